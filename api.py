@@ -1,31 +1,53 @@
+import asyncio
 import logging
 import os
-import random
 import socket
-import string
-import time
 from functools import lru_cache
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.authentication import AuthenticationMiddleware
 
 import config
-from catch_http_exceptions import catch_http_exceptions
 from connectors.pgsql import PostgreSQLConnector
+from connectors.pgsql_async import AsyncPostgreSQLConnector, build_conninfo
+from connectors.redis_pool import RedisConnector
 from dependencies import BearerTokenAuthBackend
-from metrics_middleware import MetricsMiddleware
+from metrics_middleware import (
+    record_loop_lag,
+    record_loop_stall,
+    register_cache_stats,
+    register_pool_stats,
+    register_queue_stats,
+)
+from request_pipeline import RequestPipelineMiddleware
 from routers import (
     alcohol,
     badge,
     badge_registration,
     capturetheflag,
+    debug,
     games,
     otel_test,
     secret_flag,
     tests,
 )
-from s3_logger import S3TimedRotatingFileHandler
+from s3_logger import (
+    ParquetAccessLogHandler,
+    S3TimedRotatingFileHandler,
+    start_queue_logging,
+)
+from tracing import configure_tracing
+from utilities.achievements import load_achievement_catalog
+from utilities.auth_cache import TTLCache, listen_for_invalidations
+from utilities.badge_events import BadgeEventNotifier, listen_for_badge_events
+from utilities.events import INSERT_EVENT_QUERY
+from utilities.facts import FACT_SOURCES, FactPrefetcher
+from utilities.log_policy import LogPolicyFilter, listen_for_log_policy
+from utilities.loop_monitor import LoopLagMonitor
+from utilities.process_ctf_action import CtfServices
+from utilities.profiler import ProfileSink
+from utilities.query_stats import query_stats
+from utilities.write_behind import WriteBehindBuffer
 
 logger = logging.getLogger("s3logger")
 logger.setLevel(logging.INFO)
@@ -38,10 +60,27 @@ s3_handler = S3TimedRotatingFileHandler(
     when="M",
     interval=1,
     backupCount=5,
+    endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+    max_backlog=int(os.getenv("LOG_UPLOAD_MAX_BACKLOG", "32")),
+    retries=int(os.getenv("LOG_UPLOAD_RETRIES", "3")),
 )
 formatter = logging.Formatter("[%(asctime)s.%(msecs)03d] [%(levelname)s] [%(filename)s:%(lineno)d]: %(message)s")
 s3_handler.setFormatter(formatter)
-logger.addHandler(s3_handler)
+# sampling / truncation runs before the queue handler formats anything
+logger.addFilter(LogPolicyFilter())
+# file writes, rotation and S3 shipping all happen off the request path
+log_listener = start_queue_logging(logger, s3_handler)
+
+# optional structured access log (one row per request) written as Parquet next to the text logs
+access_log_listener = None
+if os.getenv("ACCESS_LOG_PARQUET", "false").lower() == "true":
+    access_logger = logging.getLogger("accesslog")
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+    access_log_handler = ParquetAccessLogHandler(
+        os.getenv("ACCESS_LOG_DIR", "."), s3_handler.uploader, interval_seconds=int(os.getenv("ACCESS_LOG_INTERVAL_SECONDS", "300"))
+    )
+    access_log_listener = start_queue_logging(access_logger, access_log_handler)
 
 app = FastAPI()
 app.include_router(alcohol.router)
@@ -52,6 +91,7 @@ app.include_router(capturetheflag.router)
 app.include_router(secret_flag.router)
 app.include_router(otel_test.router)
 app.include_router(badge_registration.router)
+app.include_router(debug.router)
 
 
 @lru_cache()
@@ -68,51 +108,161 @@ origins = [
     "badge.cackalacky.ninja",
 ]
 
-app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.add_middleware(AuthenticationMiddleware, backend=BearerTokenAuthBackend())
-app.middleware("http")(catch_http_exceptions)
-
 skip_metrics = os.getenv("SKIP_METRICS", "False").lower() in ["true", "1", "t"]
 logger.info(f"Skip metrics? {skip_metrics}")
-if not skip_metrics:
-    app.add_middleware(MetricsMiddleware)
+
+# per-request profiling: on demand with `x-profile: $DEBUG_TOKEN`, or for PROFILE_SAMPLE_RATE of requests
+profile_token = os.getenv("DEBUG_TOKEN")
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+profile_sink = None
+if profile_token or profile_sample_rate > 0:
+    profile_uploader = s3_handler.uploader if os.getenv("PROFILE_UPLOAD", "false").lower() == "true" else None
+    profile_sink = ProfileSink(os.getenv("PROFILE_DIR", "profiles"), uploader=profile_uploader)
+
+app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(
+    RequestPipelineMiddleware,
+    backend=BearerTokenAuthBackend(),
+    record_metrics=not skip_metrics,
+    profile_sink=profile_sink,
+    profile_token=profile_token,
+    profile_sample_rate=profile_sample_rate,
+    profile_interval_seconds=int(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+)
 
 # Get the host name of the machine
 host_name = socket.gethostname()
 logger.info(f"Host name: {host_name}")
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    idem = "".join(random.choices(string.ascii_uppercase + string.digits, k=10))
-    # Log request path, headers, and query parameters
-    panda_xpress = dict(request.headers).get("panda-xpress")
-    panda_mac = dict(request.headers).get("panda-mac")
-    query_params = dict(request.query_params)
-    logger.info(
-        f"rid={idem} start request remote-ip={request.client.host} path={request.url.path} panda_xpress={panda_xpress} panda_mac={panda_mac} query_params={query_params}"
+@app.on_event("startup")
+async def startup_event():
+    configure_tracing(get_settings())
+    query_stats.configure(slow_query_ms=float(get_settings().slow_query_ms), max_statements=int(get_settings().query_stats_max_statements))
+    app.state.debug_token = get_settings().debug_token
+
+    # async handlers share the asyncio pool; plain ``def`` handlers run in the threadpool and use the sync connector
+    pgsql_db = AsyncPostgreSQLConnector()
+    await pgsql_db.connect(get_settings())
+    app.state.db = pgsql_db
+
+    pgsql_sync_db = PostgreSQLConnector()
+    pgsql_sync_db.connect(get_settings())
+    app.state.sync_db = pgsql_sync_db
+    register_pool_stats("pgsql-async", pgsql_db.stats)
+    register_pool_stats("pgsql-sync", pgsql_sync_db.stats)
+
+    settings = get_settings()
+    redis_connector = RedisConnector()
+    redis_connector.connect(settings)
+    app.state.redis = redis_connector
+    register_pool_stats("redis-async", redis_connector.stats)
+    register_pool_stats("redis-sync", redis_connector.sync_stats)
+    register_queue_stats("s3-logs", s3_handler.uploader.stats)
+
+    app.state.auth_cache = TTLCache(
+        max_entries=int(settings.auth_cache_max_entries),
+        ttl_seconds=float(settings.auth_cache_ttl_seconds),
+        negative_ttl_seconds=float(settings.auth_cache_negative_ttl_seconds),
     )
+    register_cache_stats("auth", app.state.auth_cache.stats)
+    app.state.auth_cache_listener = asyncio.create_task(listen_for_invalidations(app.state.auth_cache, redis_connector.aclient))
+    app.state.log_policy_listener = asyncio.create_task(listen_for_log_policy(redis_connector.aclient))
 
-    start_time = time.time()
-    response = await call_next(request)
-    content_length = response.headers["content-length"]
-    process_time = (time.time() - start_time) * 1000
-    formatted_process_time = "{0:.2f}".format(process_time)
-    logger.info(f"rid={idem} content_length={content_length} completed_in={formatted_process_time}ms status_code={response.status_code}")
+    # name -> WriteBehindBuffer; routers fall back to row-at-a-time inserts for names missing here
+    app.state.write_behind = {}
+    if settings.write_behind_enabled.lower() == "true":
+        for name, query, ack in (
+            ("game_score", games.INSERT_GAME_SCORE_QUERY, settings.game_score_ack),
+            ("alcohol_reading", alcohol.INSERT_ALCOHOL_READING_QUERY, settings.alcohol_reading_ack),
+        ):
+            buffer = WriteBehindBuffer(
+                pgsql_db,
+                query,
+                max_batch=int(settings.write_behind_max_batch),
+                max_delay_seconds=int(settings.write_behind_max_delay_ms) / 1000,
+                max_pending=int(settings.write_behind_max_pending),
+                durable=ack.lower() != "buffered",
+                whole_row=True,
+            )
+            buffer.start()
+            app.state.write_behind[name] = buffer
+            register_queue_stats(name, buffer.stats)
 
-    return response
+    # CTF event logging is fire-and-forget: always queued, dropped (and counted) when the queue is full
+    app.state.event_log = WriteBehindBuffer(
+        pgsql_db,
+        INSERT_EVENT_QUERY,
+        max_batch=int(settings.event_log_max_batch),
+        max_delay_seconds=int(settings.event_log_max_delay_ms) / 1000,
+        max_pending=int(settings.event_log_max_pending),
+        durable=False,
+    )
+    app.state.event_log.start()
+    register_queue_stats("events", app.state.event_log.stats)
 
+    app.state.facts = FactPrefetcher(
+        pgsql_db,
+        FACT_SOURCES[settings.fact_source],
+        size=int(settings.fact_buffer_size),
+        fetch_timeout=float(settings.fact_fetch_timeout),
+        staff_refresh_seconds=float(settings.staff_refresh_seconds),
+    )
+    app.state.facts.start()
+    register_queue_stats("facts", app.state.facts.stats)
 
-@app.on_event("startup")
-async def startup_event():
-    pgsql_db = PostgreSQLConnector()
-    pgsql_db.connect(get_settings())
-    app.state.db = pgsql_db
+    held_achievements = TTLCache(
+        max_entries=int(settings.achievement_cache_max_entries),
+        ttl_seconds=float(settings.achievement_cache_ttl_seconds),
+    )
+    register_cache_stats("achievements", held_achievements.stats)
+    app.state.ctf = CtfServices(
+        db_connection=pgsql_db,
+        event_log=app.state.event_log,
+        facts=app.state.facts,
+        catalog=await load_achievement_catalog(pgsql_db),
+        held_achievements=held_achievements,
+    )
+
+    app.state.badge_event_notifier = BadgeEventNotifier()
+    app.state.badge_event_max_wait_seconds = float(settings.badge_event_max_wait_seconds)
+    app.state.badge_event_keepalive_seconds = float(settings.badge_event_keepalive_seconds)
+    app.state.badge_event_listener = asyncio.create_task(listen_for_badge_events(app.state.badge_event_notifier, build_conninfo(settings)))
+
+    app.state.loop_monitor = LoopLagMonitor(
+        interval_seconds=int(settings.loop_lag_interval_ms) / 1000,
+        block_threshold_seconds=int(settings.loop_block_threshold_ms) / 1000,
+        capture_stacks=settings.loop_watchdog_enabled.lower() == "true",
+        record_lag=None if skip_metrics else record_loop_lag,
+        record_stall=None if skip_metrics else record_loop_stall,
+    )
+    app.state.loop_monitor.start()
     logger.info(f"Starting badge api.py - {os.getenv('APP_NAME')} | {os.getenv('APP_ENV')}")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    if not app.state.db:
+    for listener in ("auth_cache_listener", "log_policy_listener", "badge_event_listener"):
+        task = getattr(app.state, listener, None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if getattr(app.state, "loop_monitor", None):
+        await app.state.loop_monitor.close()
+    if getattr(app.state, "facts", None):
+        await app.state.facts.close()
+    # flush buffered writes while the db and redis (used by their after-commit hooks) are still open
+    for buffer in getattr(app.state, "write_behind", {}).values():
+        await buffer.close()
+    if getattr(app.state, "event_log", None):
+        await app.state.event_log.close()
+    if getattr(app.state, "redis", None):
+        await app.state.redis.close()
+    if getattr(app.state, "db", None):
         await app.state.db.close()
+    if getattr(app.state, "sync_db", None):
+        app.state.sync_db.close()
     logger.info("Server Shutdown")
+    log_listener.stop()
+    if access_log_listener:
+        access_log_listener.stop()
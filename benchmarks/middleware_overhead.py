@@ -0,0 +1,136 @@
+"""Per-request middleware overhead on ``/ping``: the old middleware stack vs ``RequestPipelineMiddleware``.
+
+Both apps serve the real ``/ping`` route in-process through ``httpx.ASGITransport`` (no sockets),
+so the difference is middleware cost. ``legacy`` rebuilds the previous stack: CORS, Starlette's
+``AuthenticationMiddleware``, the error-mapping and access-log function middlewares and a
+``BaseHTTPMiddleware`` metrics layer. Pass ``--metrics`` to record OTel instruments in both.
+Both stacks write the same two access lines per request to ``s3logger``; pass ``--log-level INFO``
+to include the cost of emitting them (the default WARNING only pays for the filtered calls).
+
+    SKIP_METRICS=True python -m benchmarks.middleware_overhead --requests 5000
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.authentication import AuthenticationMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from catch_http_exceptions import exception_response
+from dependencies import BearerTokenAuthBackend
+from metrics_middleware import (
+    active_requests,
+    host_name,
+    path_requests_count,
+    request_counter,
+    requests_latency,
+)
+from request_pipeline import RequestPipelineMiddleware, new_request_id
+from routers import tests
+
+ORIGINS = ["http://localhost"]
+
+logger = logging.getLogger("s3logger")
+
+
+def base_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(tests.router)
+    return app
+
+
+def legacy_app(record_metrics: bool) -> FastAPI:
+    app = base_app()
+    app.add_middleware(CORSMiddleware, allow_origins=ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    app.add_middleware(AuthenticationMiddleware, backend=BearerTokenAuthBackend())
+
+    @app.middleware("http")
+    async def catch_http_exceptions(request: Request, call_next):
+        try:
+            return await call_next(request)
+        except Exception as exc:
+            response = exception_response(exc)
+            if response is None:
+                raise
+            return response
+
+    if record_metrics:
+
+        class MetricsMiddleware(BaseHTTPMiddleware):
+            async def dispatch(self, request: Request, call_next):
+                start_time = time.time()
+                active_requests.add(1, {"host": host_name})
+                try:
+                    return await call_next(request)
+                finally:
+                    requests_latency.record(time.time() - start_time, {"host": host_name})
+                    request_counter.add(1, {"host": host_name})
+                    path_requests_count.add(1, {"host": host_name, "path": request.url.path})
+                    active_requests.add(-1, {"host": host_name})
+
+        app.add_middleware(MetricsMiddleware)
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        idem = new_request_id()
+        panda_xpress = dict(request.headers).get("panda-xpress")
+        panda_mac = dict(request.headers).get("panda-mac")
+        query_params = dict(request.query_params)
+        logger.info(
+            f"rid={idem} start request remote-ip={request.client.host} path={request.url.path} panda_xpress={panda_xpress} panda_mac={panda_mac} query_params={query_params}"
+        )
+
+        start_time = time.time()
+        response = await call_next(request)
+        content_length = response.headers["content-length"]
+        process_time = (time.time() - start_time) * 1000
+        formatted_process_time = "{0:.2f}".format(process_time)
+        logger.info(f"rid={idem} content_length={content_length} completed_in={formatted_process_time}ms status_code={response.status_code}")
+        return response
+
+    return app
+
+
+def pipeline_app(record_metrics: bool) -> FastAPI:
+    app = base_app()
+    app.add_middleware(CORSMiddleware, allow_origins=ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    app.add_middleware(RequestPipelineMiddleware, backend=BearerTokenAuthBackend(), record_metrics=record_metrics)
+    return app
+
+
+async def measure(app: FastAPI, requests: int):
+    timings = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for _ in range(100):
+            await client.get("/ping")
+        for _ in range(requests):
+            start = time.perf_counter()
+            await client.get("/ping")
+            timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+
+async def main(args):
+    logging.basicConfig(level=args.log_level, handlers=[logging.NullHandler()])
+    results = {}
+    for name, app in (("bare", base_app()), ("legacy", legacy_app(args.metrics)), ("pipeline", pipeline_app(args.metrics))):
+        timings = await measure(app, args.requests)
+        timings.sort()
+        results[name] = statistics.mean(timings)
+        print(f"{name:9} mean {results[name]:7.1f}us  p50 {timings[len(timings) // 2]:7.1f}us  p99 {timings[int(len(timings) * 0.99)]:7.1f}us")
+    for name in ("legacy", "pipeline"):
+        print(f"{name:9} middleware overhead ~{results[name] - results['bare']:.1f}us/request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--metrics", action="store_true")
+    parser.add_argument("--log-level", default="WARNING", choices=["INFO", "WARNING"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+"""Throughput of the sync vs asyncio PostgreSQL paths under concurrent badge traffic.
+
+Simulates ``--badges`` badges each issuing ``--requests`` lookups from ``async def``
+handlers, the way the routers do. The sync path calls ``PostgreSQLConnector`` straight
+from the coroutine (blocking the loop, as the handlers used to); the async path awaits
+``AsyncPostgreSQLConnector``. Uses the same ``PG_DB_*`` environment as the API.
+
+    python -m benchmarks.pgsql_concurrency --badges 200 --requests 5 --query-ms 5
+"""
+
+import argparse
+import asyncio
+import time
+
+import config
+from connectors.pgsql import PostgreSQLConnector
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+
+QUERY = "select pg_sleep(%(delay)s), * from users where uuid = %(uuid)s and mac_address = %(mac_address)s"
+
+
+async def run_sync(db: PostgreSQLConnector, badges: int, requests: int, delay: float) -> float:
+    async def badge(n: int):
+        for _ in range(requests):
+            db.select(QUERY, {"delay": delay, "uuid": f"bench-{n}", "mac_address": "00:00:00:00:00:00"})
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(badge(n) for n in range(badges)))
+    return time.perf_counter() - start
+
+
+async def run_async(db: AsyncPostgreSQLConnector, badges: int, requests: int, delay: float) -> float:
+    async def badge(n: int):
+        for _ in range(requests):
+            await db.select(QUERY, {"delay": delay, "uuid": f"bench-{n}", "mac_address": "00:00:00:00:00:00"})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(badge(n) for n in range(badges)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    settings = config.SettingsFromEnvironment()
+    total = args.badges * args.requests
+    delay = args.query_ms / 1000
+
+    sync_db = PostgreSQLConnector()
+    sync_db.connect(settings)
+    elapsed = await run_sync(sync_db, args.badges, args.requests, delay)
+    print(f"sync   {total} queries in {elapsed:.2f}s -> {total / elapsed:.0f} req/s")
+    sync_db.close()
+
+    async_db = AsyncPostgreSQLConnector()
+    await async_db.connect(settings)
+    elapsed = await run_async(async_db, args.badges, args.requests, delay)
+    print(f"async  {total} queries in {elapsed:.2f}s -> {total / elapsed:.0f} req/s")
+    await async_db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--badges", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--query-ms", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
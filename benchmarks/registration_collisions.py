@@ -0,0 +1,58 @@
+"""Collision stress test for badge registration code allocation.
+
+Runs ``--badges`` concurrent allocations against a local redis (the ``redis-container``
+from the README; point REDIS_HOST at it) with deliberately short codes so collisions
+are frequent, then checks that no two badges were handed the same code and reports how
+many attempts were needed. Uses a scratch logical db which is flushed before and after.
+
+    REDIS_HOST=localhost python -m benchmarks.registration_collisions --badges 2000 --code-length 3
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import redis.asyncio as aioredis
+
+from routers.badge import generate_short_hash, try_allocate_registration_code
+
+
+async def allocate_counting(rd_con: aioredis.Redis, uuid: str, mac: str, code_length: int):
+    attempts = 0
+    while True:
+        attempts += 1
+        code = await try_allocate_registration_code(rd_con, uuid, mac, generate_short_hash(uuid, mac, code_length))
+        if code is not None:
+            return code, attempts
+
+
+async def main(args):
+    rd_con = aioredis.Redis(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")), db=args.db)
+    await rd_con.flushdb()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(allocate_counting(rd_con, f"stress-{n}", "00:00:00:00:00:00", args.code_length) for n in range(args.badges)))
+    elapsed = time.perf_counter() - start
+
+    codes = [code for code, _ in results]
+    attempts = sum(attempts for _, attempts in results)
+    # a second allocation for the same badge must hand back the same code
+    again, _ = await allocate_counting(rd_con, "stress-0", "00:00:00:00:00:00", args.code_length)
+
+    print(f"{args.badges} badges, {16 ** args.code_length} possible codes, {elapsed:.2f}s")
+    print(f"unique codes: {len(set(codes))} / {len(codes)}")
+    print(f"attempts: {attempts} ({(attempts - len(codes)) / attempts:.1%} collided)")
+    print(f"re-allocation stable: {again == codes[0]}")
+
+    await rd_con.flushdb()
+    await rd_con.aclose()
+    assert len(set(codes)) == len(codes) and again == codes[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--badges", type=int, default=2000)
+    parser.add_argument("--code-length", type=int, default=3)
+    parser.add_argument("--db", type=int, default=15)
+    asyncio.run(main(parser.parse_args()))
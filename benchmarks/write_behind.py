@@ -0,0 +1,66 @@
+"""Insert throughput: row-at-a-time ``INSERT ... RETURNING id`` vs the write-behind buffer.
+
+``--writers`` concurrent writers each insert ``--rows`` rows into a scratch table shaped
+like ``alcohol_reading`` (created and dropped by the script), first one statement and commit per
+row the way ``insert_alcohol_reading`` does by default, then through ``WriteBehindBuffer`` in
+durable and buffered mode. Uses the same ``PG_DB_*`` environment as the API.
+
+    python -m benchmarks.write_behind --writers 100 --rows 50 --max-batch 100 --max-delay-ms 20
+"""
+
+import argparse
+import asyncio
+import time
+
+import config
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.write_behind import WriteBehindBuffer
+
+TABLE = "bench_write_behind"
+INSERT_QUERY = f"INSERT INTO {TABLE} (user_uuid, reading) VALUES (%(uuid)s, %(reading)s) RETURNING id;"
+
+
+async def run(writers: int, rows: int, write) -> float:
+    async def writer(n: int):
+        for i in range(rows):
+            await write({"uuid": f"bench-{n}", "reading": i})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    db = AsyncPostgreSQLConnector()
+    await db.connect(config.SettingsFromEnvironment())
+    await db.execute(
+        f"DROP TABLE IF EXISTS {TABLE}; CREATE TABLE {TABLE} (id serial PRIMARY KEY, user_uuid text, reading numeric, created_at timestamptz DEFAULT now());"
+    )
+    total = args.writers * args.rows
+
+    try:
+        elapsed = await run(args.writers, args.rows, lambda params: db.execute(INSERT_QUERY, params))
+        print(f"row-at-a-time  {total} rows in {elapsed:.2f}s -> {total / elapsed:.0f} rows/s")
+
+        for durable in (True, False):
+            buffer = WriteBehindBuffer(db, INSERT_QUERY, max_batch=args.max_batch, max_delay_seconds=args.max_delay_ms / 1000, durable=durable)
+            buffer.start()
+            start = time.perf_counter()
+            await run(args.writers, args.rows, buffer.write)
+            acked = time.perf_counter() - start
+            await buffer.close()
+            elapsed = time.perf_counter() - start
+            mode = "durable " if durable else "buffered"
+            print(f"{mode}       {total} rows in {elapsed:.2f}s -> {total / elapsed:.0f} rows/s (acked in {acked:.2f}s, {buffer.stats()})")
+    finally:
+        await db.execute(f"DROP TABLE IF EXISTS {TABLE};")
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument("--max-delay-ms", type=float, default=20.0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,10 +1,16 @@
-from fastapi import HTTPException, Request
+from typing import Optional
+
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
+from starlette.responses import Response
+
+from connectors.pool import PoolAcquireTimeout
 
 
-async def catch_http_exceptions(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except HTTPException as ex:
-        return JSONResponse(content={"detail": ex.detail}, status_code=ex.status_code)
+def exception_response(exc: Exception) -> Optional[Response]:
+    """The response for an exception that escaped the routers, or ``None`` if it isn't one we map."""
+    if isinstance(exc, HTTPException):
+        return JSONResponse(content={"detail": exc.detail}, status_code=exc.status_code, headers=getattr(exc, "headers", None))
+    if isinstance(exc, PoolAcquireTimeout):
+        return JSONResponse(content={"detail": "Database is busy, try again shortly."}, status_code=503)
+    return None
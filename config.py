@@ -16,3 +16,42 @@ class SettingsFromEnvironment(BaseSettings):
     db_port: str = os.getenv("PG_DB_PORT")
     db_database: str = os.getenv("PG_DB_DATABASE")
     db_connection_limit: str = os.getenv("PG_DB_CONNECTION_LIMIT")
+    db_acquire_timeout: str = os.getenv("PG_DB_ACQUIRE_TIMEOUT", "5")
+    db_max_waiters: str = os.getenv("PG_DB_MAX_WAITERS", "64")
+    db_idle_check_seconds: str = os.getenv("PG_DB_IDLE_CHECK_SECONDS", "30")
+    auth_cache_max_entries: str = os.getenv("AUTH_CACHE_MAX_ENTRIES", "4096")
+    auth_cache_ttl_seconds: str = os.getenv("AUTH_CACHE_TTL_SECONDS", "300")
+    auth_cache_negative_ttl_seconds: str = os.getenv("AUTH_CACHE_NEGATIVE_TTL_SECONDS", "15")
+    redis_host: str = os.getenv("REDIS_HOST")
+    redis_port: str = os.getenv("REDIS_PORT", "6379")
+    redis_db: str = os.getenv("REDIS_DB", "0")
+    redis_max_connections: str = os.getenv("REDIS_MAX_CONNECTIONS", "50")
+    redis_pool_timeout: str = os.getenv("REDIS_POOL_TIMEOUT", "5")
+    redis_socket_timeout: str = os.getenv("REDIS_SOCKET_TIMEOUT", "5")
+    redis_socket_connect_timeout: str = os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "2")
+    write_behind_enabled: str = os.getenv("WRITE_BEHIND_ENABLED", "false")
+    write_behind_max_batch: str = os.getenv("WRITE_BEHIND_MAX_BATCH", "100")
+    write_behind_max_delay_ms: str = os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "50")
+    write_behind_max_pending: str = os.getenv("WRITE_BEHIND_MAX_PENDING", "10000")
+    game_score_ack: str = os.getenv("GAME_SCORE_ACK", "durable")
+    alcohol_reading_ack: str = os.getenv("ALCOHOL_READING_ACK", "durable")
+    event_log_max_batch: str = os.getenv("EVENT_LOG_MAX_BATCH", "200")
+    event_log_max_delay_ms: str = os.getenv("EVENT_LOG_MAX_DELAY_MS", "200")
+    event_log_max_pending: str = os.getenv("EVENT_LOG_MAX_PENDING", "10000")
+    fact_source: str = os.getenv("FACT_SOURCE", "remote")
+    fact_buffer_size: str = os.getenv("FACT_BUFFER_SIZE", "8")
+    fact_fetch_timeout: str = os.getenv("FACT_FETCH_TIMEOUT", "3")
+    staff_refresh_seconds: str = os.getenv("STAFF_REFRESH_SECONDS", "300")
+    achievement_cache_max_entries: str = os.getenv("ACHIEVEMENT_CACHE_MAX_ENTRIES", "4096")
+    achievement_cache_ttl_seconds: str = os.getenv("ACHIEVEMENT_CACHE_TTL_SECONDS", "600")
+    badge_event_max_wait_seconds: str = os.getenv("BADGE_EVENT_MAX_WAIT_SECONDS", "25")
+    badge_event_keepalive_seconds: str = os.getenv("BADGE_EVENT_KEEPALIVE_SECONDS", "15")
+    slow_query_ms: str = os.getenv("SLOW_QUERY_MS", "100")
+    query_stats_max_statements: str = os.getenv("QUERY_STATS_MAX_STATEMENTS", "500")
+    debug_token: str = os.getenv("DEBUG_TOKEN")
+    loop_lag_interval_ms: str = os.getenv("LOOP_LAG_INTERVAL_MS", "500")
+    loop_block_threshold_ms: str = os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")
+    loop_watchdog_enabled: str = os.getenv("LOOP_WATCHDOG_ENABLED", "false")
+    otel_collector_svc: str = os.getenv("OTEL_COLLECTOR_SVC")
+    trace_exporter: str = os.getenv("TRACE_EXPORTER", "otlp" if os.getenv("OTEL_COLLECTOR_SVC") else "none")
+    trace_sample_ratio: str = os.getenv("TRACE_SAMPLE_RATIO", "0.05")
@@ -1,10 +1,12 @@
 import logging
-from typing import Any, Dict
+import time
+from typing import Any, Callable, Dict, List, Optional
 
-import pandas as pd
-from psycopg2 import DatabaseError, pool
+from psycopg2 import DatabaseError
 
 import config
+from connectors.pool import BoundedConnectionPool
+from utilities.query_stats import QueryObservation, observe_query
 
 logger = logging.getLogger('s3logger')
 
@@ -29,18 +31,30 @@ class PostgreSQLConnector:
     def connect(self, settings: config.SettingsFromEnvironment):
         if self.__pgconn is None:
             try:
-                self.__pgconn = pool.SimpleConnectionPool(1, int(settings.db_connection_limit),
-                                                          host=settings.db_host,
-                                                          database=settings.db_database,
-                                                          user=settings.db_user,
-                                                          port=settings.db_port,
-                                                          password=settings.db_password)
+                self.__pgconn = BoundedConnectionPool(1, int(settings.db_connection_limit),
+                                                      acquire_timeout=float(settings.db_acquire_timeout),
+                                                      max_waiters=int(settings.db_max_waiters),
+                                                      idle_check_seconds=float(settings.db_idle_check_seconds),
+                                                      host=settings.db_host,
+                                                      database=settings.db_database,
+                                                      user=settings.db_user,
+                                                      port=settings.db_port,
+                                                      password=settings.db_password)
                 logger.info(f"Connection Pool Size - {self.__pgconn.minconn}-{self.__pgconn.maxconn}")
 
             except Exception as e:
                 logger.error(e)
                 raise PostgreSQLConnectionError(e)
 
+    def close(self):
+        if self.__pgconn is not None:
+            self.__pgconn.closeall()
+            self.__pgconn = None
+            logger.info("PostgreSQL pool is closed")
+
+    def stats(self) -> Dict[str, Any]:
+        return self.__pgconn.stats() if self.__pgconn is not None else {}
+
     def release_resources(self, connection_object=None, cursor=None):
         try:
             if cursor:
@@ -54,6 +68,13 @@ class PostgreSQLConnector:
             logger.error("Issue closing cursor or connection")
             logger.error(e)
 
+    def _getconn(self, observed: QueryObservation):
+        acquire_start = time.monotonic()
+        try:
+            return self.__pgconn.getconn()
+        finally:
+            observed.add_pool_wait((time.monotonic() - acquire_start) * 1000)
+
     def execute(self, query: str, args: Dict[str, Any] = None):
         available_calls = self._retries
         connection_object = None
@@ -62,49 +83,83 @@ class PostgreSQLConnector:
         logger.info(query)
         logger.info(args)
 
-        while available_calls >= 0:
-            ret_val = None
-            try:
-                # Get connection object from a pool
-                connection_object = self.__pgconn.getconn()
-                cursor = connection_object.cursor()
-            except DatabaseError as e:
-                logger.error("Error while connecting to PostgreSQL using Connection pool", e)
-                self.release_resources(connection_object, cursor)
-                available_calls -= 1
-
-            try:
-                cursor.execute(query, args)
-                connection_object.commit()
-
-                if "insert into" in query.lower():
-                    logger.info(cursor)
-                    ret_val = cursor.fetchone()[0]
-
-                self.release_resources(connection_object, cursor)
-                return ret_val
-            except Exception as e:
-                self.release_resources(connection_object, cursor)
-                logger.error(e)
-                available_calls -= 1
-
-    def select_dataframe(self, query: str, args: Dict[str, Any] = None) -> pd.DataFrame:
+        with observe_query(query, args) as observed:
+            while available_calls >= 0:
+                # reset every attempt: the previous connection is already back in the pool and must not be returned twice
+                connection_object, cursor = None, None
+                ret_val = None
+                try:
+                    # Get connection object from a pool
+                    connection_object = self._getconn(observed)
+                    cursor = connection_object.cursor()
+                    cursor.execute(query, args)
+                    connection_object.commit()
+                    observed.set_rows(cursor.rowcount)
+
+                    if "insert into" in query.lower():
+                        logger.info(cursor)
+                        ret_val = cursor.fetchone()[0]
+
+                    return ret_val
+                except Exception as e:
+                    if connection_object is None and not isinstance(e, DatabaseError):
+                        # e.g. the pool timed out; retrying would only wait again
+                        raise
+                    logger.error(f"Error while executing on PostgreSQL using Connection pool: {e}")
+                    observed.record_exception(e)
+                    available_calls -= 1
+                finally:
+                    # every exit path hands the connection back, or the pool shrinks for good
+                    self.release_resources(connection_object, cursor)
+
+            observed.failed = True
+
+    def _fetch(self, query: str, args: Optional[Dict[str, Any]], row_type: Optional[Callable[..., Any]], fetch: str):
         available_calls = self._retries
         connection_object = None
+        cursor = None
 
         logger.info(query)
         logger.info(args)
 
-        while available_calls >= 0:
-            try:
-                # Get connection object from a pool
-                connection_object = self.__pgconn.getconn()
-
-                data = pd.read_sql_query(sql=query, con=connection_object, params=args)
-                self.release_resources(connection_object)
-                return data
-
-            except DatabaseError as e:
-                logger.error("Error while connecting to PostgreSQL using Connection pool", e)
-                self.release_resources(connection_object)
-                available_calls -= 1
+        with observe_query(query, args) as observed:
+            while available_calls >= 0:
+                connection_object, cursor = None, None
+                try:
+                    # Get connection object from a pool
+                    connection_object = self._getconn(observed)
+                    cursor = connection_object.cursor()
+                    cursor.execute(query, args)
+                    rows = cursor.fetchmany(1) if fetch == "one" else cursor.fetchall()
+                    observed.set_rows(rows)
+
+                    if row_type is not None:
+                        columns = [column.name for column in cursor.description]
+                        rows = [row_type(**dict(zip(columns, row))) for row in rows]
+
+                    return rows
+
+                except DatabaseError as e:
+                    logger.error(f"Error while selecting from PostgreSQL using Connection pool: {e}")
+                    observed.record_exception(e)
+                    available_calls -= 1
+                finally:
+                    # every exit path (including a row_type mismatch or an InterfaceError) hands the connection back
+                    self.release_resources(connection_object, cursor)
+
+            observed.failed = True
+            return []
+
+    def select_rows(self, query: str, args: Dict[str, Any] = None, row_type: Optional[Callable[..., Any]] = None) -> List[Any]:
+        """Rows straight from the cursor: tuples, or ``row_type(**columns)`` (e.g. a slotted dataclass) when given."""
+        return self._fetch(query, args, row_type, fetch="all")
+
+    def select_one(self, query: str, args: Dict[str, Any] = None, row_type: Optional[Callable[..., Any]] = None) -> Optional[Any]:
+        rows = self._fetch(query, args, row_type, fetch="one")
+        return rows[0] if rows else None
+
+    def select(self, query: str, args: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        return self.select_rows(query, args, row_type=dict)
+
+    def fetch_one(self, query: str, args: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        return self.select_one(query, args, row_type=dict)
@@ -0,0 +1,214 @@
+import logging
+import time
+import weakref
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg import OperationalError
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import class_row, dict_row, tuple_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+import config
+from connectors.pool import PoolAcquireTimeout, RecentWaits
+from utilities.query_stats import QueryObservation, observe_query
+
+logger = logging.getLogger("s3logger")
+
+
+class AsyncPostgreSQLConnectionError(Exception):
+    pass
+
+
+def build_conninfo(settings: config.SettingsFromEnvironment) -> str:
+    return make_conninfo(
+        host=settings.db_host,
+        dbname=settings.db_database,
+        user=settings.db_user,
+        port=settings.db_port,
+        password=settings.db_password,
+    )
+
+
+class AsyncPostgreSQLConnector:
+    """asyncio-native counterpart of ``PostgreSQLConnector``.
+
+    Backed by a psycopg 3 ``AsyncConnectionPool`` so waiting on the database yields
+    the event loop instead of stalling every other request on the worker. Acquiring
+    a connection is bounded by ``settings.db_acquire_timeout``; when the pool stays
+    exhausted past that deadline ``PoolAcquireTimeout`` is raised.
+
+    Like ``BoundedConnectionPool``, connections idle for ``settings.db_idle_check_seconds`` are pinged
+    on checkout (the pool replaces them if the ping fails). Statements are only retried when they
+    could not be sent; once ``execute`` has been called a failure is raised, because a write such as
+    ``INSERT ... RETURNING id`` may already have been applied.
+    """
+
+    def __init__(self):
+        self._retries = 3
+        self._pool: Optional[AsyncConnectionPool] = None
+        self._idle_check_seconds = 30.0
+        self._returned_at: "weakref.WeakKeyDictionary[Any, float]" = weakref.WeakKeyDictionary()
+        self._recent_waits = RecentWaits()
+
+    async def _mark_returned(self, connection_object):
+        self._returned_at[connection_object] = time.monotonic()
+
+    async def _check_idle(self, connection_object):
+        returned_at = self._returned_at.get(connection_object)
+        if returned_at is not None and time.monotonic() - returned_at >= self._idle_check_seconds:
+            await AsyncConnectionPool.check_connection(connection_object)
+
+    async def connect(self, settings: config.SettingsFromEnvironment):
+        if self._pool is None:
+            try:
+                conninfo = build_conninfo(settings)
+                acquire_timeout = float(settings.db_acquire_timeout)
+                self._idle_check_seconds = float(settings.db_idle_check_seconds)
+                self._pool = AsyncConnectionPool(
+                    conninfo,
+                    min_size=1,
+                    max_size=int(settings.db_connection_limit),
+                    timeout=acquire_timeout,
+                    check=self._check_idle,
+                    reset=self._mark_returned,
+                    open=False,
+                )
+                await self._pool.open(wait=True, timeout=acquire_timeout)
+                logger.info(f"Async Connection Pool Size - {self._pool.min_size}-{self._pool.max_size}")
+
+            except Exception as e:
+                logger.error(e)
+                raise AsyncPostgreSQLConnectionError(e)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logger.info("PostgreSQL async pool is closed")
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool saturation in the same shape as ``BoundedConnectionPool.stats``."""
+        if self._pool is None:
+            return {}
+        pool_stats = self._pool.get_stats()
+        size = pool_stats.get("pool_size", 0)
+        available = pool_stats.get("pool_available", 0)
+        return {
+            "in_use": size - available,
+            "idle": available,
+            "waiters": pool_stats.get("requests_waiting", 0),
+            "wait_ms": self._recent_waits.mean_ms(),
+        }
+
+    async def _acquire(self, stack: AsyncExitStack, observed: QueryObservation):
+        """Check a connection out for the life of ``stack``; the wait goes to the pool stats and the statement's observation."""
+        acquire_start = time.monotonic()
+        try:
+            connection_object = await stack.enter_async_context(self._pool.connection())
+        finally:
+            wait_ms = (time.monotonic() - acquire_start) * 1000
+            observed.add_pool_wait(wait_ms)
+        self._recent_waits.record(wait_ms)
+        return connection_object
+
+    async def _run(self, query: str, args: Optional[Dict[str, Any]], fetch: str, row_factory=dict_row):
+        available_calls = self._retries
+
+        with observe_query(query, args) as observed:
+            while True:
+                sent = False
+                try:
+                    async with AsyncExitStack() as stack:
+                        connection_object = await self._acquire(stack, observed)
+                        async with connection_object.cursor(row_factory=row_factory) as cursor:
+                            sent = True
+                            await cursor.execute(query, args)
+                            observed.set_rows(cursor.rowcount)
+                            if cursor.description is None:
+                                return None
+                            if fetch == "one":
+                                return await cursor.fetchone()
+                            return await cursor.fetchall()
+
+                except PoolTimeout as e:
+                    logger.error(f"Timed out waiting for a PostgreSQL connection: {e}")
+                    raise PoolAcquireTimeout(e)
+                except OperationalError as e:
+                    # the pool discards broken connections on release, so a retry gets a fresh one; but once the
+                    # statement may have reached the server it is not retried, or a write could be applied twice
+                    logger.error(f"Error while talking to PostgreSQL using Connection pool: {e}")
+                    observed.record_exception(e)
+                    available_calls -= 1
+                    if sent or available_calls < 0:
+                        raise
+
+    async def select(self, query: str, args: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        logger.info(query)
+        logger.info(args)
+
+        rows = await self._run(query, args, fetch="all")
+        return rows or []
+
+    async def fetch_one(self, query: str, args: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        logger.info(query)
+        logger.info(args)
+
+        return await self._run(query, args, fetch="one")
+
+    async def select_rows(self, query: str, args: Dict[str, Any] = None, row_type: Optional[Callable[..., Any]] = None) -> List[Any]:
+        """Rows straight from the cursor: tuples, or ``row_type(**columns)`` (e.g. a slotted dataclass) when given."""
+        logger.info(query)
+        logger.info(args)
+
+        rows = await self._run(query, args, fetch="all", row_factory=class_row(row_type) if row_type else tuple_row)
+        return rows or []
+
+    async def select_one(self, query: str, args: Dict[str, Any] = None, row_type: Optional[Callable[..., Any]] = None) -> Optional[Any]:
+        logger.info(query)
+        logger.info(args)
+
+        return await self._run(query, args, fetch="one", row_factory=class_row(row_type) if row_type else tuple_row)
+
+    async def execute(self, query: str, args: Dict[str, Any] = None, whole_row: bool = False):
+        """Run a write statement; returns the first column of the first returned row (e.g. ``RETURNING id``).
+
+        With ``whole_row`` the entire returned row comes back as a tuple, e.g. ``RETURNING id, score`` as ``(id, score)``.
+        """
+        logger.info(query)
+        logger.info(args)
+
+        row = await self._run(query, args, fetch="one", row_factory=tuple_row if whole_row else dict_row)
+        if not row:
+            return None
+        if whole_row:
+            return row
+        return next(iter(row.values()))
+
+    async def execute_many(self, query: str, args_list: List[Dict[str, Any]], whole_row: bool = False) -> List[Any]:
+        """Run one write statement per ``args`` in a single pipelined round trip and transaction.
+
+        Returns, in input order, the first column of each statement's returned row, or the whole row as a tuple with
+        ``whole_row`` (``None`` when it returned nothing).
+        """
+        logger.info(query)
+        logger.info(f"{len(args_list)} rows")
+
+        try:
+            with observe_query(query, args_list) as observed:
+                observed.span.set_attribute("db.batch_size", len(args_list))
+                async with AsyncExitStack() as stack:
+                    connection_object = await self._acquire(stack, observed)
+                    async with connection_object.cursor(row_factory=tuple_row) as cursor:
+                        await cursor.executemany(query, args_list, returning=True)
+                        results = []
+                        while True:
+                            row = await cursor.fetchone() if cursor.description is not None else None
+                            results.append((row if whole_row else row[0]) if row else None)
+                            if not cursor.nextset():
+                                break
+                        observed.set_rows(sum(result is not None for result in results))
+                        return results
+        except PoolTimeout as e:
+            logger.error(f"Timed out waiting for a PostgreSQL connection: {e}")
+            raise PoolAcquireTimeout(e)
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Set
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger("s3logger")
+
+
+class PoolAcquireTimeout(Exception):
+    pass
+
+
+class RecentWaits:
+    """Mean time to acquire a connection over the last ``window_seconds``, for the ``db_pool_wait_ms`` gauge.
+
+    Shared by both postgres pools so the gauge means the same thing for each; it drops back to 0 once
+    the pool has been quiet for a window. Read from the metrics export thread, so it takes a lock.
+    """
+
+    def __init__(self, window_seconds: float = 60, max_samples: int = 4096):
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=max_samples)  # (monotonic time, wait ms) pairs, oldest first
+        self._lock = threading.Lock()
+
+    def record(self, wait_ms: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), wait_ms))
+
+    def mean_ms(self) -> float:
+        horizon = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < horizon:
+                self._samples.popleft()
+            if not self._samples:
+                return 0.0
+            return sum(wait_ms for _, wait_ms in self._samples) / len(self._samples)
+
+
+class BoundedConnectionPool:
+    """Thread-safe psycopg2 pool for handlers running in Starlette's threadpool.
+
+    Unlike ``psycopg2.pool.SimpleConnectionPool`` callers wait for a free connection
+    instead of failing outright. At most ``max_waiters`` threads queue up, each for
+    at most ``acquire_timeout`` seconds, before ``PoolAcquireTimeout`` is raised.
+    Connections that sat idle longer than ``idle_check_seconds`` are pinged before
+    being handed out and replaced if the ping fails.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, acquire_timeout: float = 5, max_waiters: int = 64, idle_check_seconds: float = 30, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_waiters = max_waiters
+        self.idle_check_seconds = idle_check_seconds
+        self._kwargs = kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, returned_at) pairs, most recently used last
+        self._in_use = 0
+        self._checked_out: Set[int] = set()  # id() of every connection handed out and not yet returned
+        self._waiters = 0
+        self._recent_waits = RecentWaits()
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self._kwargs)
+
+    def _is_healthy(self, connection_object, returned_at: float) -> bool:
+        if connection_object.closed:
+            return False
+        if time.monotonic() - returned_at < self.idle_check_seconds:
+            return True
+        try:
+            with connection_object.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection_object.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.info(f"Discarding stale pooled connection: {e}")
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        connection_object, returned_at = None, None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolAcquireTimeout("connection pool is closed")
+                if self._idle:
+                    connection_object, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.maxconn:
+                    break
+                if self._waiters >= self.max_waiters:
+                    raise PoolAcquireTimeout(f"{self._waiters} threads already waiting for a connection")
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolAcquireTimeout(f"no connection available after {self.acquire_timeout}s")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+            # reserve the slot before connecting / health checking outside the lock
+            self._in_use += 1
+            self._recent_waits.record((time.monotonic() - start) * 1000)
+
+        try:
+            if connection_object is not None and not self._is_healthy(connection_object, returned_at):
+                self._discard(connection_object)
+                connection_object = None
+            if connection_object is None:
+                connection_object = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checked_out.add(id(connection_object))
+        return connection_object
+
+    def putconn(self, connection_object, close: bool = False):
+        """Return a connection from ``getconn``; unknown or already returned connections are ignored."""
+        with self._cond:
+            if id(connection_object) not in self._checked_out:
+                logger.error("Ignoring putconn for a connection that is not checked out from this pool")
+                return
+            self._checked_out.discard(id(connection_object))
+
+        keep = not close and not self._closed and not connection_object.closed
+        if keep:
+            status = connection_object.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection_object.rollback()
+                except psycopg2.Error:
+                    keep = False
+
+        if not keep:
+            self._discard(connection_object)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((connection_object, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, connection_object):
+        try:
+            connection_object.close()
+        except Exception as e:
+            logger.error(f"Issue closing pooled connection: {e}")
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+        for connection_object, _ in idle:
+            self._discard(connection_object)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "wait_ms": self._recent_waits.mean_ms(),
+            }
@@ -0,0 +1,102 @@
+import logging
+from typing import Any, Dict, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+import config
+from tracing import redis_span
+
+logger = logging.getLogger("s3logger")
+
+
+class RedisConnectionError(Exception):
+    pass
+
+
+class TracedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        with redis_span([args for args, _ in self.command_stack], pipeline=True):
+            return super().execute(raise_on_error)
+
+
+class TracedRedis(redis.Redis):
+    """``redis.Redis`` with a span per command and per pipeline; pub/sub connections are left untraced."""
+
+    def execute_command(self, *args, **options):
+        with redis_span([args]):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> TracedPipeline:
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncTracedPipeline(aioredis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with redis_span([args for args, _ in self.command_stack], pipeline=True):
+            return await super().execute(raise_on_error)
+
+
+class AsyncTracedRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        with redis_span([args]):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> AsyncTracedPipeline:
+        return AsyncTracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class RedisConnector:
+    """Application-scoped Redis pools, created once at startup.
+
+    ``aclient`` (redis.asyncio) is what ``async def`` handlers should use; ``client`` is the
+    blocking variant for plain ``def`` handlers running in the threadpool. Both pools block
+    for up to ``settings.redis_pool_timeout`` seconds when all connections are in use.
+    """
+
+    def __init__(self):
+        self._pool: Optional[redis.BlockingConnectionPool] = None
+        self._apool: Optional[aioredis.BlockingConnectionPool] = None
+        self.client: Optional[redis.Redis] = None
+        self.aclient: Optional[aioredis.Redis] = None
+
+    def connect(self, settings: config.SettingsFromEnvironment):
+        if self._pool is None:
+            try:
+                connection_kwargs = {
+                    "host": settings.redis_host,
+                    "port": int(settings.redis_port),
+                    "db": int(settings.redis_db),
+                    "max_connections": int(settings.redis_max_connections),
+                    "timeout": float(settings.redis_pool_timeout),
+                    "socket_timeout": float(settings.redis_socket_timeout),
+                    "socket_connect_timeout": float(settings.redis_socket_connect_timeout),
+                }
+                self._pool = redis.BlockingConnectionPool(**connection_kwargs)
+                self._apool = aioredis.BlockingConnectionPool(**connection_kwargs)
+                self.client = TracedRedis(connection_pool=self._pool)
+                self.aclient = AsyncTracedRedis(connection_pool=self._apool)
+                logger.info(f"Redis Connection Pool Size - {settings.redis_max_connections} ({settings.redis_host})")
+
+            except Exception as e:
+                logger.error(e)
+                raise RedisConnectionError(e)
+
+    async def close(self):
+        if self._apool is not None:
+            await self._apool.disconnect()
+            self._pool.disconnect()
+            self._pool = self._apool = self.client = self.aclient = None
+            logger.info("Redis pools are closed")
+
+    def stats(self) -> Dict[str, Any]:
+        if self._apool is None:
+            return {}
+        return {"in_use": len(self._apool._in_use_connections), "idle": len(self._apool._available_connections)}
+
+    def sync_stats(self) -> Dict[str, Any]:
+        if self._pool is None:
+            return {}
+        # the blocking pool pre-fills its queue with None placeholders for connections not yet created
+        idle = sum(1 for connection in list(self._pool.pool.queue) if connection is not None)
+        return {"in_use": len(self._pool._connections) - idle, "idle": idle}
@@ -1,17 +1,15 @@
 import logging
 import os
 import socket
-import time
-from typing import Callable
+from typing import Any, Callable, Dict, Set
 
-from fastapi import Header, HTTPException, Request
 from opentelemetry import metrics
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+from opentelemetry.metrics import CallbackOptions, Observation
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
 from opentelemetry.sdk.resources import Resource
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
 
 # Get the host name of the machine
 host_name = socket.gethostname()
@@ -24,7 +22,20 @@ resource = Resource.create(
 )
 exporter = OTLPMetricExporter(endpoint=f"http://{os.getenv('OTEL_COLLECTOR_SVC')}:4317", insecure=True)
 metric_reader = PeriodicExportingMetricReader(exporter)
-provider = MeterProvider(metric_readers=[metric_reader], resource=resource)
+# most endpoints answer in a few ms, so the default buckets (5ms, 10ms, 25ms, 50ms, 75ms, 100ms, 250ms, ...) put nearly everything in the
+# first two; these resolve the sub-100ms range and still cover the long-poll endpoints (event queue wait, SSE stream)
+LATENCY_BUCKETS_SECONDS = [0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+latency_view = View(
+    instrument_name="http_request_latency_seconds",
+    aggregation=ExplicitBucketHistogramAggregation(boundaries=LATENCY_BUCKETS_SECONDS),
+)
+# loop lag is ~0 when healthy; anything past a few ms is a blocking call in the loop
+LOOP_LAG_BUCKETS_SECONDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+loop_lag_view = View(
+    instrument_name="event_loop_lag_seconds",
+    aggregation=ExplicitBucketHistogramAggregation(boundaries=LOOP_LAG_BUCKETS_SECONDS),
+)
+provider = MeterProvider(metric_readers=[metric_reader], resource=resource, views=[latency_view, loop_lag_view])
 
 # Sets the global default meter provider
 metrics.set_meter_provider(provider)
@@ -45,32 +56,119 @@ active_requests = meter.create_up_down_counter("http_active_requests", descripti
 
 request_errors = meter.create_counter("http_request_error", description="Number of HTTP requests that resulted in an error")
 
-path_requests_count = meter.create_counter("http_requests_paths", description="Count of HTTP requests by path")
+path_requests_count = meter.create_counter("http_requests_paths", description="Count of HTTP requests by route template")
+
+loop_lag = meter.create_histogram("event_loop_lag_seconds", description="How late the event loop woke a sleeping task")
+
+loop_stalls = meter.create_counter("event_loop_blocked", description="Loop lag samples over the blocking threshold")
+
+# label used when no route matched (404s, auth failures before routing); raw paths would let scanners mint a series per URL
+UNMATCHED_ROUTE = "unmatched"
+# label used once MAX_ROUTE_LABELS distinct templates have been seen, so a misconfigured mount cannot grow series without bound
+OVERFLOW_ROUTE = "other"
+MAX_ROUTE_LABELS = 200
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+_route_labels: Set[str] = set()
 
 logger = logging.getLogger("s3logger")
 
+# name -> zero-arg callable returning {"in_use", "idle", "waiters", "wait_ms"}; read on every metric export
+pool_stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+# name -> zero-arg callable returning {"hits", "misses", "evictions", "size"}
+cache_stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+# name -> zero-arg callable returning {"depth", "flushed", "failed", "dropped"}; write-behind buffers, s3 log uploads, fact prefetch
+queue_stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """Matched route template for the request (e.g. /games/leaderboard/{game}), read from the scope after routing."""
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return UNMATCHED_ROUTE
+    if template not in _route_labels:
+        if len(_route_labels) >= MAX_ROUTE_LABELS:
+            return OVERFLOW_ROUTE
+        _route_labels.add(template)
+    return template
+
+
+def method_label(scope: Dict[str, Any]) -> str:
+    method = scope.get("method", "")
+    return method if method in KNOWN_METHODS else "OTHER"
+
+
+def record_loop_lag(lag_seconds: float):
+    loop_lag.record(lag_seconds, {"host": host_name})
+
+
+def record_loop_stall():
+    loop_stalls.add(1, {"host": host_name})
+
+
+def register_pool_stats(pool_name: str, stats_callable: Callable[[], Dict[str, Any]]):
+    pool_stats_sources[pool_name] = stats_callable
+
+
+def register_cache_stats(cache_name: str, stats_callable: Callable[[], Dict[str, Any]]):
+    cache_stats_sources[cache_name] = stats_callable
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        path = request.url.path
-        start_time = time.time()
-        active_requests.add(1, {"host": host_name})
-        try:
-            response = await call_next(request)
-        except HTTPException as http_exc:
-            request_errors.add(1, {"host": host_name, "path": path, "status_code": http_exc.status_code})
-            logger.info(http_exc.status_code)
-            logger.info(http_exc.detail)
-            response = Response(content=http_exc.detail, status_code=http_exc.status_code)
-        except Exception as exc:
-            request_errors.add(1, {"host": host_name, "path": path, "status_code": 500})
-            logger.info(exc)
-            response = Response(content=str(exc), status_code=500)
-        finally:
-            elapsed_time = time.time() - start_time
-            requests_latency.record(elapsed_time, {"host": host_name})
-            request_counter.add(1, {"host": host_name})
-            path_requests_count.add(1, {"host": host_name, "path": path})
-            active_requests.add(-1, {"host": host_name})
-
-        return response
+
+def register_queue_stats(queue_name: str, stats_callable: Callable[[], Dict[str, Any]]):
+    queue_stats_sources[queue_name] = stats_callable
+
+
+def observe_stat(sources: Dict[str, Callable[[], Dict[str, Any]]], stat: str, label: str):
+    def callback(options: CallbackOptions):
+        for source_name, stats_callable in list(sources.items()):
+            try:
+                value = stats_callable().get(stat)
+            except Exception as e:
+                logger.error(f"Could not read {stat} for {label} {source_name}: {e}")
+                continue
+            if value is not None:
+                yield Observation(value, {"host": host_name, label: source_name})
+
+    return callback
+
+
+meter.create_observable_gauge(
+    "db_pool_in_use", callbacks=[observe_stat(pool_stats_sources, "in_use", "pool")], description="Pooled connections checked out"
+)
+meter.create_observable_gauge(
+    "db_pool_idle", callbacks=[observe_stat(pool_stats_sources, "idle", "pool")], description="Pooled connections sitting idle"
+)
+meter.create_observable_gauge(
+    "db_pool_waiters", callbacks=[observe_stat(pool_stats_sources, "waiters", "pool")], description="Callers waiting for a pooled connection"
+)
+meter.create_observable_gauge(
+    "db_pool_wait_ms",
+    callbacks=[observe_stat(pool_stats_sources, "wait_ms", "pool")],
+    description="Mean time to acquire a pooled connection over the last minute",
+)
+
+meter.create_observable_counter("cache_hits", callbacks=[observe_stat(cache_stats_sources, "hits", "cache")], description="In-process cache hits")
+meter.create_observable_counter(
+    "cache_misses", callbacks=[observe_stat(cache_stats_sources, "misses", "cache")], description="In-process cache misses"
+)
+meter.create_observable_counter(
+    "cache_evictions", callbacks=[observe_stat(cache_stats_sources, "evictions", "cache")], description="In-process cache LRU evictions"
+)
+meter.create_observable_gauge("cache_size", callbacks=[observe_stat(cache_stats_sources, "size", "cache")], description="In-process cache entries")
+
+meter.create_observable_gauge(
+    "queue_depth", callbacks=[observe_stat(queue_stats_sources, "depth", "queue")], description="Items waiting in a background queue"
+)
+meter.create_observable_counter(
+    "queue_flushed", callbacks=[observe_stat(queue_stats_sources, "flushed", "queue")], description="Items a background queue has processed"
+)
+meter.create_observable_counter(
+    "queue_failed", callbacks=[observe_stat(queue_stats_sources, "failed", "queue")], description="Items a background queue failed to process"
+)
+meter.create_observable_counter(
+    "queue_dropped",
+    callbacks=[observe_stat(queue_stats_sources, "dropped", "queue")],
+    description="Items dropped because a background queue was full",
+)
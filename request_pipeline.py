@@ -0,0 +1,208 @@
+import asyncio
+import hmac
+import logging
+import random
+import string
+import time
+from typing import Optional
+
+from starlette.authentication import (
+    AuthCredentials,
+    AuthenticationBackend,
+    AuthenticationError,
+    UnauthenticatedUser,
+)
+from starlette.requests import HTTPConnection
+from starlette.responses import PlainTextResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import tracing
+from catch_http_exceptions import exception_response
+from metrics_middleware import (
+    active_requests,
+    host_name,
+    method_label,
+    path_requests_count,
+    request_counter,
+    request_errors,
+    requests_latency,
+    route_label,
+)
+from tracing import end_request_span, start_request_span
+from utilities.log_policy import begin_request, end_request
+from utilities.profiler import ProfileSink, RequestProfiler
+
+logger = logging.getLogger("s3logger")
+# structured copy of the access log; only enabled when api.py attaches the Parquet sink (ACCESS_LOG_PARQUET)
+access_logger = logging.getLogger("accesslog")
+
+REQUEST_ID_ALPHABET = string.ascii_uppercase + string.digits
+# access lines are always logged, whatever the sampling policy
+EXEMPT = {"log_policy_exempt": True}
+
+
+def new_request_id() -> str:
+    return "".join(random.choices(REQUEST_ID_ALPHABET, k=10))
+
+
+class RequestPipelineMiddleware:
+    """Request id, authentication, error mapping, metrics, tracing and access logging in one pure-ASGI pass.
+
+    Replaces the former stack of ``AuthenticationMiddleware``, the ``catch_http_exceptions`` and
+    ``log_requests`` function middlewares and the ``BaseHTTPMiddleware``-based ``MetricsMiddleware``,
+    each of which re-wrapped the response in its own task and stream.
+
+    The request id is exposed as ``request.state.request_id`` and the ``x-request-id`` response header.
+
+    With a ``profile_sink``, a request is profiled (see ``utilities.profiler``) when it carries
+    ``x-profile: <profile_token>`` or is picked by ``profile_sample_rate``; its collapsed stacks are saved
+    as ``<time>-<rid>.collapsed`` and the response gets an ``x-profile-id`` header. At most
+    ``max_concurrent_profiles`` requests are profiled at once.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: AuthenticationBackend,
+        record_metrics: bool = True,
+        profile_sink: Optional[ProfileSink] = None,
+        profile_token: Optional[str] = None,
+        profile_sample_rate: float = 0.0,
+        profile_interval_seconds: float = 0.005,
+        max_concurrent_profiles: int = 2,
+    ):
+        self.app = app
+        self.backend = backend
+        self.record_metrics = record_metrics
+        self.profile_sink = profile_sink
+        self.profile_token = profile_token
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_interval_seconds = profile_interval_seconds
+        self.max_concurrent_profiles = max_concurrent_profiles
+        self._active_profiles = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = new_request_id()
+        scope.setdefault("state", {})["request_id"] = request_id
+        path = scope["path"]
+        connection = HTTPConnection(scope)
+        headers = connection.headers
+        client = connection.client
+        logger.info(
+            f"rid={request_id} start request remote-ip={client.host if client else None} path={path} "
+            f"panda_xpress={headers.get('panda-xpress')} panda_mac={headers.get('panda-mac')} query_params={dict(connection.query_params)}",
+            extra=EXEMPT,
+        )
+
+        sampling = begin_request(path)
+        profiler = self._start_profiler(headers) if self.profile_sink is not None else None
+        start_time = time.perf_counter()
+        status_code = 500
+        content_length = 0
+        response_started = False
+        failed = False
+        error: Optional[Exception] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, content_length, response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+                if profiler is not None:
+                    message["headers"].append((b"x-profile-id", request_id.encode()))
+            elif message["type"] == "http.response.body":
+                content_length += len(message.get("body", b""))
+            await send(message)
+
+        if self.record_metrics:
+            active_requests.add(1, {"host": host_name})
+        if tracing.tracing_enabled:
+            span, span_token = start_request_span(scope["method"], headers)
+        try:
+            error_response = await self._authenticate(scope)
+            if error_response is not None:
+                await error_response(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            if response_started:
+                # too late for an error response; re-raise so the server aborts the connection instead of
+                # letting the client take a truncated body for a complete one
+                failed = True
+                error = exc
+                logger.error(f"rid={request_id} {type(exc).__name__} after the response started, aborting it: {exc}")
+                raise
+            response = exception_response(exc)
+            if response is None:
+                failed = True
+                error = exc
+                logger.error(f"rid={request_id} unhandled {type(exc).__name__}: {exc}")
+                response = Response(content=str(exc), status_code=500)
+            await response(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            route = route_label(scope)
+            if tracing.tracing_enabled:
+                end_request_span(span, span_token, route, status_code, request_id, error)
+            if self.record_metrics:
+                if failed:
+                    request_errors.add(1, {"host": host_name, "route": route, "status_code": status_code})
+                requests_latency.record(elapsed, {"host": host_name, "route": route, "method": method_label(scope), "status_code": status_code})
+                request_counter.add(1, {"host": host_name})
+                path_requests_count.add(1, {"host": host_name, "route": route})
+                active_requests.add(-1, {"host": host_name})
+            logger.info(
+                f"rid={request_id} content_length={content_length} completed_in={elapsed * 1000:.2f}ms status_code={status_code}", extra=EXEMPT
+            )
+            end_request(sampling)
+            if access_logger.isEnabledFor(logging.INFO):
+                access = {
+                    "rid": request_id,
+                    "method": scope["method"],
+                    "path": path,
+                    "status": status_code,
+                    "latency_ms": elapsed * 1000,
+                    "content_length": content_length,
+                    "panda_mac": headers.get("panda-mac"),
+                }
+                access_logger.info("access", extra={"access": access})
+            if profiler is not None:
+                await self._save_profile(profiler, request_id, route)
+
+    def _start_profiler(self, headers) -> Optional[RequestProfiler]:
+        token = headers.get("x-profile")
+        requested = token is not None and self.profile_token is not None and hmac.compare_digest(token.encode(), self.profile_token.encode())
+        if not requested and (self.profile_sample_rate <= 0 or random.random() >= self.profile_sample_rate):
+            return None
+        if self._active_profiles >= self.max_concurrent_profiles:
+            return None
+        self._active_profiles += 1
+        profiler = RequestProfiler(asyncio.current_task(), interval_seconds=self.profile_interval_seconds)
+        profiler.start()
+        return profiler
+
+    async def _save_profile(self, profiler: RequestProfiler, request_id: str, route: str):
+        try:
+            stacks = profiler.stop()
+            file_path = await asyncio.to_thread(self.profile_sink.save, request_id, stacks)
+            logger.info(f"rid={request_id} profiled route={route} samples={profiler.samples} profile={file_path}", extra=EXEMPT)
+        except OSError as e:
+            logger.error(f"rid={request_id} could not save profile: {e}")
+        finally:
+            self._active_profiles -= 1
+
+    async def _authenticate(self, scope: Scope) -> Optional[Response]:
+        try:
+            auth_result = await self.backend.authenticate(HTTPConnection(scope))
+        except AuthenticationError as exc:
+            return PlainTextResponse(str(exc), status_code=400)
+        if auth_result is None:
+            auth_result = AuthCredentials(), UnauthenticatedUser()
+        scope["auth"], scope["user"] = auth_result
+        return None
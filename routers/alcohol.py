@@ -1,16 +1,28 @@
-import json
 import logging
+from typing import Optional
 
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, HTTPException, Request
 
-from dependencies import get_token_header
+from dependencies import AuthPolicy, get_redis, require_auth
+from utilities.leaderboards import read_alcohol_leaderboard, record_alcohol_reading
+from utilities.pagination import (
+    add_keyset,
+    add_limit,
+    order_by,
+    page_response,
+    with_tiebreak,
+)
+from utilities.write_behind import insert_returning
 
 logger = logging.getLogger("s3logger")
 
+INSERT_ALCOHOL_READING_QUERY = "INSERT INTO alcohol_reading (user_uuid, reading) VALUES (%(uuid)s, %(reading)s) RETURNING id, reading;"
+
 router = APIRouter(
     prefix="/alcohol",
     tags=["alcohol"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.HEADER_ONLY))],
     responses={404: {"description": "Not found"}},
 )
 
@@ -20,7 +32,7 @@ def add_limit_and_offset(query: str):
     OFFSET %(offset)s"""
 
 
-def simple_sort(query: str, sort_by: str, table_alias: str):
+def get_sort_fields(sort_by: str):
     """
     best
     worst
@@ -28,7 +40,7 @@ def simple_sort(query: str, sort_by: str, table_alias: str):
     stale
 
     :param sort_by:
-    :return:
+    :return: the ORDER BY fields, ending in the row id so the order is total (needed for keyset pagination)
     """
     mapper = {
         "best": {"field": "reading", "order": "desc"},
@@ -37,8 +49,20 @@ def simple_sort(query: str, sort_by: str, table_alias: str):
         "stale": {"field": "id", "order": "asc"},
         "default": {"field": "id", "order": "desc"},
     }
-    to_sort = mapper.get(sort_by, "default")
-    return f"{query} order by {table_alias}.{to_sort['field']} {to_sort['order']}"
+    to_sort = mapper.get(sort_by, mapper["default"])
+    return with_tiebreak([to_sort])
+
+
+def simple_sort(query: str, sort_by: str, table_alias: str):
+    return f"{query} {order_by(get_sort_fields(sort_by), table_alias)}"
+
+
+def paginate(query: str, params: dict, sort_by: str, table_alias: str, cursor: Optional[str]):
+    """Sort and page ``query``: keyset when a cursor is given, otherwise the old page/pageSize offset."""
+    if cursor:
+        query = add_keyset(query, params, get_sort_fields(sort_by), table_alias, cursor, sort_by)
+        return add_limit(simple_sort(query, sort_by, table_alias))
+    return add_limit_and_offset(simple_sort(query, sort_by, table_alias))
 
 
 def check_page_and_offset_values(page: int, pageSize: int):
@@ -50,65 +74,87 @@ def check_page_and_offset_values(page: int, pageSize: int):
 
 
 @router.get("/list")
-async def get_alcohol_list(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+async def get_alcohol_list(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best", cursor: Optional[str] = None):
     check_page_and_offset_values(page, pageSize)
     params = {"limit": pageSize, "offset": (page - 1) * pageSize}
     QRY = """
-        SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading 
+        SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading, ar.id as row_id
         FROM alcohol_reading ar 
         join users usrs on usrs.uuid = ar.user_uuid 
     """
-    QRY = simple_sort(QRY, sortBy, "ar")
-    QRY = add_limit_and_offset(QRY)
+    QRY = paginate(QRY, params, sortBy, "ar", cursor)
     logger.info(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields(sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
 @router.get("/leaderboard")
-async def get_alcohol_leaderboard(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+async def get_alcohol_leaderboard(
+    request: Request,
+    page: int = 1,
+    pageSize: int = 10,
+    sortBy: str = "best",
+    cursor: Optional[str] = None,
+    rd_con: aioredis.Redis = Depends(get_redis),
+):
     check_page_and_offset_values(page, pageSize)
     params = {"limit": pageSize, "offset": (page - 1) * pageSize}
+    if not cursor:
+        records = await read_alcohol_leaderboard(rd_con, request.app.state.db, params["offset"], pageSize, sortBy)
+        if records is not None:
+            response = page_response(records, get_sort_fields(sortBy), sortBy, pageSize)
+            logger.info(response)
+            return response
+
     QRY = """
-            SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading 
+            SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading, ar.id as row_id
             FROM alcohol_reading ar 
             join users usrs on usrs.uuid = ar.user_uuid 
         """
-    QRY = simple_sort(QRY, sortBy, "ar")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, sortBy, "ar", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields(sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
-@router.get("/me")
-async def get_my_alcohol_readings(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+@router.get("/me", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def get_my_alcohol_readings(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best", cursor: Optional[str] = None):
     check_page_and_offset_values(page, pageSize)
-    params = {"uuid": request.user[0]["uuid"], "limit": pageSize, "offset": (page - 1) * pageSize}
+    params = {"uuid": request.user[0].uuid, "limit": pageSize, "offset": (page - 1) * pageSize}
     QRY = """
-            SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading 
+            SELECT coalesce(usrs.discord_handle, NULL) as discord_handle, ar.reading, ar.id as row_id
             FROM alcohol_reading ar 
             join users usrs on usrs.uuid = ar.user_uuid 
         """
-    QRY = simple_sort(QRY, sortBy, "ar")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, sortBy, "ar", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields(sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
-@router.post("/me")
-async def insert_alcohol_reading(request: Request):
-    QRY = "INSERT INTO alcohol_reading (user_uuid, reading) VALUES (%(uuid)s, %(reading)s) RETURNING id;"
+@router.post("/me", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def insert_alcohol_reading(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     if await request.body():
         req_info = await request.json()
-        params = {"uuid": request.user[0]["uuid"], "reading": req_info["reading"]}
+        params = {"uuid": request.user[0].uuid, "reading": req_info["reading"]}
         logger.info(params)
-        record_id = request.app.state.db.execute(query=QRY, args=params)
+        user = request.user[0]
+
+        async def after_commit(row):
+            if row is not None:
+                # the stored reading, not the one sent: the member has to sort like the column the SQL fallback reads
+                record_id, reading = row
+                await record_alcohol_reading(rd_con, record_id, user.uuid, reading, user.discord_handle)
+
+        # with ALCOHOL_READING_ACK=buffered the id isn't known yet and comes back as null
+        row = await insert_returning(
+            request.app.state.db, request.app.state.write_behind.get("alcohol_reading"), INSERT_ALCOHOL_READING_QUERY, params, after_commit
+        )
+        record_id = row[0] if row else None
         response = {"status": "SUCCESS", "data": {"record_id": record_id}}
         logger.info(response)
     else:
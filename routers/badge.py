@@ -2,100 +2,118 @@ import hashlib
 import json
 import logging
 import os
-import time
-
-import redis
-from fastapi import APIRouter, Depends, Request
-
-from dependencies import get_token_header
+import secrets
+from typing import Optional
+
+import redis.asyncio as aioredis
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from redis.commands.core import AsyncScript
+
+from dependencies import AuthPolicy, get_redis, require_auth, require_debug_token
+from utilities.badge_events import (
+    MAX_EVENTS_PER_POLL,
+    dequeue_badge_events,
+    stream_badge_events,
+    wait_for_badge_events,
+)
 
 router = APIRouter(
     prefix="/badge",
     tags=["badge"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.HEADER_ONLY))],
     responses={404: {"description": "Not found"}},
 )
 
 logger = logging.getLogger("s3logger")
 
 
-def generate_short_hash(uuid, mac_address):
-    timestamp = str(time.time())
-
-    # Concatenate the UUID, MAC address, and timestamp
-    combined_string = uuid + mac_address + timestamp
+REGISTRATION_TTL_SECONDS = 60 * 15
+REGISTRATION_CODE_ATTEMPTS = 16
+
+# KEYS[1] = "uuid|mac", KEYS[2] = candidate code; ARGV[1] = "uuid|mac", ARGV[2] = ttl seconds
+# Returns the badge's live code if it already has one, the candidate if it was free, or nil on a collision.
+ALLOCATE_REGISTRATION_CODE_LUA = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    return existing
+end
+if redis.call('SET', KEYS[2], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    redis.call('SET', KEYS[1], KEYS[2], 'EX', ARGV[2])
+    return KEYS[2]
+end
+return nil
+"""
+# registered on first use; the sha is the same for every client, so one Script serves them all
+_allocate_registration_code_script: Optional[AsyncScript] = None
+
+
+def generate_short_hash(uuid, mac_address, code_length=8):
+    # a random nonce rather than the timestamp, so a retry never needs to wait for the clock to move
+    nonce = secrets.token_hex(8)
+
+    # Concatenate the UUID, MAC address, and nonce
+    combined_string = uuid + mac_address + nonce
     hash_object = hashlib.sha256(combined_string.encode())
     hash_hex = hash_object.hexdigest()
 
-    # Reduce the hash to the first 6 characters
-    short_hash = hash_hex[:8]
+    # Reduce the hash to the first 8 characters
+    short_hash = hash_hex[:code_length]
 
     return short_hash
 
 
-def set_registration_keys(uuid, mac):
-    logger.info("Creating a registration code by uuid and mac.")
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-    registration_hash = generate_short_hash(uuid, mac)
-
-    hash_in_rd = rd_con.get(registration_hash)
-    logger.info(registration_hash)
-    logger.info(hash_in_rd)  # returns None if not exists
-
-    # check for hash collisions
-    while hash_in_rd is not None:
-        hash_in_rd = hash_in_rd.decode("utf-8")
-        found_uuid = hash_in_rd.split("|")[0]
-        found_mac = hash_in_rd.split("|")[1]
-
-        # they somehow duped the key... so just use the current hash and extend TTL
-        if found_uuid == uuid and found_mac == mac:
-            break
+def allocate_registration_code_script(rd_con: aioredis.Redis) -> AsyncScript:
+    global _allocate_registration_code_script
+    if _allocate_registration_code_script is None:
+        _allocate_registration_code_script = rd_con.register_script(ALLOCATE_REGISTRATION_CODE_LUA)
+    return _allocate_registration_code_script
 
-        time.sleep(1)
-        registration_hash = generate_short_hash(uuid, mac)
 
-        hash_in_rd = rd_con.get(registration_hash)
-        logger.info(registration_hash)
-        logger.info(hash_in_rd)
+async def try_allocate_registration_code(rd_con: aioredis.Redis, uuid, mac, candidate_code):
+    """One atomic attempt; returns the badge's code, or None if ``candidate_code`` belongs to another badge."""
+    allocate = allocate_registration_code_script(rd_con)
+    code = await allocate(keys=[f"{uuid}|{mac}", candidate_code], args=[f"{uuid}|{mac}", REGISTRATION_TTL_SECONDS], client=rd_con)
+    return code.decode("utf-8") if code is not None else None
 
-    rd_con.set(registration_hash, f"{uuid}|{mac}", ex=60 * 15)  # TTL 15min
-    rd_con.set(f"{uuid}|{mac}", registration_hash, ex=60 * 15)
-    return registration_hash
 
+async def allocate_registration_code(rd_con: aioredis.Redis, uuid, mac, code_length=8):
+    """Return the badge's pending registration code, creating one if needed.
 
-def get_registration_code(uuid, mac):
-    logger.info("Retrieving code by uuid and mac.")
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-
-    hash_in_rd = rd_con.get(f"{uuid}|{mac}")
-    logger.info(hash_in_rd)
+    Both keys are written by a single server-side script, so two replicas can never
+    hand out the same code and a collision just means retrying with a fresh nonce.
+    """
+    for _ in range(REGISTRATION_CODE_ATTEMPTS):
+        candidate_code = generate_short_hash(uuid, mac, code_length)
+        code = await try_allocate_registration_code(rd_con, uuid, mac, candidate_code)
+        if code is not None:
+            return code
+        logger.info(f"Registration code collision on {candidate_code}, retrying.")
 
-    return hash_in_rd
+    raise HTTPException(status_code=503, detail="Could not allocate a registration code, try again.")
 
 
-@router.post("/push-redis")
-async def test_redis(request: Request):
+# redis smoke tests; behind the debug token like /debug/*
+@router.post("/push-redis", dependencies=[Depends(require_debug_token)])
+async def test_redis(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     logger.info(os.getenv("REDIS_HOST"))
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-    ret_val = rd_con.set("test", "asdf")
+    ret_val = await rd_con.set("test", "asdf")
 
     response = {"status": "SUCCESS", "redis_retval": json.dumps(ret_val)}
     return response
 
 
-@router.get("/pull-redis")
-async def test_redis(request: Request):
+@router.get("/pull-redis", dependencies=[Depends(require_debug_token)])
+async def test_redis(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     logger.info(os.getenv("REDIS_HOST"))
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-    ret_val = rd_con.get("test")
+    ret_val = await rd_con.get("test")
 
     response = {"status": "SUCCESS", "redis_retval": json.dumps(ret_val.decode())}
     return response
 
 
-@router.post("/register")
-async def register_badge(request: Request):
+@router.post("/register", dependencies=[Depends(require_auth(AuthPolicy.USER, allow_unregistered=True))])
+async def register_badge(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     has_registered = 0
     registration_code = None
     if len(request.user) > 0:
@@ -104,23 +122,20 @@ async def register_badge(request: Request):
         panda_xpress = request.headers["panda-xpress"]
         panda_mac = request.headers["panda-mac"]
 
-        registration_code = get_registration_code(panda_xpress, panda_mac)
-        if not registration_code:
-            registration_code = set_registration_keys(panda_xpress, panda_mac)
+        registration_code = await allocate_registration_code(rd_con, panda_xpress, panda_mac)
 
     response = {"status": "SUCCESS", "registered": json.dumps(has_registered), "registration_code": registration_code}
     return response
 
 
-@router.post("/verify")
-async def verify_badge(request: Request):
+@router.post("/verify", dependencies=[Depends(require_auth(AuthPolicy.USER, allow_unregistered=True))])
+async def verify_badge(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     has_registered = 0
     registration_code = None
     if len(request.user) > 0:
         has_registered = 1
         if await request.body():
             req_info = await request.json()
-            rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
             pub_body = {"user_uuid": request.headers["panda-xpress"], "mac_address": request.headers["panda-mac"]}
 
             if req_info.get("hs"):
@@ -130,50 +145,62 @@ async def verify_badge(request: Request):
                 pub_body["event"] = "status"
                 pub_body["status"] = req_info["status"]
 
-            rd_con.publish("high-score-processor", json.dumps(pub_body))
+            await rd_con.publish("high-score-processor", json.dumps(pub_body))
     else:
         panda_xpress = request.headers["panda-xpress"]
         panda_mac = request.headers["panda-mac"]
 
-        registration_code = get_registration_code(panda_xpress, panda_mac)
-        if not registration_code:
-            registration_code = set_registration_keys(panda_xpress, panda_mac)
+        registration_code = await allocate_registration_code(rd_con, panda_xpress, panda_mac)
 
     response = {"status": "SUCCESS", "registered": json.dumps(has_registered), "registration_code": registration_code}
     return response
 
 
-@router.get("/event/queue")
-async def get_event_from_badge_event_queue(request: Request):
-    params = {"uuid": request.user[0]["uuid"], "mac_address": request.user[0]["mac_address"]}
-    QRY = """
-    select id, badge_action, event_message
-    from badge_event_queue 
-    where recipient_uuid = %(uuid)s and recipient_mac_address = %(mac_address)s
-    and has_read = 0
-    ORDER BY ID ASC 
-    LIMIT 1 
+@router.get("/event/queue", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def get_event_from_badge_event_queue(
+    request: Request,
+    max_events: Optional[int] = Query(None, alias="max"),
+    wait: Optional[float] = None,
+):
+    """Oldest unread event (or ``[]``); with ``?max=N`` a list of up to N events, oldest first.
+
+    ``?wait=S`` long-polls: the request is held up to S seconds (capped by BADGE_EVENT_MAX_WAIT_SECONDS) until an event arrives.
     """
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    event = records.to_dict("records")
-    if len(event) > 0:
-        event = event[0]
-        QRY = "UPDATE badge_event_queue set has_read = 1 where id=%(id)s;"
-        params = {"id": event["id"]}
-        logger.info(params)
-        record_id = request.app.state.db.execute(query=QRY, args=params)
-        logger.info(f"Updated badge_event_queue ID {record_id} to has read")
-    # response = {
-    #     "status": "SUCCESS",
-    #     json.dumps(event)
-    # }
-    return event
+    if max_events is not None and not 1 <= max_events <= MAX_EVENTS_PER_POLL:
+        raise HTTPException(status_code=400, detail=f"max must be between 1 and {MAX_EVENTS_PER_POLL}")
+    if wait is not None and wait < 0:
+        raise HTTPException(status_code=400, detail="wait must not be negative")
+
+    uuid, mac_address = request.user[0].uuid, request.user[0].mac_address
+    if wait:
+        timeout = min(wait, request.app.state.badge_event_max_wait_seconds)
+        events = await wait_for_badge_events(
+            request.app.state.db, request.app.state.badge_event_notifier, uuid, mac_address, max_events or 1, timeout
+        )
+    else:
+        events = await dequeue_badge_events(request.app.state.db, uuid, mac_address, max_events or 1)
+    if max_events is not None:
+        return events
+    return events[0] if events else []
+
+
+@router.get("/event/stream", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def stream_badge_event_queue(request: Request):
+    """Server-Sent Events: each queued event is delivered as it arrives, and marked read once it has been sent."""
+    body = stream_badge_events(
+        request.app.state.db,
+        request.app.state.badge_event_notifier,
+        request.user[0].uuid,
+        request.user[0].mac_address,
+        request.app.state.badge_event_keepalive_seconds,
+    )
+    return StreamingResponse(body, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # TODO -> REMOVE THIS BEFORE CON DAY
-@router.post("/event/queue/reset")
+@router.post("/event/queue/reset", dependencies=[Depends(require_auth(AuthPolicy.USER)), Depends(require_debug_token)])
 async def admin_reset_badge_queue_events(request: Request):
     QRY = """update badge_event_queue set has_read = 0;"""
-    record_id = request.app.state.db.execute(query=QRY)
+    record_id = await request.app.state.db.execute(query=QRY)
     response = {"status": "SUCCESS", "data": json.dumps(record_id)}
     return response
@@ -2,11 +2,11 @@ import logging
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 
-from dependencies import get_token_header
+from dependencies import AuthPolicy, require_auth
 
 router = APIRouter(
     tags=["badge", "registration"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.HEADER_ONLY))],
     responses={404: {"description": "Not found"}},
 )
 
@@ -26,7 +26,7 @@ async def config_badge_register(request: Request):
         if not params["chip_id"]:
             raise HTTPException(status_code=400, detail="chip_id is missing")
 
-        record_id = request.app.state.db.execute(query=QRY, args=params)
+        record_id = await request.app.state.db.execute(query=QRY, args=params)
         response = {"status": "SUCCESS", "data": {"record_id": record_id}}
         logger.info(response)
     else:
@@ -1,21 +1,15 @@
 import json
 import logging
-import os
 
-import redis
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse
 
-from dependencies import get_token_header
-from utilities.achievements import (
-    Achievements,
-    get_achievement_by_ctf_id_and_user_id,
-    insert_user_achievement,
-)
+from dependencies import AuthPolicy, get_redis, require_auth
+from utilities.achievements import Achievements, unlock_achievement
 from utilities.encrypt_decrypt import decoder
-from utilities.events import log_event
+from utilities.events import queue_event
 from utilities.process_ctf_action import ctf_action
-from utilities.users import get_user_by_device
 
 
 class UserNotRegisteredException(Exception):
@@ -25,7 +19,7 @@ class UserNotRegisteredException(Exception):
 router = APIRouter(
     prefix="/capturetheflag",
     tags=["capturetheflag"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.PUBLIC))],
     responses={404: {"description": "Not found"}},
 )
 
@@ -33,7 +27,7 @@ logger = logging.getLogger("s3logger")
 
 
 @router.get("")
-def capture_the_flag(request: Request, code: str = None):
+async def capture_the_flag(request: Request, code: str = None, rd_con: aioredis.Redis = Depends(get_redis)):
     achievements = Achievements()
     decoded_value = decoder(code)
 
@@ -43,94 +37,94 @@ def capture_the_flag(request: Request, code: str = None):
     event_id = 17
 
     if uuid and mac_address:
-        log_event(request.app.state.db, event_id, uuid, mac_address)
-        user_record = get_user_by_device(request.app.state.db, uuid, mac_address)
+        ctf = request.app.state.ctf
+        rick_rolled = ctf.catalog.resolve(achievements.RICK_ROLLED)
+        await queue_event(ctf.db_connection, ctf.event_log, event_id, uuid, mac_address)
         try:
-            if not user_record:
+            award = await unlock_achievement(ctf.db_connection, ctf.held_achievements, uuid, mac_address, rick_rolled.id)
+            if not award:
                 raise UserNotRegisteredException(f"User with badge: {uuid} | {mac_address} does not exist. They probably haven't registered yet.")
 
-            message = f"{user_record.discord_handle} just got Rick Rolled. #pwnd."
-            achievement_info = get_achievement_by_ctf_id_and_user_id(request.app.state.db, user_record.id, achievements.RICK_ROLLED.id)
-            logger.info(achievement_info)
-            rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-            if achievement_info.user_has_achievement == 0:
-                insert_user_achievement(request.app.state.db, user_record.id, achievements.RICK_ROLLED.id)
-                rd_con.publish(
+            logger.info(award)
+            if award.newly_awarded:
+                await rd_con.publish(
                     "achievement",
                     json.dumps(
                         {
-                            "handle": user_record.discord_handle,
-                            "name": achievements.RICK_ROLLED.name,
-                            "description": achievements.RICK_ROLLED.description,
-                            "points": achievements.RICK_ROLLED.points,
+                            "handle": award.discord_handle,
+                            "name": rick_rolled.name,
+                            "description": rick_rolled.description,
+                            "points": rick_rolled.points,
                         }
                     ),
                 )
             else:
-                message = f"{user_record.discord_handle} was already #pwnd. Guess they wanted more."
+                message = f"{award.discord_handle} was already #pwnd. Guess they wanted more."
                 logger.info(message)
-                rd_con.publish("community-message", message)
+                await rd_con.publish("community-message", message)
         except UserNotRegisteredException as e:
             logger.error(f"{type(e).__name__} caught: {str(e)}")
-            rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-            rd_con.publish("community-message", "Someone got an achievement but didn't register their badge...")
+            await rd_con.publish("community-message", "Someone got an achievement but didn't register their badge...")
         except Exception as e:
             logger.error(str(e))
     else:
         message = "Someone just got Rick Rolled. #pwnd."
-        rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-        rd_con.publish("community-message", message)
+        await rd_con.publish("community-message", message)
         # bot_runner.community_message(message)
 
     return RedirectResponse("https://rb.gy/8dpuen", status_code=302)
 
 
-@router.get("/HelloWorld")
-async def ctf_hello_world(request: Request):
+@router.get("/HelloWorld", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def ctf_hello_world(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.HELLO_WORLD)
+    response = await ctf_action(request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.HELLO_WORLD)
 
     logger.info(response)
     return response
 
 
-@router.get("/Serial")
-async def ctf_serial(request: Request):
+@router.get("/Serial", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def ctf_serial(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(
-        request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.SERIAL_PORT_INTERACTION
+    response = await ctf_action(
+        request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.SERIAL_PORT_INTERACTION
     )
 
     logger.info(response)
     return response
 
 
-@router.get("/APConn")
-async def ctf_serial(request: Request):
+@router.get("/APConn", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def ctf_serial(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.BADGE_ACCESS_POINT)
+    response = await ctf_action(
+        request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.BADGE_ACCESS_POINT
+    )
 
     logger.info(response)
     return response
 
 
-@router.get("/WebAuth")
-async def ctf_serial(request: Request):
+@router.get("/WebAuth", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def ctf_serial(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.BADGE_WEB_AUTH)
+    response = await ctf_action(
+        request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.BADGE_WEB_AUTH
+    )
 
     logger.info(response)
     return response
 
 
-@router.get("/FlagTxt")
-async def ctf_serial(request: Request):
+@router.get("/FlagTxt", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def ctf_serial(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.FLAG_TEXT)
+    response = await ctf_action(request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.FLAG_TEXT)
     logger.info(response)
     return response
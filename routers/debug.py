@@ -0,0 +1,37 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from dependencies import require_debug_token
+from utilities.query_stats import SORT_KEYS, query_stats
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+    dependencies=[Depends(require_debug_token)],
+    responses={404: {"description": "Not found"}},
+)
+
+logger = logging.getLogger("s3logger")
+
+
+@router.get("/queries")
+async def top_queries(sort_by: str = "total_ms", limit: int = Query(20, ge=1, le=500)):
+    """Statements this worker has run, worst first, with count, rows and p50/p95/p99 latency."""
+    if sort_by not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(SORT_KEYS)}")
+    return {"status": "SUCCESS", "data": {"slow_query_ms": query_stats.slow_query_ms, "statements": query_stats.top(sort_by, limit)}}
+
+
+@router.delete("/queries")
+async def reset_queries():
+    query_stats.reset()
+    logger.info("Query stats reset")
+    return {"status": "SUCCESS"}
+
+
+@router.get("/loop")
+async def loop_lag(request: Request):
+    """Loop lag so far and the most recent stalls, with the loop thread's stack when the watchdog is on."""
+    monitor = request.app.state.loop_monitor
+    return {"status": "SUCCESS", "data": {**monitor.stats(), "stalls": monitor.recent_stalls()}}
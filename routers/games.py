@@ -1,28 +1,39 @@
 import json
 import logging
-import os
+from typing import Optional
 
-import redis
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, HTTPException, Request
 
-from dependencies import get_token_header
+from dependencies import AuthPolicy, get_redis, require_auth
+from utilities.leaderboards import read_game_leaderboard, record_game_score
+from utilities.pagination import (
+    add_keyset,
+    add_limit,
+    order_by,
+    page_response,
+    with_tiebreak,
+)
+from utilities.write_behind import insert_returning
 
 router = APIRouter(
     prefix="/games",
     tags=["games"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.HEADER_ONLY))],
     responses={404: {"description": "Not found"}},
 )
 
 logger = logging.getLogger("s3logger")
 
+INSERT_GAME_SCORE_QUERY = "INSERT INTO game_score (game_id, game_name, score, duration, user_uuid, user_mac_address) VALUES (%(game_id)s, %(game)s, %(score)s, %(duration)s, %(uuid)s, %(mac_address)s) RETURNING id, score, duration;"
+
 
 def add_limit_and_offset(query: str):
     return f"""{query} LIMIT %(limit)s 
     OFFSET %(offset)s"""
 
 
-def simple_sort(query: str, query_category: str, sort_by: str, table_alias: str):
+def get_sort_fields(query_category: str, sort_by: str):
     """
     best
     worst
@@ -30,7 +41,7 @@ def simple_sort(query: str, query_category: str, sort_by: str, table_alias: str)
     stale
 
     :param sort_by:
-    :return:
+    :return: the ORDER BY fields, ending in the row id so the order is total (needed for keyset pagination)
     """
     mapper = {
         "game": {
@@ -47,16 +58,25 @@ def simple_sort(query: str, query_category: str, sort_by: str, table_alias: str)
         },
     }
     # Get the field and order for sorting
-    sort_fields = mapper.get(query_category, {}).get(sort_by, "default")
+    category = mapper.get(query_category, {})
+    sort_fields = category.get(sort_by, category["default"])
     if not isinstance(sort_fields, list):
         sort_fields = [sort_fields]
 
-    # Build the ORDER BY clause
-    order_by_fields = ", ".join([f"{table_alias}.{f['field']} {f['order']}" for f in sort_fields])
-    order_by = f"ORDER BY {order_by_fields}"
+    return with_tiebreak(sort_fields)
+
+
+def simple_sort(query: str, query_category: str, sort_by: str, table_alias: str):
     # Add the ORDER BY clause to the query
-    sorted_query = f"{query} {order_by}"
-    return sorted_query
+    return f"{query} {order_by(get_sort_fields(query_category, sort_by), table_alias)}"
+
+
+def paginate(query: str, params: dict, query_category: str, sort_by: str, table_alias: str, cursor: Optional[str]):
+    """Sort and page ``query``: keyset when a cursor is given, otherwise the old page/pageSize offset."""
+    if cursor:
+        query = add_keyset(query, params, get_sort_fields(query_category, sort_by), table_alias, cursor, sort_by)
+        return add_limit(simple_sort(query, query_category, sort_by, table_alias))
+    return add_limit_and_offset(simple_sort(query, query_category, sort_by, table_alias))
 
 
 def check_page_and_offset_values(page: int, pageSize: int):
@@ -68,116 +88,139 @@ def check_page_and_offset_values(page: int, pageSize: int):
 
 
 @router.get("/list")
-async def get_game_list(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "asc"):
+async def get_game_list(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "asc", cursor: Optional[str] = None):
     check_page_and_offset_values(page, pageSize)
     params = {"limit": pageSize, "offset": (page - 1) * pageSize}
     QRY = """
-        select gl.game_name from game_list gl
+        select gl.game_name, gl.id as row_id from game_list gl
     """
-    QRY = simple_sort(QRY, "game", sortBy, "gl")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, "game", sortBy, "gl", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields("game", sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
 @router.get("/leaderboard/{game}")
-async def get_game_leaderboard(game: str, request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+async def get_game_leaderboard(
+    game: str,
+    request: Request,
+    page: int = 1,
+    pageSize: int = 10,
+    sortBy: str = "best",
+    cursor: Optional[str] = None,
+    rd_con: aioredis.Redis = Depends(get_redis),
+):
     check_page_and_offset_values(page, pageSize)
     params = {"game": game, "limit": pageSize, "offset": (page - 1) * pageSize}
+    if not cursor:
+        records = await read_game_leaderboard(rd_con, request.app.state.db, game, params["offset"], pageSize, sortBy)
+        if records is not None:
+            response = page_response(records, get_sort_fields("score", sortBy), sortBy, pageSize)
+            logger.info(response)
+            return response
+
     QRY = """
-        SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle
+        SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle, gs.id as row_id
         FROM cackalacky.game_score gs
         JOIN users usrs on usrs.uuid = gs.user_uuid
         where gs.game_name = %(game)s
     """
-    QRY = simple_sort(QRY, "score", sortBy, "gs")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, "score", sortBy, "gs", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields("score", sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
-@router.get("/me")
-async def get_my_games(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+@router.get("/me", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def get_my_games(request: Request, page: int = 1, pageSize: int = 10, sortBy: str = "best", cursor: Optional[str] = None):
     check_page_and_offset_values(page, pageSize)
-    params = {"uuid": request.user[0]["uuid"], "limit": pageSize, "offset": (page - 1) * pageSize}
+    params = {"uuid": request.user[0].uuid, "limit": pageSize, "offset": (page - 1) * pageSize}
     QRY = """
-        SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle
+        SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle, gs.id as row_id
         FROM cackalacky.game_score gs
         JOIN users usrs on usrs.uuid = gs.user_uuid
         where user_uuid = %(uuid)s
         """
-    QRY = simple_sort(QRY, "score", sortBy, "gs")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, "score", sortBy, "gs", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields("score", sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
-@router.get("/me/{game}")
-async def get_my_game_score(request: Request, game: str, page: int = 1, pageSize: int = 10, sortBy: str = "best"):
+@router.get("/me/{game}", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def get_my_game_score(request: Request, game: str, page: int = 1, pageSize: int = 10, sortBy: str = "best", cursor: Optional[str] = None):
     check_page_and_offset_values(page, pageSize)
-    params = {"uuid": request.user[0]["uuid"], "game": game, "limit": pageSize, "offset": (page - 1) * pageSize}
+    params = {"uuid": request.user[0].uuid, "game": game, "limit": pageSize, "offset": (page - 1) * pageSize}
     QRY = """
-    SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle
+    SELECT gs.game_name, gs.score, gs.duration, coalesce(usrs.discord_handle, NULL) as discord_handle, gs.id as row_id
         FROM cackalacky.game_score gs
         JOIN users usrs on usrs.uuid = gs.user_uuid
     where user_uuid = %(uuid)s AND game_name = %(game)s
     """
-    QRY = simple_sort(QRY, "score", sortBy, "gs")
-    QRY = add_limit_and_offset(QRY)
-    records = request.app.state.db.select_dataframe(query=QRY, args=params)
-    response = {"status": "SUCCESS", "data": json.dumps(records.to_dict("records"))}
+    QRY = paginate(QRY, params, "score", sortBy, "gs", cursor)
+    records = await request.app.state.db.select(query=QRY, args=params)
+    response = page_response(records, get_sort_fields("score", sortBy), sortBy, pageSize)
     logger.info(response)
     return response
 
 
-@router.post("/me/{game}")
-async def insert_my_game_score(request: Request, game: str):
+@router.post("/me/{game}", dependencies=[Depends(require_auth(AuthPolicy.USER))])
+async def insert_my_game_score(request: Request, game: str, rd_con: aioredis.Redis = Depends(get_redis)):
     GET_GAME_ID_QRY = """
         select gl.id from game_list gl where game_name = %(game)s
     """
 
-    QRY = "INSERT INTO game_score (game_id, game_name, score, duration, user_uuid, user_mac_address) VALUES (%(game_id)s, %(game)s, %(score)s, %(duration)s, %(uuid)s, %(mac_address)s) RETURNING id;"
     if await request.body():
         req_info = await request.json()
 
-        game_id = request.app.state.db.select_dataframe(query=GET_GAME_ID_QRY, args={"game": game})
-        if len(game_id) == 0:
+        game_id = await request.app.state.db.select_one(query=GET_GAME_ID_QRY, args={"game": game})
+        if not game_id:
             return {"status": "ERROR", "data": {"message": f"Game: {game} not found"}}
 
         params = {
-            "game_id": game_id.to_dict("records")[0]["id"],
-            "uuid": request.user[0]["uuid"],
-            "mac_address": request.user[0]["mac_address"],
+            "game_id": game_id[0],
+            "uuid": request.user[0].uuid,
+            "mac_address": request.user[0].mac_address,
             "game": game,
             "score": req_info["score"],
             "duration": req_info["duration"],
         }
         logger.info(params)
-        record_id = request.app.state.db.execute(query=QRY, args=params)
+        user = request.user[0]
+        panda_xpress, panda_mac = request.headers["panda-xpress"], request.headers["panda-mac"]
+
+        async def after_commit(row):
+            record_id = None
+            if row is not None:
+                # the stored score and duration, not the ones sent: the member has to sort like the columns the SQL fallback reads
+                record_id, score, duration = row
+                await record_game_score(rd_con, game, record_id, user.uuid, score, duration, user.discord_handle)
+            await rd_con.publish(
+                "high-score-processor",
+                json.dumps({"event": "around-the-world", "user_uuid": panda_xpress, "mac_address": panda_mac}),
+            )
+            await rd_con.publish(
+                "high-score-processor",
+                json.dumps(
+                    {
+                        "event": "challenge-check",
+                        "user_uuid": panda_xpress,
+                        "mac_address": panda_mac,
+                        "score_id": record_id,
+                    }
+                ),
+            )
+
+        # with GAME_SCORE_ACK=buffered the id isn't known yet and comes back as null
+        row = await insert_returning(
+            request.app.state.db, request.app.state.write_behind.get("game_score"), INSERT_GAME_SCORE_QUERY, params, after_commit
+        )
+        record_id = row[0] if row else None
         response = {"status": "SUCCESS", "data": {"record_id": record_id}}
         logger.info(response)
-        rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-        rd_con.publish(
-            "high-score-processor",
-            json.dumps({"event": "around-the-world", "user_uuid": request.headers["panda-xpress"], "mac_address": request.headers["panda-mac"]}),
-        )
-        rd_con.publish(
-            "high-score-processor",
-            json.dumps(
-                {
-                    "event": "challenge-check",
-                    "user_uuid": request.headers["panda-xpress"],
-                    "mac_address": request.headers["panda-mac"],
-                    "score_id": record_id,
-                }
-            ),
-        )
     else:
         response = {"status": "SUCCESS", "data": "No body passed. Nothing written"}
     return response
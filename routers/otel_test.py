@@ -3,11 +3,11 @@ import logging
 
 from fastapi import APIRouter, Depends
 
-from dependencies import get_token_header
+from dependencies import AuthPolicy, require_auth
 
 router = APIRouter(
     tags=["otel-test"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.PUBLIC))],
     responses={404: {"description": "Not found"}},
 )
 
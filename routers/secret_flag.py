@@ -1,15 +1,16 @@
 import logging
 
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, Request
 
-from dependencies import get_token_header
+from dependencies import AuthPolicy, get_redis, require_auth
 from routers.capturetheflag import ctf_action
 from utilities.achievements import Achievements
 
 router = APIRouter(
     prefix="/secret",
     tags=["secret"],
-    dependencies=[Depends(get_token_header)],
+    dependencies=[Depends(require_auth(AuthPolicy.USER))],
     responses={404: {"description": "Not found"}},
 )
 
@@ -17,9 +18,9 @@ logger = logging.getLogger("s3logger")
 
 
 @router.get("/flag")
-async def ctf_secret_flag(request: Request):
+async def ctf_secret_flag(request: Request, rd_con: aioredis.Redis = Depends(get_redis)):
     eventId = 17
     achievements = Achievements()
-    response = ctf_action(request.app.state.db, request.user[0]["uuid"], request.user[0]["mac_address"], eventId, achievements.SECRET_FLAG)
+    response = await ctf_action(request.app.state.ctf, rd_con, request.user[0].uuid, request.user[0].mac_address, eventId, achievements.SECRET_FLAG)
     logger.info(response)
     return response
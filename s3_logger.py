@@ -1,62 +1,233 @@
+import gzip
 import logging
 import os
-from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import shutil
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, List, Optional, Tuple
 
 import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 logger = logging.getLogger("s3logger")
 
 
-def print_directory_rotation_stats(filename, rotated_files, s3_path):
-    """Logging rotation stats to ensure that the backup count and path are correct
-    on each rotation cycle.
+def s3_key_for(file_path: str) -> str:
+    file_name = os.path.basename(file_path)
+    now = datetime.now()
+    formatted_today_date = now.strftime("%Y-%m-%d")
+    current_time = now.strftime("%H-%M-%S")
 
-    :param filename:
-    :param rotated_files:
-    :param s3_path:
-    :return:
+    # remove the datetime from the log rotation
+    adjusted_s3_key_name = ".".join(file_name.split(".")[:2])
+    return f"logs/conference=ckc/app={os.getenv('APP_NAME')}/date={formatted_today_date}/{current_time}-{adjusted_s3_key_name}.gz"
+
+
+class S3Uploader(threading.Thread):
+    """Background thread that ships log files to S3.
+
+    Rotation only hands over a path, so no logging call ever waits on S3. Text logs are gzipped
+    first; files that are already compressed (Parquet) go up as-is. Uploads are retried with
+    exponential backoff; when more than ``max_backlog`` files are waiting the newest is skipped
+    (it stays on disk) instead of growing without bound. Reports its own problems on stderr:
+    logging them would feed back into the files it ships.
     """
-    logger.info(f"Log file stats")
-    logger.info(f"Current file: {filename}")
-    logger.info(f"Len of rotated files: {len(rotated_files)}")
-    logger.info(f"Rotated files list: {rotated_files}")
-    logger.info(f"S3 path: {s3_path}")
+
+    def __init__(self, s3_client, bucket_name: str, max_backlog: int = 32, retries: int = 3, retry_delay: float = 1.0):
+        super().__init__(name="s3-log-uploader", daemon=True)
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self._backlog: "queue.Queue[Optional[Tuple[str, Optional[str], bool]]]" = queue.Queue(maxsize=max_backlog)
+
+    def submit(self, file_path: str, s3_path: Optional[str] = None, compress: bool = True) -> bool:
+        """Queue ``file_path`` for upload (to ``s3_path``, default ``s3_key_for``); ``compress=False`` uploads it as-is and then deletes it."""
+        try:
+            self._backlog.put_nowait((file_path, s3_path, compress))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"S3 log upload backlog full, not shipping {file_path}", file=sys.stderr)
+            return False
+
+    def stop(self, timeout: Optional[float] = None):
+        """Finish the files already queued, then exit."""
+        self._backlog.put(None)
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            item = self._backlog.get()
+            if item is None:
+                return
+            self.upload(*item)
+
+    def upload(self, file_path: str, s3_path: Optional[str] = None, compress: bool = True) -> Optional[str]:
+        s3_path = s3_path or s3_key_for(file_path)
+        if not compress:
+            uploaded = self._upload_with_retries(file_path, s3_path, {})
+            if uploaded:
+                os.remove(file_path)
+            return uploaded
+
+        gz_path = f"{file_path}.gz"
+        try:
+            with open(file_path, "rb") as source, gzip.open(gz_path, "wb") as target:
+                shutil.copyfileobj(source, target)
+        except OSError as e:
+            self.failed += 1
+            print(f"Could not compress {file_path} for S3: {e}", file=sys.stderr)
+            return None
+        try:
+            return self._upload_with_retries(gz_path, s3_path, {"ContentEncoding": "gzip"})
+        finally:
+            os.remove(gz_path)
+
+    def _upload_with_retries(self, file_path: str, s3_path: str, extra_args: Dict[str, str]) -> Optional[str]:
+        for attempt in range(self.retries + 1):
+            try:
+                self.s3_client.upload_file(file_path, self.bucket_name, s3_path, ExtraArgs=extra_args)
+                self.uploaded += 1
+                return s3_path
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    print(f"Failed to upload {file_path} to S3: {e}", file=sys.stderr)
+                    return None
+                time.sleep(self.retry_delay * 2**attempt)
+
+    def stats(self):
+        return {"depth": self._backlog.qsize(), "flushed": self.uploaded, "failed": self.failed, "dropped": self.dropped}
 
 
 class S3TimedRotatingFileHandler(TimedRotatingFileHandler):
-    def __init__(self, filename, bucket_name, aws_access_key_id, aws_secret_access_key, when="m", interval=1, backupCount=5):
+    """Rotating file handler that hands every rotated file to an ``S3Uploader``.
+
+    ``endpoint_url`` points the client at an S3-compatible stand-in (e.g. a local MinIO) for testing.
+    """
+
+    def __init__(
+        self,
+        filename,
+        bucket_name,
+        aws_access_key_id,
+        aws_secret_access_key,
+        when="m",
+        interval=1,
+        backupCount=5,
+        endpoint_url=None,
+        max_backlog=32,
+        retries=3,
+    ):
         super().__init__(filename, when, interval, backupCount)
         self.bucket_name = bucket_name
-        self.s3_client = boto3.client("s3", aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-
-    def doRollover(self):
-        # Perform the log rotation
-        super().doRollover()
-        current_log_path = self.baseFilename
-        log_dir, log_filename = os.path.split(current_log_path)
-        rotated_files = [f for f in os.listdir(log_dir) if os.path.isfile(os.path.join(log_dir, f)) and f.startswith(log_filename)]
-
-        rotated_files.sort(key=lambda f: os.path.getmtime(os.path.join(log_dir, f)), reverse=True)
-        s3_path = ""
-        if rotated_files:
-            # The most recently modified file that matches the original log filename pattern should be the rotated file
-            rotated_file_path = os.path.join(log_dir, rotated_files[1])
-            s3_path = self.upload_file_to_s3(rotated_file_path)
-
-        print_directory_rotation_stats(log_filename, rotated_files, s3_path)
-
-    def upload_file_to_s3(self, file_path):
-        file_name = os.path.basename(file_path)
-        now = datetime.now()
-        formatted_today_date = now.strftime("%Y-%m-%d")
-        current_time = now.strftime("%H-%M-%S")
-
-        # remove the datetime from the log rotation
-        adjusted_s3_key_name = ".".join(file_name.split(".")[:2])
-        s3_path = f"logs/conference=ckc/app={os.getenv('APP_NAME')}/date={formatted_today_date}/{current_time}-{adjusted_s3_key_name}"
+        self.s3_client = boto3.client(
+            "s3", aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, endpoint_url=endpoint_url
+        )
+        self.uploader = S3Uploader(self.s3_client, bucket_name, max_backlog=max_backlog, retries=retries)
+        self.uploader.start()
+
+    def rotate(self, source, dest):
+        super().rotate(source, dest)
+        if os.path.exists(dest):
+            self.uploader.submit(dest)
+
+    def close(self):
+        super().close()
+        if self.uploader.is_alive():
+            self.uploader.stop(timeout=30)
+
+
+ACCESS_LOG_SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("rid", pa.string()),
+        ("method", pa.string()),
+        ("path", pa.string()),
+        ("status", pa.int16()),
+        ("latency_ms", pa.float32()),
+        ("content_length", pa.int64()),
+        ("panda_mac", pa.string()),
+        ("host", pa.string()),
+    ]
+)
+
+
+class ParquetAccessLogHandler(logging.Handler):
+    """Structured access-log sink: collects ``extra={"access": {...}}`` records into Arrow columns and
+    writes one zstd-compressed Parquet file per ``interval_seconds`` (or ``max_rows``), shipped by ``uploader``.
+
+    Files land under ``logs/conference=ckc/app=<APP_NAME>/kind=access/date=YYYY-MM-DD/hour=HH/`` so
+    post-con queries can prune by partition and read only the columns they need.
+    """
+
+    def __init__(self, directory: str, uploader: S3Uploader, interval_seconds: int = 300, max_rows: int = 200_000):
+        super().__init__()
+        self.directory = directory
+        self.uploader = uploader
+        self.interval_seconds = interval_seconds
+        self.max_rows = max_rows
+        self.host = socket.gethostname()
+        self._columns: Dict[str, List] = {name: [] for name in ACCESS_LOG_SCHEMA.names}
+        self._rollover_at = time.time() + interval_seconds
+
+    def emit(self, record: logging.LogRecord):
+        access = getattr(record, "access", None)
+        if access is None:
+            return
         try:
-            response = self.s3_client.upload_file(file_path, self.bucket_name, s3_path)
-            return s3_path
-        except Exception as e:
-            logger.error(f"Failed to upload {file_path} to S3: {e}")
+            self._columns["timestamp"].append(int(record.created * 1000))
+            self._columns["host"].append(self.host)
+            for name in ("rid", "method", "path", "status", "latency_ms", "content_length", "panda_mac"):
+                self._columns[name].append(access.get(name))
+            if record.created >= self._rollover_at or len(self._columns["rid"]) >= self.max_rows:
+                self.write_batch()
+        except Exception:
+            self.handleError(record)
+
+    def write_batch(self):
+        rows = len(self._columns["rid"])
+        self._rollover_at = time.time() + self.interval_seconds
+        if not rows:
+            return
+
+        started = datetime.fromtimestamp(self._columns["timestamp"][0] / 1000, tz=timezone.utc)
+        table = pa.table(self._columns, schema=ACCESS_LOG_SCHEMA)
+        self._columns = {name: [] for name in ACCESS_LOG_SCHEMA.names}
+
+        file_name = f"{self.host}-{started:%Y%m%dT%H%M%S}-{rows}.parquet"
+        file_path = os.path.join(self.directory, f"access-{file_name}")
+        pq.write_table(table, file_path, compression="zstd")
+        s3_path = f"logs/conference=ckc/app={os.getenv('APP_NAME')}/kind=access/date={started:%Y-%m-%d}/hour={started:%H}/{file_name}"
+        self.uploader.submit(file_path, s3_path, compress=False)
+
+    def close(self):
+        self.acquire()
+        try:
+            self.write_batch()
+        finally:
+            self.release()
+        super().close()
+
+
+def start_queue_logging(target_logger: logging.Logger, *handlers: logging.Handler) -> QueueListener:
+    """Route ``target_logger`` through an in-memory queue drained by a writer thread running ``handlers``.
+
+    Logging calls on the request path only format the record and enqueue it; file writes and
+    rotation happen on the listener thread. Stop the returned listener on shutdown to flush it.
+    """
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    target_logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
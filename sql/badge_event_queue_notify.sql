@@ -0,0 +1,20 @@
+-- Wakes long-polling / streaming /badge/event/queue requests (utilities/badge_events.py) when a badge
+-- gets a new unread event. Safe to re-run.
+
+CREATE OR REPLACE FUNCTION notify_badge_event_queue() RETURNS trigger AS $$
+BEGIN
+    -- identical payloads within one transaction are delivered once
+    PERFORM pg_notify(
+        'badge_event_queue',
+        json_build_object('uuid', NEW.recipient_uuid, 'mac_address', NEW.recipient_mac_address)::text
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS badge_event_queue_notify ON badge_event_queue;
+CREATE TRIGGER badge_event_queue_notify
+    AFTER INSERT OR UPDATE OF has_read ON badge_event_queue
+    FOR EACH ROW
+    WHEN (NEW.has_read = 0)
+    EXECUTE FUNCTION notify_badge_event_queue();
@@ -0,0 +1,8 @@
+-- Indexes backing the hot API queries. Safe to re-run; CONCURRENTLY avoids locking writers.
+-- Run outside a transaction block, e.g. psql -f sql/indexes.sql
+
+-- /badge/event/queue dequeue: only unread rows for one badge, oldest first.
+-- Partial, so it stays tiny as delivered events pile up, and ends in id so ORDER BY id LIMIT n reads it in order.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS badge_event_queue_unread_recipient_idx
+    ON badge_event_queue (recipient_uuid, recipient_mac_address, id)
+    WHERE has_read = 0;
@@ -0,0 +1,15 @@
+-- Required by utilities/achievements.award_achievement (INSERT ... ON CONFLICT (user_id, achievement_id)).
+-- Removes duplicate awards left by the old check-then-insert path, keeping the earliest row. Safe to re-run.
+
+BEGIN;
+
+DELETE FROM cackalacky.user_achievements ua
+USING cackalacky.user_achievements earlier
+WHERE ua.user_id = earlier.user_id
+  AND ua.achievement_id = earlier.achievement_id
+  AND ua.id > earlier.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS user_achievements_user_id_achievement_id_key
+    ON cackalacky.user_achievements (user_id, achievement_id);
+
+COMMIT;
@@ -0,0 +1,14 @@
+import os
+
+# set before the app modules are imported: spans go to tracing.span_exporter, and nothing talks to a collector
+os.environ.setdefault("TRACE_EXPORTER", "memory")
+os.environ.setdefault("TRACE_SAMPLE_RATIO", "1")
+os.environ.setdefault("SKIP_METRICS", "True")
+
+
+def pytest_configure():
+    # the same settings path as api.py's startup, so tests trace exactly as the app would
+    from config import SettingsFromEnvironment
+    from tracing import configure_tracing
+
+    configure_tracing(SettingsFromEnvironment())
@@ -0,0 +1,31 @@
+import asyncio
+
+from utilities.badge_events import BadgeEventNotifier, stream_badge_events
+
+
+class FakeDb:
+    def __init__(self, event_ids):
+        self.unread = set(event_ids)
+
+    async def select(self, query, args):
+        pending = sorted(event_id for event_id in self.unread if event_id > args["after"])[: args["max"]]
+        return [{"id": event_id, "badge_action": "ping", "event_message": f"event {event_id}"} for event_id in pending]
+
+    async def execute(self, query, args):
+        self.unread.discard(args["id"])
+
+
+def test_events_not_sent_before_a_disconnect_stay_unread():
+    async def run():
+        db = FakeDb([1, 2, 3])
+        body = stream_badge_events(db, BadgeEventNotifier(), "uuid", "mac", keepalive_seconds=0.01)
+        first = await body.__anext__()
+        second = await body.__anext__()
+        # the client goes away while the second event is being sent
+        await body.aclose()
+        return db, first, second
+
+    db, first, second = asyncio.run(run())
+
+    assert first.startswith("id: 1\n") and second.startswith("id: 2\n")
+    assert db.unread == {2, 3}
@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import fakeredis.aioredis
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+import routers.badge
+from routers.badge import REGISTRATION_CODE_ATTEMPTS, allocate_registration_code
+
+
+def test_concurrent_badges_never_share_a_code():
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        # two hex characters leave 256 codes for 100 badges, so collisions are frequent
+        badges = [(f"badge-{n}", "00:00:00:00:00:00") for n in range(100)]
+        codes = await asyncio.gather(*(allocate_registration_code(rd_con, uuid, mac, code_length=2) for uuid, mac in badges))
+        again = await allocate_registration_code(rd_con, *badges[0], code_length=2)
+        owners = [await rd_con.get(code) for code in codes]
+        return badges, codes, again, owners
+
+    badges, codes, again, owners = asyncio.run(run())
+
+    assert len(set(codes)) == len(codes)
+    assert owners == [f"{uuid}|{mac}".encode() for uuid, mac in badges]
+    assert again == codes[0]
+
+
+def test_gives_up_with_503_after_every_attempt_collides(monkeypatch):
+    candidates = []
+
+    def taken_code(uuid, mac_address, code_length=8):
+        candidates.append(uuid)
+        return "taken"
+
+    monkeypatch.setattr(routers.badge, "generate_short_hash", taken_code)
+
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        await rd_con.set("taken", "another-badge|00:00:00:00:00:01")
+        return await allocate_registration_code(rd_con, "badge", "00:00:00:00:00:00")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(run())
+    assert raised.value.status_code == 503
+    assert len(candidates) == REGISTRATION_CODE_ATTEMPTS
+
+
+def test_redis_test_routes_need_the_debug_token():
+    app = FastAPI()
+    app.include_router(routers.badge.router)
+    app.state.redis = SimpleNamespace(aclient=fakeredis.aioredis.FakeRedis())
+    badge_headers = {"panda-xpress": "badge", "panda-mac": "00:00:00:00:00:00"}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            disabled = await client.post("/badge/push-redis", headers=badge_headers)
+            app.state.debug_token = "secret"
+            wrong = await client.post("/badge/push-redis", headers={**badge_headers, "x-debug-token": "guess"})
+            allowed = await client.post("/badge/push-redis", headers={**badge_headers, "x-debug-token": "secret"})
+            return disabled.status_code, wrong.status_code, allowed.status_code
+
+    assert asyncio.run(run()) == (404, 403, 200)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import fakeredis.aioredis
+
+from routers.capturetheflag import capture_the_flag
+from utilities.achievements import AchievementCatalog, Achievements
+from utilities.auth_cache import TTLCache
+from utilities.encrypt_decrypt import encoder
+from utilities.facts import FACT_SOURCES, FactPrefetcher
+from utilities.process_ctf_action import CtfServices, ctf_action
+
+BADGE = ("badge", "00:00:00:00:00:00")
+
+
+class FakeDb:
+    """A registered badge, its awarded achievements and the events logged for it."""
+
+    def __init__(self, registered=True):
+        self.registered = registered
+        self.awards = set()
+        self.events = []
+
+    async def select_one(self, query, args=None, row_type=None):
+        if not self.registered:
+            return None
+        held = sorted(self.awards)
+        newly_awarded = args["achievement_id"] not in self.awards
+        self.awards.add(args["achievement_id"])
+        return row_type(user_id=1, discord_handle="pat", newly_awarded=newly_awarded, held=held)
+
+    async def select_rows(self, query, args=None, row_type=None):
+        return []
+
+    async def execute(self, query, args=None):
+        self.events.append(args)
+        return len(self.events)
+
+
+def ctf_services(db):
+    return CtfServices(db, None, FactPrefetcher(db, FACT_SOURCES["stub"]), AchievementCatalog(Achievements.builtin()), TTLCache())
+
+
+async def published(rd_con, action):
+    pubsub = rd_con.pubsub()
+    await pubsub.subscribe("achievement", "community-message")
+    for _ in range(2):
+        await pubsub.get_message(timeout=1)
+    result = await action()
+    messages = []
+    while (message := await pubsub.get_message(timeout=0.1)) is not None:
+        messages.append((message["channel"].decode(), message["data"].decode()))
+    return result, messages
+
+
+def test_ctf_action_writes_the_award_once():
+    db = FakeDb()
+    ctf = ctf_services(db)
+
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        first = await published(rd_con, lambda: ctf_action(ctf, rd_con, *BADGE, 17, Achievements().HELLO_WORLD))
+        repeat = await published(rd_con, lambda: ctf_action(ctf, rd_con, *BADGE, 17, Achievements().HELLO_WORLD))
+        return first, repeat
+
+    (response, messages), (repeat_response, repeat_messages) = asyncio.run(run())
+
+    assert db.awards == {Achievements().HELLO_WORLD.id}
+    assert len(db.events) == 2
+    assert response == {"status": "SUCCESS", "message": "pat unlocked: Hello World for 5 points!"}
+    assert [channel for channel, _ in messages] == ["achievement"]
+    assert json.loads(messages[0][1])["handle"] == "pat"
+    # answered from the held-achievements cache
+    assert repeat_response["message"] == "pat has already unlocked: Hello World"
+    assert repeat_messages == [("community-message", "pat has already unlocked: Hello World")]
+
+
+def test_ctf_action_reports_an_unregistered_badge():
+    db = FakeDb(registered=False)
+
+    async def run():
+        return await ctf_action(ctf_services(db), fakeredis.aioredis.FakeRedis(), *BADGE, 17, Achievements().HELLO_WORLD)
+
+    response = asyncio.run(run())
+
+    assert response["status"] == "ERROR"
+    assert not db.awards
+
+
+def test_rick_roll_link_awards_the_achievement():
+    db = FakeDb()
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(ctf=ctf_services(db))))
+
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        return await published(rd_con, lambda: capture_the_flag(request, encoder("&".join(BADGE)), rd_con))
+
+    response, messages = asyncio.run(run())
+
+    assert response.status_code == 302
+    assert db.awards == {Achievements().RICK_ROLLED.id}
+    assert json.loads(messages[0][1])["name"] == "Rick Rolled"
@@ -0,0 +1,81 @@
+import asyncio
+
+from utilities.facts import FACT_SOURCES, STUB_FACTS, FactPrefetcher
+
+
+class FakeDb:
+    async def select_rows(self, query, args=None, row_type=None):
+        return []
+
+
+async def wait_until(condition, timeout=1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_stub_source_keeps_the_buffer_full():
+    async def run():
+        prefetcher = FactPrefetcher(FakeDb(), FACT_SOURCES["stub"], size=3)
+        prefetcher.start()
+        try:
+            await wait_until(lambda: prefetcher.stats()["depth"] == 3)
+            fact = prefetcher.take_fact()
+            await wait_until(lambda: prefetcher.stats()["depth"] == 3)
+            return fact, prefetcher.stats()
+        finally:
+            await prefetcher.close()
+
+    fact, stats = asyncio.run(run())
+
+    assert fact in STUB_FACTS
+    assert stats == {"depth": 3, "flushed": 4, "failed": 0, "dropped": 0}
+
+
+def test_takes_from_an_empty_buffer_are_counted():
+    def unreachable(timeout):
+        raise ConnectionError("facts api is down")
+
+    async def run():
+        prefetcher = FactPrefetcher(FakeDb(), unreachable, size=3)
+        prefetcher.start()
+        try:
+            await wait_until(lambda: prefetcher.failed == 1)
+            return prefetcher.take_fact(), prefetcher.stats()
+        finally:
+            await prefetcher.close()
+
+    fact, stats = asyncio.run(run())
+
+    assert fact is None
+    assert stats["depth"] == 0 and stats["dropped"] == 1
+
+
+def test_takes_do_not_refetch_until_refill_seconds_after_a_failure():
+    calls = []
+
+    def unreachable(timeout):
+        calls.append(timeout)
+        raise ConnectionError("facts api is down")
+
+    async def run():
+        prefetcher = FactPrefetcher(FakeDb(), unreachable, size=3, refill_seconds=0.2)
+        prefetcher.start()
+        try:
+            await wait_until(lambda: prefetcher.failed == 1)
+            for _ in range(20):
+                prefetcher.take_fact()
+                await asyncio.sleep(0.001)
+            during_backoff = len(calls)
+            await asyncio.sleep(0.2)
+            prefetcher.take_fact()
+            await wait_until(lambda: prefetcher.failed == 2)
+            return during_backoff, prefetcher.stats()
+        finally:
+            await prefetcher.close()
+
+    during_backoff, stats = asyncio.run(run())
+
+    assert during_backoff == 1
+    assert stats["dropped"] == 21
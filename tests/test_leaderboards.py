@@ -0,0 +1,128 @@
+import asyncio
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+import fakeredis.aioredis
+
+from routers.games import insert_my_game_score
+from utilities.leaderboards import (
+    BUILT_KEY,
+    forget_handle,
+    game_key,
+    read_game_leaderboard,
+    record_game_score,
+    sort_key,
+)
+
+
+class FakeDb:
+    def __init__(self, handles):
+        self.handles = handles
+        self.lookups = 0
+
+    async def select_rows(self, query, args):
+        self.lookups += 1
+        return [(user_uuid, self.handles[user_uuid]) for user_uuid in args["uuids"] if user_uuid in self.handles]
+
+
+def test_sort_key_orders_like_the_numbers():
+    values = [Decimal(v) for v in ("-10", "-1.5", "-1", "-0.51", "-0.5", "0", "0.5", "0.51", "1", "1.5", "9", "10", "9007199254740993")]
+
+    assert sorted(values, key=sort_key) == values
+    assert sort_key(9007199254740993) > sort_key(9007199254740992)
+
+
+async def build_board(rd_con, db, scores):
+    for record_id, user_uuid, score, duration in scores:
+        await record_game_score(rd_con, "snake", record_id, user_uuid, score, duration, db.handles.get(user_uuid))
+    await rd_con.sadd(BUILT_KEY, game_key("snake"))
+
+
+def test_ties_follow_the_sql_order():
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        db = FakeDb({"a": "alice", "b": "bob"})
+        # score desc, duration asc, id asc -- the SQL "best" order
+        scores = [(4, "b", 100, 5), (2, "a", 100, 9), (3, "b", 100, 9), (1, "a", 99.5, 1), (5, "a", 12, 30)]
+        await build_board(rd_con, db, scores)
+        best = await read_game_leaderboard(rd_con, db, "snake", 0, 10, "best")
+        worst = await read_game_leaderboard(rd_con, db, "snake", 0, 10, "worst")
+        return best, worst
+
+    best, worst = asyncio.run(run())
+
+    assert [row["row_id"] for row in best] == [4, 2, 3, 1, 5]
+    assert [row["row_id"] for row in worst] == [5, 1, 3, 2, 4]
+    assert best[3] == {"game_name": "snake", "score": 99.5, "duration": 1, "discord_handle": "alice", "row_id": 1}
+
+
+def test_scores_of_deleted_users_do_not_shorten_the_page():
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        db = FakeDb({"a": "alice", "gone": "ghost"})
+        await build_board(rd_con, db, [(1, "a", 30, 1), (2, "gone", 20, 1), (3, "a", 10, 1)])
+        del db.handles["gone"]
+        await forget_handle(rd_con, "gone")
+        page = await read_game_leaderboard(rd_con, db, "snake", 0, 2, "best")
+        return page, await rd_con.zcard(game_key("snake"))
+
+    page, remaining = asyncio.run(run())
+
+    assert [row["row_id"] for row in page] == [1, 3]
+    assert remaining == 2
+
+
+def test_forgotten_handles_are_read_again():
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        db = FakeDb({"a": "alice"})
+        await build_board(rd_con, db, [(1, "a", 30, 1)])
+        db.handles["a"] = "alice2"
+        stale = await read_game_leaderboard(rd_con, db, "snake", 0, 10, "best")
+        await forget_handle(rd_con, "a")
+        fresh = await read_game_leaderboard(rd_con, db, "snake", 0, 10, "best")
+        return stale, fresh
+
+    stale, fresh = asyncio.run(run())
+
+    assert stale[0]["discord_handle"] == "alice"
+    assert fresh[0]["discord_handle"] == "alice2"
+
+
+class ScoreDb:
+    """Stores scores the way a numeric(10, 2) column would."""
+
+    async def select_one(self, query, args=None):
+        return (3,)
+
+    async def execute(self, query, args=None, whole_row=False):
+        return (7, Decimal(str(args["score"])).quantize(Decimal("0.01")), args["duration"])
+
+
+class ScoreRequest:
+    def __init__(self, body):
+        self.body_json = body
+        self.user = [SimpleNamespace(uuid="a", mac_address="00:00:00:00:00:00", discord_handle="alice")]
+        self.headers = {"panda-xpress": "a", "panda-mac": "00:00:00:00:00:00"}
+        self.app = SimpleNamespace(state=SimpleNamespace(db=ScoreDb(), write_behind={}))
+
+    async def body(self):
+        return json.dumps(self.body_json).encode()
+
+    async def json(self):
+        return self.body_json
+
+
+def test_members_hold_the_stored_score_not_the_one_sent():
+    async def run():
+        rd_con = fakeredis.aioredis.FakeRedis()
+        response = await insert_my_game_score(ScoreRequest({"score": 99.499, "duration": 12}), "snake", rd_con)
+        return response, await rd_con.zrange(game_key("snake"), 0, -1, withscores=True)
+
+    response, members = asyncio.run(run())
+
+    assert response == {"status": "SUCCESS", "data": {"record_id": 7}}
+    [(member, score)] = members
+    assert member.decode().startswith(sort_key(Decimal("99.50")))
+    assert score == 99.5
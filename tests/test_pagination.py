@@ -0,0 +1,35 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+from utilities.pagination import decode_cursor, page_response, with_tiebreak
+
+SCORE_SORT = with_tiebreak([{"field": "score", "order": "desc"}])
+
+
+def test_page_response_encodes_psycopg_column_types():
+    user_uuid = uuid.uuid4()
+    records = [
+        {
+            "score": Decimal("12.5"),
+            "duration": datetime.timedelta(seconds=90),
+            "created_at": datetime.datetime(2024, 4, 19, 12, 30),
+            "uuid": user_uuid,
+            "row_id": 7,
+        }
+    ]
+
+    response = page_response(records, SCORE_SORT, "highest", page_size=10)
+
+    assert json.loads(response["data"]) == [{"score": 12.5, "duration": 90.0, "created_at": "2024-04-19T12:30:00", "uuid": str(user_uuid)}]
+    assert response["next_cursor"] is None
+
+
+def test_full_page_gets_a_cursor_for_its_last_row():
+    records = [{"score": Decimal(score), "row_id": row_id} for row_id, score in ((3, "30"), (1, "20"))]
+
+    response = page_response(records, SCORE_SORT, "highest", page_size=2)
+
+    assert decode_cursor(response["next_cursor"], "highest", SCORE_SORT) == ["20", 1]
+    assert "row_id" not in json.loads(response["data"])[0]
@@ -0,0 +1,82 @@
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+from connectors import pgsql
+from tests.test_pool import FakeConnection, FakePool
+
+
+@dataclass
+class Handle:
+    discord_handle: str
+
+
+class FakeCursor:
+    description = [SimpleNamespace(name="user_id")]
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def execute(self, query, args):
+        if self.error is not None:
+            raise self.error
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class CursorConnection(FakeConnection):
+    error = None
+
+    def cursor(self):
+        return FakeCursor(self.error)
+
+
+class CursorPool(FakePool):
+    def _connect(self):
+        return CursorConnection()
+
+
+def connector(monkeypatch):
+    monkeypatch.setattr(pgsql, "BoundedConnectionPool", CursorPool)
+    settings = SimpleNamespace(
+        db_connection_limit="2",
+        db_acquire_timeout="0.01",
+        db_max_waiters="0",
+        db_idle_check_seconds="30",
+        db_host="localhost",
+        db_database="badge",
+        db_user="badge",
+        db_port="5432",
+        db_password="",
+    )
+    db = pgsql.PostgreSQLConnector()
+    db.connect(settings)
+    return db
+
+
+def test_row_type_mismatch_returns_the_connection(monkeypatch):
+    db = connector(monkeypatch)
+
+    with pytest.raises(TypeError):
+        db.select_rows("SELECT user_id FROM users", row_type=Handle)
+
+    assert db.stats()["in_use"] == 0
+    db.close()
+
+
+def test_interface_error_returns_the_connection(monkeypatch):
+    db = connector(monkeypatch)
+    monkeypatch.setattr(CursorConnection, "error", psycopg2.InterfaceError("connection already closed"))
+
+    with pytest.raises(psycopg2.InterfaceError):
+        db.select_rows("SELECT user_id FROM users")
+    db.execute("UPDATE users SET discord_handle = NULL")
+
+    assert db.stats()["in_use"] == 0
+    db.close()
@@ -0,0 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from psycopg import OperationalError
+
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.query_stats import query_stats
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.description = [("id",)]
+        self.rowcount = 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, query, args):
+        self.pool.executed += 1
+        if self.pool.fail_execute:
+            raise OperationalError("server closed the connection unexpectedly")
+
+    async def fetchone(self):
+        return {"id": 42}
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, row_factory=None):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    def __init__(self, fail_checkouts=0, fail_execute=False, checkout_seconds=0.0):
+        self.fail_checkouts = fail_checkouts
+        self.fail_execute = fail_execute
+        self.checkout_seconds = checkout_seconds
+        self.checkouts = 0
+        self.executed = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        self.checkouts += 1
+        await asyncio.sleep(self.checkout_seconds)
+        if self.checkouts <= self.fail_checkouts:
+            raise OperationalError("could not connect")
+        yield FakeConnection(self)
+
+
+def connector_with(pool: FakePool) -> AsyncPostgreSQLConnector:
+    db = AsyncPostgreSQLConnector()
+    db._pool = pool
+    return db
+
+
+def test_failure_after_the_statement_was_sent_is_not_retried():
+    pool = FakePool(fail_execute=True)
+
+    with pytest.raises(OperationalError):
+        asyncio.run(connector_with(pool).execute("INSERT INTO events (x) VALUES (%(x)s) RETURNING id", {"x": 1}))
+
+    assert pool.executed == 1
+
+
+def test_failure_before_the_statement_was_sent_is_retried():
+    pool = FakePool(fail_checkouts=2)
+
+    record_id = asyncio.run(connector_with(pool).execute("INSERT INTO events (x) VALUES (%(x)s) RETURNING id", {"x": 1}))
+
+    assert record_id == 42
+    assert pool.checkouts == 3
+    assert pool.executed == 1
+
+
+def test_pool_wait_is_kept_out_of_the_statement_latency():
+    query_stats.reset()
+    db = connector_with(FakePool(checkout_seconds=0.05))
+
+    asyncio.run(db.execute("INSERT INTO waits (x) VALUES (%(x)s) RETURNING id", {"x": 1}))
+
+    (statement,) = query_stats.top()
+    assert statement["pool_wait_ms"] >= 50
+    assert statement["max_ms"] < 50
+    assert db._recent_waits.mean_ms() >= 50
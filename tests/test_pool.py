@@ -0,0 +1,86 @@
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from connectors.pool import BoundedConnectionPool, PoolAcquireTimeout, RecentWaits
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = FakeInfo()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(BoundedConnectionPool):
+    def __init__(self, *args, **kwargs):
+        self.fail_connect = False
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        if self.fail_connect:
+            raise psycopg2.OperationalError("connection refused")
+        return FakeConnection()
+
+
+def test_double_putconn_is_ignored():
+    pool = FakePool(0, 1, acquire_timeout=0.01)
+    connection_object = pool.getconn()
+    pool.putconn(connection_object)
+    pool.putconn(connection_object)
+
+    assert pool.stats()["in_use"] == 0
+    assert pool.stats()["idle"] == 1
+
+
+def test_unknown_connection_is_ignored():
+    pool = FakePool(0, 1, acquire_timeout=0.01)
+    pool.putconn(FakeConnection())
+
+    assert pool.stats()["in_use"] == 0
+    assert pool.stats()["idle"] == 0
+
+
+def test_maxconn_holds_after_a_failed_connect_and_stray_putconn():
+    pool = FakePool(0, 1, acquire_timeout=0.01)
+    connection_object = pool.getconn()
+    pool.putconn(connection_object)
+    connection_object.closed = 1  # dropped by the server while idle: the next getconn has to reconnect
+    pool.idle_check_seconds = 0
+
+    pool.fail_connect = True
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    pool.putconn(connection_object)  # the old retry path handed the stale connection back again
+
+    pool.fail_connect = False
+    held = pool.getconn()
+    with pytest.raises(PoolAcquireTimeout):
+        pool.getconn()
+    pool.putconn(held)
+    assert pool.stats()["in_use"] == 0
+
+
+def test_wait_ms_is_the_mean_over_the_window_and_decays(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("connectors.pool.time.monotonic", lambda: now[0])
+    waits = RecentWaits(window_seconds=60)
+
+    waits.record(10)
+    now[0] += 30
+    waits.record(30)
+    assert waits.mean_ms() == 20
+
+    now[0] += 45
+    assert waits.mean_ms() == 30
+    now[0] += 60
+    assert waits.mean_ms() == 0.0
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from starlette.authentication import AuthenticationBackend
+
+from request_pipeline import RequestPipelineMiddleware
+
+
+class NoAuth(AuthenticationBackend):
+    async def authenticate(self, conn):
+        return None
+
+
+async def fails_mid_body(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"[1, 2", "more_body": True})
+    raise RuntimeError("cursor closed")
+
+
+async def fails_before_start(scope, receive, send):
+    raise RuntimeError("boom")
+
+
+def call(app):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/stream", "headers": [], "query_string": b"", "client": ("127.0.0.1", 1)}
+    middleware = RequestPipelineMiddleware(app, backend=NoAuth(), record_metrics=False)
+    return sent, middleware(scope, receive, send)
+
+
+def test_error_after_the_response_started_is_re_raised():
+    sent, request = call(fails_mid_body)
+
+    with pytest.raises(RuntimeError, match="cursor closed"):
+        asyncio.run(request)
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body"]
+
+
+def test_error_before_the_response_started_becomes_a_500():
+    sent, request = call(fails_before_start)
+
+    asyncio.run(request)
+
+    assert sent[0]["status"] == 500
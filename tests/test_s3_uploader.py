@@ -0,0 +1,90 @@
+import gzip
+
+from s3_logger import S3TimedRotatingFileHandler, S3Uploader
+
+
+class FlakyS3:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = 0
+        self.uploads = []
+
+    def upload_file(self, file_path, bucket_name, s3_path, ExtraArgs):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("s3 is unreachable")
+        with open(file_path, "rb") as uploaded:
+            self.uploads.append((bucket_name, s3_path, ExtraArgs, uploaded.read()))
+
+
+def rotated_log(tmp_path, content=b"line\n"):
+    file_path = tmp_path / "badge-api.log.2024-04-19_12-00"
+    file_path.write_bytes(content)
+    return str(file_path)
+
+
+def test_upload_retries_then_ships_the_gzipped_file(tmp_path):
+    s3 = FlakyS3(failures=2)
+    uploader = S3Uploader(s3, "logs-bucket", retries=3, retry_delay=0)
+
+    s3_path = uploader.upload(rotated_log(tmp_path), "logs/badge-api.log.gz")
+
+    assert s3_path == "logs/badge-api.log.gz"
+    assert s3.attempts == 3
+    ((bucket_name, _, extra_args, body),) = s3.uploads
+    assert (bucket_name, extra_args, gzip.decompress(body)) == ("logs-bucket", {"ContentEncoding": "gzip"}, b"line\n")
+    assert uploader.stats() == {"depth": 0, "flushed": 1, "failed": 0, "dropped": 0}
+    assert not list(tmp_path.glob("*.gz"))
+
+
+def test_upload_gives_up_after_the_last_retry(tmp_path):
+    s3 = FlakyS3(failures=10)
+    uploader = S3Uploader(s3, "logs-bucket", retries=2, retry_delay=0)
+
+    assert uploader.upload(rotated_log(tmp_path), "logs/badge-api.log.gz") is None
+    assert s3.attempts == 3
+    assert uploader.stats()["failed"] == 1
+
+
+def test_uncompressed_upload_deletes_the_file_once_shipped(tmp_path):
+    s3 = FlakyS3()
+    uploader = S3Uploader(s3, "logs-bucket", retry_delay=0)
+    file_path = rotated_log(tmp_path, b"stacks 1\n")
+
+    uploader.upload(file_path, "logs/kind=profile/x.collapsed", compress=False)
+
+    assert s3.uploads == [("logs-bucket", "logs/kind=profile/x.collapsed", {}, b"stacks 1\n")]
+    assert not list(tmp_path.iterdir())
+
+
+def test_full_backlog_drops_new_files(tmp_path):
+    # not started, so nothing drains the backlog
+    uploader = S3Uploader(FlakyS3(), "logs-bucket", max_backlog=2)
+
+    accepted = [uploader.submit(str(tmp_path / f"log.{n}")) for n in range(3)]
+
+    assert accepted == [True, True, False]
+    assert uploader.stats() == {"depth": 2, "flushed": 0, "failed": 0, "dropped": 1}
+
+
+def test_queued_files_are_shipped_before_stop_returns(tmp_path):
+    s3 = FlakyS3()
+    uploader = S3Uploader(s3, "logs-bucket", retry_delay=0)
+    uploader.start()
+
+    uploader.submit(rotated_log(tmp_path), "logs/badge-api.log.gz")
+    uploader.stop(timeout=5)
+
+    assert not uploader.is_alive()
+    assert [s3_path for _, s3_path, _, _ in s3.uploads] == ["logs/badge-api.log.gz"]
+
+
+def test_handler_points_its_client_at_a_stand_in_endpoint(tmp_path):
+    handler = S3TimedRotatingFileHandler(
+        str(tmp_path / "badge-api.log"), "logs-bucket", "test-key", "test-secret", endpoint_url="http://localhost:9000"
+    )
+    try:
+        assert handler.s3_client.meta.endpoint_url == "http://localhost:9000"
+        assert handler.uploader.s3_client is handler.s3_client
+    finally:
+        handler.close()
@@ -0,0 +1,32 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+
+import routers.tests
+
+
+class FakeSyncDb:
+    def select(self, query, args=None):
+        now = datetime.datetime(2024, 1, 1)
+        return [{"id": 1, "created_at": now, "updated_at": now}]
+
+
+def test_db_routes_need_the_debug_token():
+    app = FastAPI()
+    app.include_router(routers.tests.router)
+    app.state.sync_db = FakeSyncDb()
+    app.state.db = SimpleNamespace()
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            disabled = await client.get("/db-get/1")
+            app.state.debug_token = "secret"
+            wrong = await client.get("/db-get", headers={"x-debug-token": "guess"})
+            refused_insert = await client.post("/db-insert", headers={"x-debug-token": "guess"})
+            allowed = await client.get("/db-get", headers={"x-debug-token": "secret"})
+            return disabled.status_code, wrong.status_code, refused_insert.status_code, allowed.status_code
+
+    assert asyncio.run(run()) == (404, 403, 403, 200)
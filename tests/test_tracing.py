@@ -0,0 +1,60 @@
+import pytest
+
+import tracing
+from tracing import db_span, normalize_sql, redis_span
+from utilities.query_stats import observe_query
+
+
+@pytest.fixture
+def spans():
+    tracing.span_exporter.clear()
+    yield tracing.span_exporter
+    tracing.span_exporter.clear()
+
+
+def test_normalize_sql_replaces_literals_and_keeps_placeholders():
+    query = """
+        select * from game_score
+        where game_name = 'snake' and score > 10.5 and user_uuid = %(uuid)s
+        LIMIT 20
+    """
+
+    assert normalize_sql(query) == "select * from game_score where game_name = ? and score > ? and user_uuid = %(uuid)s LIMIT ?"
+
+
+def test_db_span_is_named_after_the_operation(spans):
+    with db_span("UPDATE users set discord_handle = 'x' where id = 3"):
+        pass
+
+    (span,) = spans.get_finished_spans()
+    assert span.name == "UPDATE"
+    assert span.kind == tracing.SpanKind.CLIENT
+    assert dict(span.attributes) == {
+        "db.system": "postgresql",
+        "db.operation": "UPDATE",
+        "db.statement": "UPDATE users set discord_handle = ? where id = ?",
+    }
+
+
+def test_observed_query_records_rows_and_errors(spans):
+    with observe_query("select id from users") as observed:
+        observed.set_rows([(1,), (2,)])
+    with pytest.raises(ValueError):
+        with observe_query("select 1"):
+            raise ValueError("bad")
+
+    selected, failed = spans.get_finished_spans()
+    assert selected.attributes["db.row_count"] == 2
+    assert [event.name for event in failed.events] == ["exception"]
+
+
+def test_redis_spans_record_command_names_only(spans):
+    with redis_span([("GET", "secret-key")]):
+        pass
+    with redis_span([("ZADD", "board", {"member": 1}), ("SET", "handle", "value")], pipeline=True):
+        pass
+
+    single, pipeline = spans.get_finished_spans()
+    assert single.name == "GET" and single.attributes["db.statement"] == "GET"
+    assert pipeline.name == "PIPELINE"
+    assert dict(pipeline.attributes) == {"db.system": "redis", "db.statement": "ZADD SET", "db.redis.pipeline_length": 2}
@@ -0,0 +1,81 @@
+import asyncio
+
+from psycopg import IntegrityError, OperationalError
+
+from utilities.write_behind import WriteBehindBuffer
+
+
+class FakeDb:
+    """Mimics one-transaction batches: any bad row fails the whole ``execute_many``."""
+
+    def __init__(self, batch_error=IntegrityError):
+        self.batch_error = batch_error
+        self.batches = 0
+        self.rows = 0
+
+    async def execute_many(self, query, args_list, whole_row=False):
+        self.batches += 1
+        if any(params["user_id"] is None for params in args_list):
+            raise self.batch_error("insert or update violates foreign key constraint")
+        return [params["n"] for params in args_list]
+
+    async def execute(self, query, args, whole_row=False):
+        self.rows += 1
+        if args["user_id"] is None:
+            raise IntegrityError("insert or update violates foreign key constraint")
+        return args["n"]
+
+
+async def write_all(db, rows):
+    buffer = WriteBehindBuffer(db, "INSERT ... RETURNING id", max_batch=10, max_delay_seconds=0.01)
+    buffer.start()
+    try:
+        return buffer, await asyncio.gather(*(buffer.write(params) for params in rows), return_exceptions=True)
+    finally:
+        await buffer.close()
+
+
+def test_one_bad_row_fails_only_its_own_writer():
+    db = FakeDb()
+    rows = [{"n": 1, "user_id": 7}, {"n": 2, "user_id": None}, {"n": 3, "user_id": 7}]
+
+    buffer, results = asyncio.run(write_all(db, rows))
+
+    assert results[0] == 1 and results[2] == 3
+    assert isinstance(results[1], IntegrityError)
+    assert db.batches == 1 and db.rows == 3
+    assert buffer.stats() == {"depth": 0, "flushed": 2, "failed": 1, "dropped": 0}
+
+
+def test_connection_errors_fail_the_batch_without_replaying():
+    db = FakeDb(batch_error=OperationalError)
+    rows = [{"n": 1, "user_id": 7}, {"n": 2, "user_id": None}]
+
+    buffer, results = asyncio.run(write_all(db, rows))
+
+    assert all(isinstance(result, OperationalError) for result in results)
+    assert db.rows == 0
+    assert buffer.stats()["failed"] == 2
+
+
+def test_good_batch_returns_ids_in_order():
+    db = FakeDb()
+
+    _, results = asyncio.run(write_all(db, [{"n": n, "user_id": 7} for n in range(5)]))
+
+    assert results == [0, 1, 2, 3, 4]
+    assert db.batches == 1
+
+
+def test_buffered_writes_return_immediately():
+    async def scenario():
+        buffer = WriteBehindBuffer(FakeDb(), "INSERT ... RETURNING id", durable=False, max_pending=1)
+        first = await buffer.write({"n": 1, "user_id": 7})
+        dropped = buffer.put_nowait({"n": 2, "user_id": 7})
+        await buffer.close()
+        return first, dropped, buffer.stats()
+
+    first, accepted, stats = asyncio.run(scenario())
+
+    assert first is None and accepted is False
+    assert stats["flushed"] == 1 and stats["dropped"] == 1
@@ -0,0 +1,135 @@
+import logging
+import re
+import socket
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Iterable, Optional, Tuple
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+
+import config
+
+logger = logging.getLogger("s3logger")
+
+# statements are exported as span attributes, keep them bounded
+MAX_STATEMENT_LENGTH = 2048
+
+# both set by configure_tracing; until then (and with TRACE_EXPORTER=none) the span helpers return immediately
+tracing_enabled = False
+span_exporter: Optional[InMemorySpanExporter] = None
+
+# a proxy until configure_tracing installs the provider, then it hands out real spans
+tracer = trace.get_tracer("ckc-badge-api")
+
+
+def configure_tracing(settings: config.SettingsFromEnvironment):
+    """Install the global tracer provider described by ``settings.trace_exporter`` and ``settings.trace_sample_ratio``.
+
+    otlp (to the collector), console, memory (kept in ``span_exporter`` for tests and benchmarks) or none. Sampling is
+    decided once when the request span starts and inherited by its db / redis children; an incoming traceparent header
+    keeps the caller's decision. OpenTelemetry only takes one global provider, so later calls are ignored.
+    """
+    global tracing_enabled, span_exporter
+    exporter = settings.trace_exporter.lower()
+    if tracing_enabled or exporter == "none":
+        return
+
+    sample_ratio = float(settings.trace_sample_ratio)
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "ckc-badge-api", "host.name": socket.gethostname()}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    if exporter == "memory":
+        span_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+    elif exporter == "console":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+    else:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=f"http://{settings.otel_collector_svc}:4317", insecure=True)))
+    trace.set_tracer_provider(provider)
+    tracing_enabled = True
+    logger.info(f"Tracing to {exporter}, sampling {sample_ratio:.0%} of requests")
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w%)])-?\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=512)
+def normalize_sql(query: str) -> str:
+    """Whitespace collapsed and inline literals replaced with ``?``; ``%(name)s`` placeholders are kept as-is."""
+    statement = _STRING_LITERAL.sub("?", query)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return statement[:MAX_STATEMENT_LENGTH]
+
+
+@contextmanager
+def db_span(query: str, system: str = "postgresql"):
+    """CLIENT span around one statement, named after its operation (``SELECT``, ``INSERT``, ``WITH``...)."""
+    if not tracing_enabled:
+        yield trace.INVALID_SPAN
+        return
+    statement = normalize_sql(query)
+    operation = statement.split(" ", 1)[0].upper()
+    with tracer.start_as_current_span(
+        operation, kind=SpanKind.CLIENT, attributes={"db.system": system, "db.operation": operation, "db.statement": statement}
+    ) as span:
+        yield span
+
+
+def set_row_count(span: Span, rows: Any):
+    if span.is_recording():
+        if isinstance(rows, list):
+            span.set_attribute("db.row_count", len(rows))
+        elif rows is not None and rows >= 0:
+            span.set_attribute("db.row_count", rows)
+
+
+@contextmanager
+def redis_span(commands: Iterable[Tuple[Any, ...]], pipeline: bool = False):
+    """CLIENT span around a redis command or pipeline; only command names are recorded, never keys or values."""
+    if not tracing_enabled:
+        yield trace.INVALID_SPAN
+        return
+    names = [str(args[0]).upper() for args in commands]
+    name = "PIPELINE" if pipeline else names[0]
+    with tracer.start_as_current_span(name, kind=SpanKind.CLIENT, attributes={"db.system": "redis", "db.statement": " ".join(names)}) as span:
+        if pipeline:
+            span.set_attribute("db.redis.pipeline_length", len(names))
+        yield span
+
+
+def start_request_span(method: str, headers) -> Tuple[Span, object]:
+    """SERVER span for one request, made current until ``end_request_span``; honours an incoming ``traceparent``."""
+    span = tracer.start_span(f"{method} request", context=propagate.extract(headers), kind=SpanKind.SERVER, attributes={"http.method": method})
+    token = context.attach(trace.set_span_in_context(span))
+    return span, token
+
+
+def end_request_span(span: Span, token: object, route: str, status_code: int, request_id: str, exc: Optional[BaseException] = None):
+    if span.is_recording():
+        method = span.attributes.get("http.method")
+        span.update_name(f"{method} {route}")
+        span.set_attributes({"http.route": route, "http.status_code": status_code, "request.id": request_id})
+        if exc is not None:
+            span.record_exception(exc)
+        if status_code >= 500:
+            span.set_status(Status(StatusCode.ERROR))
+    span.end()
+    context.detach(token)
@@ -1,23 +1,48 @@
 import logging
 import random
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Iterable, List, Mapping, Optional
 
-from connectors.pgsql import PostgreSQLConnector, nullify
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.auth_cache import TTLCache
 
 logger = logging.getLogger("s3logger")
 
 
-@dataclass
-class UserAchievementView:
-    id: int
-    name: str
-    points: int
-    description: str
-    user_has_achievement: str
+@dataclass(slots=True)
+class AwardResult:
+    user_id: int
+    discord_handle: str
+    newly_awarded: bool
+    # achievement ids the user held before this award
+    held: List[int] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class HeldAchievements:
+    """A user's achievements as a bitset (bit n set = holds achievement id n)."""
+
+    user_id: int
+    discord_handle: str
+    bits: int = 0
 
+    def has(self, achievement_id: int) -> bool:
+        return bool(self.bits >> achievement_id & 1)
 
-@dataclass
+    def add(self, achievement_id: int):
+        self.bits |= 1 << achievement_id
+
+    @classmethod
+    def from_award(cls, award: AwardResult, achievement_id: int) -> "HeldAchievements":
+        held = cls(award.user_id, award.discord_handle)
+        for held_id in award.held:
+            held.add(held_id)
+        held.add(achievement_id)
+        return held
+
+
+@dataclass(slots=True)
 class Achievement:
     id: int
     name: str
@@ -25,7 +50,7 @@ class Achievement:
     description: str
 
 
-@dataclass
+@dataclass(slots=True)
 class StaffMember:
     id: int
     discord_handle: str
@@ -82,66 +107,106 @@ class Achievements:
     def HELLO_WORLD(self) -> Achievement:
         return self._HELLO_WORLD
 
+    @classmethod
+    def builtin(cls) -> List[Achievement]:
+        return [value for value in vars(cls).values() if isinstance(value, Achievement)]
+
+
+class AchievementCatalog:
+    """Read-only view of ``cackalacky.achievements``, indexed by id; loaded once at startup."""
+
+    __slots__ = ("_by_id",)
+
+    def __init__(self, achievements: Iterable[Achievement]):
+        self._by_id: Mapping[int, Achievement] = MappingProxyType({achievement.id: achievement for achievement in achievements})
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def get(self, achievement_id: int) -> Optional[Achievement]:
+        return self._by_id.get(achievement_id)
 
-def get_random_staff_member(db_connection: PostgreSQLConnector) -> Optional[StaffMember]:
+    def resolve(self, achievement: Achievement) -> Achievement:
+        """The catalog's row for a built-in ``Achievements`` entry (falls back to the built-in)."""
+        return self._by_id.get(achievement.id, achievement)
+
+
+async def load_achievement_catalog(db_connection: AsyncPostgreSQLConnector) -> AchievementCatalog:
     query = """
-    select id, discord_handle, discord_user_id from staff;
+    select id, name, points, description from cackalacky.achievements;
     """
 
     try:
-        staff_df = db_connection.select_dataframe(query)
-        if len(staff_df) == 0:
-            return None
-
-        random_staff = random.randint(1, len(staff_df))
-        user_dict = staff_df.to_dict("records")[random_staff - 1]
-        return StaffMember(id=user_dict["id"], discord_handle=user_dict["discord_handle"], discord_user_id=user_dict["discord_user_id"])
+        catalog = AchievementCatalog(await db_connection.select_rows(query, row_type=Achievement))
+        logger.info(f"Loaded {len(catalog)} achievements")
+        return catalog
     except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        return None
+        logger.error(f"Could not load achievement catalog, using built-in entries: {e}")
+        return AchievementCatalog(Achievements.builtin())
 
 
-def get_achievement_by_ctf_id_and_user_id(db_connection: PostgreSQLConnector, user_id: int, ctf_id: int) -> Optional[UserAchievementView]:
+async def get_staff_members(db_connection: AsyncPostgreSQLConnector) -> List[StaffMember]:
     query = """
-    SELECT ach.id,
-               name,
-               points,
-               description,
-               case when ua.user_id is not null then 1 else 0 end as user_has_achievement
-        FROM cackalacky.achievements ach
-        LEFT JOIN cackalacky.user_achievements ua ON ua.achievement_id = ach.id AND ua.user_id = %(user_id)s
-        where ach.id = %(ctf_id)s;
+    select id, discord_handle, discord_user_id from staff;
     """
 
-    params = {"user_id": user_id, "ctf_id": ctf_id}
+    return await db_connection.select_rows(query, row_type=StaffMember)
+
 
+async def get_random_staff_member(db_connection: AsyncPostgreSQLConnector) -> Optional[StaffMember]:
     try:
-        achievement_df = db_connection.select_dataframe(query, params)
-        if len(achievement_df) == 0:
+        staff = await get_staff_members(db_connection)
+        if len(staff) == 0:
             return None
 
-        user_dict = achievement_df.to_dict("records")[0]
-        return UserAchievementView(
-            id=user_dict["id"],
-            name=user_dict["name"],
-            points=user_dict["points"],
-            description=user_dict["description"],
-            user_has_achievement=user_dict["user_has_achievement"],
-        )
+        return random.choice(staff)
     except Exception as e:
         logger.error(f"An error occurred: {e}")
         return None
 
 
-def insert_user_achievement(db_connection: PostgreSQLConnector, user_id: int, achievement_id: int):
-    query = f"""
-    INSERT INTO cackalacky.user_achievements (user_id, achievement_id) VALUES (%(user_id)s, %(achievement_id)s) RETURNING id;
+async def award_achievement(db_connection: AsyncPostgreSQLConnector, uuid: str, mac_address: str, achievement_id: int) -> Optional[AwardResult]:
+    """Look up the badge's user and award the achievement in one statement.
+
+    ``None`` when the badge isn't registered. Safe under concurrent hits: the unique
+    (user_id, achievement_id) constraint (sql/user_achievements_unique.sql) lets exactly one
+    insert win, and only that caller sees ``newly_awarded``.
+    """
+    query = """
+    WITH badge_user AS (
+        SELECT id, discord_handle FROM cackalacky.users WHERE uuid = %(uuid)s AND mac_address = %(mac_address)s
+    ), awarded AS (
+        INSERT INTO cackalacky.user_achievements (user_id, achievement_id)
+        SELECT id, %(achievement_id)s FROM badge_user
+        ON CONFLICT (user_id, achievement_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT id AS user_id,
+           discord_handle,
+           EXISTS (SELECT 1 FROM awarded) AS newly_awarded,
+           ARRAY(SELECT achievement_id FROM cackalacky.user_achievements WHERE user_id = badge_user.id) AS held
+    FROM badge_user;
     """
 
-    params = {"user_id": nullify(user_id), "achievement_id": nullify(achievement_id)}
+    params = {"uuid": uuid, "mac_address": mac_address, "achievement_id": achievement_id}
+    return await db_connection.select_one(query, params, row_type=AwardResult)
 
-    try:
-        new_user_achievement_id = db_connection.execute(query, params)
-        return new_user_achievement_id
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
+
+async def unlock_achievement(
+    db_connection: AsyncPostgreSQLConnector, held_cache: TTLCache, uuid: str, mac_address: str, achievement_id: int
+) -> Optional[AwardResult]:
+    """``award_achievement`` fronted by a per-badge cache of held achievements.
+
+    Repeat scans of an achievement the badge already holds are answered from the cache with no query.
+    A stale cache can only claim "not held" (awards are never revoked), which falls through to the
+    authoritative award statement, so other replicas' caches need no invalidation.
+    """
+    key = (uuid, mac_address)
+    hit, held = held_cache.get(key)
+    if hit and held.has(achievement_id):
+        return AwardResult(held.user_id, held.discord_handle, False)
+
+    award = await award_achievement(db_connection, uuid, mac_address, achievement_id)
+    if award:
+        held_cache.set(key, HeldAchievements.from_award(award, achievement_id))
+    return award
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger("s3logger")
+
+USER_CACHE_CHANNEL = "user-cache-invalidate"
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a TTL.
+
+    Empty values (e.g. a badge with no user row) are cached as negative entries with
+    their own, shorter TTL so a freshly registered badge is picked up quickly even if
+    the invalidation message is missed. Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 300, negative_ttl_seconds: float = 15):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def set(self, key: Hashable, value: Any):
+        ttl = self.ttl_seconds if value else self.negative_ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+
+async def publish_user_invalidation(rd_con: aioredis.Redis, uuid: str, mac_address: str):
+    """Tell every replica to drop its cached lookup for a badge (call after a user registers or changes)."""
+    await rd_con.publish(USER_CACHE_CHANNEL, json.dumps({"uuid": uuid, "mac_address": mac_address}))
+
+
+def apply_invalidation(cache: TTLCache, payload):
+    message = json.loads(payload)
+    if message.get("all"):
+        cache.clear()
+    else:
+        cache.invalidate((message["uuid"], message["mac_address"]))
+
+
+async def listen_for_invalidations(cache: TTLCache, rd_con: aioredis.Redis, retry_seconds: float = 5):
+    """Background task: apply invalidations published on ``USER_CACHE_CHANNEL`` until cancelled."""
+    while True:
+        pubsub = rd_con.pubsub()
+        try:
+            await pubsub.subscribe(USER_CACHE_CHANNEL)
+            # anything cached while we weren't subscribed may have missed its invalidation
+            cache.clear()
+            while True:
+                # poll with a timeout rather than listen(): a blocking read would trip the pool's socket_timeout
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    apply_invalidation(cache, message["data"])
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Ignoring malformed user cache invalidation {message['data']}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"User cache invalidation listener failed, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from psycopg import AsyncConnection
+
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.pagination import json_default
+
+logger = logging.getLogger("s3logger")
+
+MAX_EVENTS_PER_POLL = 50
+BADGE_EVENT_CHANNEL = "badge_event_queue"
+FALLBACK_POLL_SECONDS = 10
+
+# Claims and marks up to %(max)s unread events in one statement. SKIP LOCKED means two
+# concurrent polls from the same badge split the rows instead of both delivering them.
+# Backed by badge_event_queue_unread_recipient_idx (sql/indexes.sql).
+DEQUEUE_BADGE_EVENTS_QUERY = """
+    UPDATE badge_event_queue q
+    set has_read = 1
+    FROM (
+        select id
+        from badge_event_queue
+        where recipient_uuid = %(uuid)s and recipient_mac_address = %(mac_address)s
+        and has_read = 0
+        ORDER BY ID ASC
+        LIMIT %(max)s
+        FOR UPDATE SKIP LOCKED
+    ) pending
+    where q.id = pending.id
+    RETURNING q.id, q.badge_action, q.event_message
+"""
+
+# The SSE stream reads without claiming and marks each event read only once it has been sent,
+# so a client that drops mid-stream gets the rest on its next connection.
+PEEK_BADGE_EVENTS_QUERY = """
+    select id, badge_action, event_message
+    from badge_event_queue
+    where recipient_uuid = %(uuid)s and recipient_mac_address = %(mac_address)s
+    and has_read = 0 and id > %(after)s
+    ORDER BY ID ASC
+    LIMIT %(max)s
+"""
+MARK_BADGE_EVENT_READ_QUERY = "update badge_event_queue set has_read = 1 where id = %(id)s"
+
+
+async def dequeue_badge_events(db_connection: AsyncPostgreSQLConnector, uuid: str, mac_address: str, max_events: int = 1) -> List[Dict[str, Any]]:
+    params = {"uuid": uuid, "mac_address": mac_address, "max": max_events}
+    events = await db_connection.select(DEQUEUE_BADGE_EVENTS_QUERY, params)
+    # RETURNING order isn't guaranteed
+    events.sort(key=lambda event: event["id"])
+    if events:
+        logger.info(f"Updated badge_event_queue IDs {[event['id'] for event in events]} to has read")
+    return events
+
+
+async def peek_badge_events(
+    db_connection: AsyncPostgreSQLConnector, uuid: str, mac_address: str, max_events: int = 1, after: int = 0
+) -> List[Dict[str, Any]]:
+    return await db_connection.select(PEEK_BADGE_EVENTS_QUERY, {"uuid": uuid, "mac_address": mac_address, "max": max_events, "after": after})
+
+
+async def mark_badge_event_read(db_connection: AsyncPostgreSQLConnector, event_id: int):
+    await db_connection.execute(MARK_BADGE_EVENT_READ_QUERY, {"id": event_id})
+
+
+class BadgeEventNotifier:
+    """Wakes requests that are waiting on a badge's event queue.
+
+    Keyed by ``(uuid, mac_address)``; ``notify`` is driven by ``listen_for_badge_events``.
+    A wake-up only means "go look again" - the queue itself stays the source of truth.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[Tuple[str, str], Set[asyncio.Event]] = defaultdict(set)
+
+    def subscribe(self, key: Tuple[str, str]) -> asyncio.Event:
+        waiter = asyncio.Event()
+        self._waiters[key].add(waiter)
+        return waiter
+
+    def unsubscribe(self, key: Tuple[str, str], waiter: asyncio.Event):
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            return
+        waiters.discard(waiter)
+        if not waiters:
+            del self._waiters[key]
+
+    def notify(self, key: Tuple[str, str]):
+        for waiter in self._waiters.get(key, ()):
+            waiter.set()
+
+    def notify_all(self):
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                waiter.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"badges": len(self._waiters), "waiters": sum(len(waiters) for waiters in self._waiters.values())}
+
+
+async def wait_for_badge_events(
+    db_connection: AsyncPostgreSQLConnector,
+    notifier: BadgeEventNotifier,
+    uuid: str,
+    mac_address: str,
+    max_events: int,
+    timeout: float,
+    peek_after: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Dequeue up to ``max_events``, holding the request for up to ``timeout`` seconds until one arrives.
+
+    With ``peek_after`` the unread events after that id are only read, not marked; the caller marks them.
+    """
+    key = (uuid, mac_address)
+    deadline = time.monotonic() + timeout
+    while True:
+        # subscribe before looking, so a row inserted between the query and the wait still wakes us
+        waiter = notifier.subscribe(key)
+        try:
+            if peek_after is None:
+                events = await dequeue_badge_events(db_connection, uuid, mac_address, max_events)
+            else:
+                events = await peek_badge_events(db_connection, uuid, mac_address, max_events, peek_after)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            # recheck periodically anyway in case a notification was lost (e.g. listener reconnecting)
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=min(remaining, FALLBACK_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            notifier.unsubscribe(key, waiter)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['id']}\nevent: {event['badge_action']}\ndata: {json.dumps(event, default=json_default)}\n\n"
+
+
+async def stream_badge_events(
+    db_connection: AsyncPostgreSQLConnector,
+    notifier: BadgeEventNotifier,
+    uuid: str,
+    mac_address: str,
+    keepalive_seconds: float,
+) -> AsyncIterator[str]:
+    """Server-Sent Events body: every event for the badge as it is queued, plus keepalive comments.
+
+    Each event is marked read after the yield returns, i.e. once ``StreamingResponse`` has sent it.
+    A disconnect cancels the generator at the yield (Starlette watches for ``http.disconnect`` itself),
+    so an event that was not sent stays unread. Delivery is at-least-once: a second stream for the same
+    badge, or a failure between the send and the mark, can deliver an event twice (same SSE ``id``).
+    """
+    last_sent = 0
+    while True:
+        events = await wait_for_badge_events(db_connection, notifier, uuid, mac_address, MAX_EVENTS_PER_POLL, keepalive_seconds, peek_after=last_sent)
+        if not events:
+            yield ": keepalive\n\n"
+        for event in events:
+            yield format_sse(event)
+            last_sent = event["id"]
+            await mark_badge_event_read(db_connection, event["id"])
+
+
+def apply_badge_event_notification(notifier: BadgeEventNotifier, payload: str):
+    message = json.loads(payload)
+    notifier.notify((message["uuid"], message["mac_address"]))
+
+
+async def listen_for_badge_events(notifier: BadgeEventNotifier, conninfo: str, retry_seconds: float = 5):
+    """Background task: ``LISTEN`` on ``BADGE_EVENT_CHANNEL`` and wake matching waiters until cancelled.
+
+    Uses its own connection outside the pool, since it is held for the life of the process.
+    The channel is fed by the trigger in ``sql/badge_event_queue_notify.sql``.
+    """
+    while True:
+        try:
+            async with await AsyncConnection.connect(conninfo, autocommit=True) as connection:
+                await connection.execute(f"LISTEN {BADGE_EVENT_CHANNEL}")
+                # anything queued while we weren't listening never notified anyone
+                notifier.notify_all()
+                logger.info(f"Listening for badge events on {BADGE_EVENT_CHANNEL}")
+                async for notification in connection.notifies():
+                    try:
+                        apply_badge_event_notification(notifier, notification.payload)
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"Ignoring malformed badge event notification {notification.payload}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Badge event listener failed, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
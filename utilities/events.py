@@ -1,18 +1,39 @@
 import logging
+from typing import Optional
 
-from connectors.pgsql import PostgreSQLConnector, nullify
+from connectors.pgsql import nullify
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.write_behind import WriteBehindBuffer
 
 logger = logging.getLogger("s3logger")
 
+INSERT_EVENT_QUERY = "INSERT INTO cackalacky.events (event_id,uuid,mac_address) VALUES (%(event_id)s, %(uuid)s, %(mac_address)s) RETURNING id;"
 
-def log_event(db_connection: PostgreSQLConnector, event_id, uuid, mac_address):
-    insert_columns = ["event_id", "uuid", "mac_address"]
-    query = f"INSERT INTO cackalacky.events ({','.join(insert_columns)}) VALUES (%(event_id)s, %(uuid)s, %(mac_address)s) RETURNING id;"
 
-    params = {"event_id": nullify(event_id), "uuid": nullify(uuid), "mac_address": nullify(mac_address)}
+def event_params(event_id, uuid, mac_address):
+    return {"event_id": nullify(event_id), "uuid": nullify(uuid), "mac_address": nullify(mac_address)}
 
+
+async def log_event(db_connection: AsyncPostgreSQLConnector, event_id, uuid, mac_address):
     try:
-        new_event_id = db_connection.execute(query, params)
+        new_event_id = await db_connection.execute(INSERT_EVENT_QUERY, event_params(event_id, uuid, mac_address))
         return new_event_id
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+
+
+async def log_event_later(event_id: Optional[int]):
+    logger.info(f"Event logged {event_id}")
+
+
+async def queue_event(db_connection: AsyncPostgreSQLConnector, event_log: Optional[WriteBehindBuffer], event_id, uuid, mac_address):
+    """Log an event without holding up the request: it is handed to the ``event_log`` queue and inserted in a batch.
+
+    When the queue is full the event is dropped (and counted in ``queue_dropped``) rather than slowing the caller down.
+    Falls back to an inline ``log_event`` when no queue is running.
+    """
+    if event_log is None:
+        return await log_event(db_connection, event_id, uuid, mac_address)
+
+    if not event_log.put_nowait(event_params(event_id, uuid, mac_address), log_event_later):
+        logger.warning(f"Event log queue full, dropped event {event_id} for {uuid} | {mac_address}")
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import requests
+
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from utilities.achievements import StaffMember, get_staff_members
+
+logger = logging.getLogger("s3logger")
+
+FACTS_URL = "https://uselessfacts.jsph.pl/api/v2/facts/random"
+
+# FACT_SOURCE=stub: offline source for local runs and tests
+STUB_FACTS = (
+    "Honey never spoils.",
+    "Octopuses have three hearts.",
+    "A group of flamingos is called a flamboyance.",
+    "Bananas are berries, but strawberries are not.",
+    "The Eiffel Tower can be 15 cm taller during the summer.",
+)
+
+
+def fetch_remote_fact(timeout: float) -> Optional[str]:
+    response = requests.get(FACTS_URL, timeout=timeout)
+    response.raise_for_status()
+    return response.json().get("text")
+
+
+def fetch_stub_fact(timeout: float) -> Optional[str]:
+    return random.choice(STUB_FACTS)
+
+
+FACT_SOURCES: Dict[str, Callable[[float], Optional[str]]] = {"remote": fetch_remote_fact, "stub": fetch_stub_fact}
+
+
+class FactPrefetcher:
+    """Keeps facts and the staff roster in memory so ``send_fact_to`` never waits on HTTP or the ``staff`` table.
+
+    A background task tops the ring buffer back up to ``size`` facts whenever one is taken, and re-reads
+    the roster every ``staff_refresh_seconds``. After a failed fetch, takes stop waking it until
+    ``refill_seconds`` have passed, so an outage costs one fetch per ``refill_seconds``, not one per award.
+    ``stats`` uses the queue metric shape: depth = facts ready, flushed = facts fetched,
+    failed = fetch errors, dropped = takes that found the buffer empty.
+    """
+
+    def __init__(
+        self,
+        db_connection: AsyncPostgreSQLConnector,
+        fetch_fact: Callable[[float], Optional[str]],
+        size: int = 8,
+        fetch_timeout: float = 3,
+        refill_seconds: float = 30,
+        staff_refresh_seconds: float = 300,
+    ):
+        self.db_connection = db_connection
+        self.fetch_fact = fetch_fact
+        self.fetch_timeout = fetch_timeout
+        self.refill_seconds = refill_seconds
+        self.staff_refresh_seconds = staff_refresh_seconds
+        self.fetched = 0
+        self.failed = 0
+        self.empty = 0
+        self._facts: Deque[str] = deque(maxlen=size)
+        self._staff: Tuple[StaffMember, ...] = ()
+        self._staff_loaded_at = 0.0
+        self._failed_at: Optional[float] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def take_fact(self) -> Optional[str]:
+        if self._failed_at is None or time.monotonic() - self._failed_at >= self.refill_seconds:
+            self._wake.set()
+        if not self._facts:
+            self.empty += 1
+            return None
+        return self._facts.popleft()
+
+    def return_fact(self, fact: str):
+        """Put back a fact that was taken but not used."""
+        if len(self._facts) < self._facts.maxlen:
+            self._facts.appendleft(fact)
+
+    def random_staff_member(self) -> Optional[StaffMember]:
+        return random.choice(self._staff) if self._staff else None
+
+    async def _refresh_staff(self):
+        try:
+            self._staff = tuple(await get_staff_members(self.db_connection))
+            self._staff_loaded_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Could not refresh staff roster: {e}")
+
+    async def _refill(self):
+        while len(self._facts) < self._facts.maxlen:
+            try:
+                fact = await asyncio.wait_for(asyncio.to_thread(self.fetch_fact, self.fetch_timeout), timeout=self.fetch_timeout + 1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                fact, error = None, e
+            else:
+                error = "the source returned no fact"
+            if not fact:
+                self.failed += 1
+                self._failed_at = time.monotonic()
+                logger.error(f"Could not prefetch a fact: {error}")
+                return
+            self._failed_at = None
+            self._facts.append(fact)
+            self.fetched += 1
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if time.monotonic() - self._staff_loaded_at >= self.staff_refresh_seconds:
+                await self._refresh_staff()
+            await self._refill()
+            # asyncio.timeout rather than wait_for: on 3.11 wait_for drops a cancel that lands as the wake is set,
+            # which left close() waiting on a task that kept running
+            try:
+                async with asyncio.timeout(min(self.refill_seconds, self.staff_refresh_seconds)):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"depth": len(self._facts), "flushed": self.fetched, "failed": self.failed, "dropped": self.empty}
@@ -0,0 +1,245 @@
+"""Live leaderboards kept in redis sorted sets.
+
+Each score row is one zset member (``<sort key>json [id, user_uuid, value...]``) so pages come
+back with the exact stored values. The zset score is the value as a float; the member's sort key
+spells out the exact value, the rest of the order and the row id, so redis breaks float and exact
+ties the same way the SQL query (and its keyset cursor) does: ``score desc, duration asc, id asc``
+for games, ``reading desc, id desc`` for alcohol, and the exact reverse for ``worst``.
+Discord handles are cached per user for ``HANDLE_TTL_SECONDS``, falling back to postgres.
+
+A leaderboard is only served from redis once it has been rebuilt from postgres (its key is in
+``leaderboard:built``); until then, or for sort modes a zset cannot answer, callers get None
+and should run the SQL query. Cold start / after a redis flush::
+
+    python -m utilities.leaderboards rebuild
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+import config
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+from connectors.redis_pool import RedisConnector
+from utilities.pagination import ROW_ID, json_default
+
+logger = logging.getLogger("s3logger")
+
+# bumped when the member format changes, so boards are served from postgres until they are rebuilt
+BUILT_KEY = "leaderboard:built:2"
+ALCOHOL_KEY = "leaderboard:alcohol"
+
+# a handle change is picked up by the leaderboards within this long, or straight away after forget_handle
+HANDLE_TTL_SECONDS = 300
+# reads of a page that keeps finding scores of deleted users before giving up and using postgres
+PAGE_READ_ATTEMPTS = 3
+
+_COMPLEMENT = str.maketrans("0123456789", "9876543210")
+
+# sortBy -> read the zset highest-first?
+SORT_DIRECTIONS = {"best": True, "worst": False}
+
+
+def game_key(game: str) -> str:
+    return f"leaderboard:game:{game}"
+
+
+def handle_key(user_uuid: str) -> str:
+    return f"leaderboard:handle:{user_uuid}"
+
+
+def sort_key(value) -> str:
+    """``value`` spelled so that strings compare like the numbers, at any size or precision.
+
+    Sign, digit count, digits, then a terminator below every digit (above, with the digits complemented, for negatives).
+    """
+    number = Decimal(str(value))
+    integer, _, fraction = f"{abs(number):f}".partition(".")
+    integer, fraction = integer.lstrip("0"), fraction.rstrip("0")
+    digits = integer + ("." + fraction if fraction else "")
+    if number < 0:
+        return f"n{999 - len(integer):03d}{digits.translate(_COMPLEMENT)}~"
+    return f"p{len(integer):03d}{digits} "
+
+
+def game_member(record_id: int, user_uuid: str, score, duration) -> str:
+    # read highest-first for "best", so the key ascends in the reverse of score desc, duration asc, id asc
+    key = sort_key(score) + sort_key(-Decimal(str(duration))) + sort_key(-record_id)
+    return key + json.dumps([record_id, user_uuid, score, duration], default=json_default)
+
+
+def alcohol_member(record_id: int, user_uuid: str, reading) -> str:
+    # reading desc, id desc read highest-first
+    return sort_key(reading) + sort_key(record_id) + json.dumps([record_id, user_uuid, reading], default=json_default)
+
+
+def member_entry(member: bytes) -> list:
+    member = member.decode() if isinstance(member, bytes) else member
+    return json.loads(member[member.index("[") :])
+
+
+async def record_game_score(rd_con: aioredis.Redis, game: str, record_id: int, user_uuid: str, score, duration, discord_handle: Optional[str]):
+    pipe = rd_con.pipeline(transaction=False)
+    pipe.zadd(game_key(game), {game_member(record_id, user_uuid, score, duration): float(score)})
+    pipe.set(handle_key(user_uuid), json.dumps(discord_handle), ex=HANDLE_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def record_alcohol_reading(rd_con: aioredis.Redis, record_id: int, user_uuid: str, reading, discord_handle: Optional[str]):
+    pipe = rd_con.pipeline(transaction=False)
+    pipe.zadd(ALCOHOL_KEY, {alcohol_member(record_id, user_uuid, reading): float(reading)})
+    pipe.set(handle_key(user_uuid), json.dumps(discord_handle), ex=HANDLE_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def forget_handle(rd_con: aioredis.Redis, user_uuid: str):
+    """Drop a cached handle (call after a user's row changes) so the next page reads it from postgres."""
+    await rd_con.delete(handle_key(user_uuid))
+
+
+async def hydrate_handles(rd_con: aioredis.Redis, db: AsyncPostgreSQLConnector, user_uuids: List[str]) -> Dict[str, Optional[str]]:
+    """Handles by user uuid; users that no longer exist are left out."""
+    unique_uuids = list(dict.fromkeys(user_uuids))
+    if not unique_uuids:
+        return {}
+
+    cached = await rd_con.mget([handle_key(user_uuid) for user_uuid in unique_uuids])
+    handles = {user_uuid: json.loads(handle) for user_uuid, handle in zip(unique_uuids, cached) if handle is not None}
+
+    missing = [user_uuid for user_uuid in unique_uuids if user_uuid not in handles]
+    if missing:
+        rows = await db.select_rows("select uuid, discord_handle from users where uuid = ANY(%(uuids)s)", {"uuids": missing})
+        pipe = rd_con.pipeline(transaction=False)
+        for user_uuid, discord_handle in rows:
+            handles[str(user_uuid)] = discord_handle
+            pipe.set(handle_key(str(user_uuid)), json.dumps(discord_handle), ex=HANDLE_TTL_SECONDS)
+        if rows:
+            await pipe.execute()
+
+    return handles
+
+
+async def read_page(
+    rd_con: aioredis.Redis, db: AsyncPostgreSQLConnector, key: str, offset: int, limit: int, sort_by: str
+) -> Optional[Tuple[List[list], Dict[str, Optional[str]]]]:
+    """Entries and their handles for one page, or None if redis can't answer it.
+
+    Scores of users that have since been deleted are removed from the board and the page is read
+    again, so a page is only short at the end of the board (the SQL query joins them away too).
+    """
+    if sort_by not in SORT_DIRECTIONS:
+        return None
+
+    for _ in range(PAGE_READ_ATTEMPTS):
+        pipe = rd_con.pipeline(transaction=False)
+        pipe.sismember(BUILT_KEY, key)
+        pipe.zrange(key, offset, offset + limit - 1, desc=SORT_DIRECTIONS[sort_by])
+        is_built, members = await pipe.execute()
+        if not is_built:
+            return None
+
+        entries = [member_entry(member) for member in members]
+        handles = await hydrate_handles(rd_con, db, [entry[1] for entry in entries])
+        orphans = [member for member, entry in zip(members, entries) if entry[1] not in handles]
+        if not orphans:
+            return entries, handles
+        logger.info(f"Removing {len(orphans)} scores of deleted users from {key}")
+        await rd_con.zrem(key, *orphans)
+
+    return None
+
+
+async def read_game_leaderboard(
+    rd_con: aioredis.Redis, db: AsyncPostgreSQLConnector, game: str, offset: int, limit: int, sort_by: str
+) -> Optional[List[Dict[str, Any]]]:
+    """A page shaped like the SQL leaderboard rows (including ``row_id`` for the cursor), or None if redis can't answer it."""
+    page = await read_page(rd_con, db, game_key(game), offset, limit, sort_by)
+    if page is None:
+        return None
+
+    entries, handles = page
+    return [
+        {"game_name": game, "score": score, "duration": duration, "discord_handle": handles[user_uuid], ROW_ID: record_id}
+        for record_id, user_uuid, score, duration in entries
+    ]
+
+
+async def read_alcohol_leaderboard(
+    rd_con: aioredis.Redis, db: AsyncPostgreSQLConnector, offset: int, limit: int, sort_by: str
+) -> Optional[List[Dict[str, Any]]]:
+    page = await read_page(rd_con, db, ALCOHOL_KEY, offset, limit, sort_by)
+    if page is None:
+        return None
+
+    entries, handles = page
+    return [{"discord_handle": handles[user_uuid], "reading": reading, ROW_ID: record_id} for record_id, user_uuid, reading in entries]
+
+
+async def replace_zset(rd_con: aioredis.Redis, key: str, members: Dict[str, float], chunk_size: int = 1000):
+    """Load into a scratch key and RENAME over the live one so readers never see a half-built board.
+
+    Scores inserted between the postgres read and the rename are lost from redis (not postgres); run during quiet time.
+    """
+    scratch_key = f"{key}:rebuild"
+    await rd_con.delete(scratch_key)
+    items = list(members.items())
+    for start in range(0, len(items), chunk_size):
+        await rd_con.zadd(scratch_key, dict(items[start : start + chunk_size]))
+
+    if items:
+        await rd_con.rename(scratch_key, key)
+    else:
+        await rd_con.delete(key)
+    await rd_con.sadd(BUILT_KEY, key)
+
+
+async def rebuild(rd_con: aioredis.Redis, db: AsyncPostgreSQLConnector):
+    games = await db.select_rows("select game_name from game_list")
+    for (game,) in games:
+        rows = await db.select_rows(
+            """
+            SELECT gs.id, gs.user_uuid, gs.score, gs.duration
+            FROM cackalacky.game_score gs
+            JOIN users usrs on usrs.uuid = gs.user_uuid
+            where gs.game_name = %(game)s
+            """,
+            {"game": game},
+        )
+        await replace_zset(rd_con, game_key(game), {game_member(row[0], str(row[1]), row[2], row[3]): float(row[2]) for row in rows})
+        logger.info(f"Rebuilt {game_key(game)} with {len(rows)} scores")
+
+    rows = await db.select_rows(
+        """
+        SELECT ar.id, ar.user_uuid, ar.reading
+        FROM alcohol_reading ar
+        join users usrs on usrs.uuid = ar.user_uuid
+        """
+    )
+    await replace_zset(rd_con, ALCOHOL_KEY, {alcohol_member(row[0], str(row[1]), row[2]): float(row[2]) for row in rows})
+    logger.info(f"Rebuilt {ALCOHOL_KEY} with {len(rows)} readings")
+
+
+async def main(command: str):
+    settings = config.SettingsFromEnvironment()
+    db = AsyncPostgreSQLConnector()
+    await db.connect(settings)
+    redis_connector = RedisConnector()
+    redis_connector.connect(settings)
+    try:
+        if command == "rebuild":
+            await rebuild(redis_connector.aclient, db)
+    finally:
+        await redis_connector.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the redis leaderboards")
+    parser.add_argument("command", choices=["rebuild"])
+    asyncio.run(main(parser.parse_args().command))
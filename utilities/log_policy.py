@@ -0,0 +1,168 @@
+"""Runtime-adjustable policy for the ``s3logger`` request/response and query logging.
+
+Handlers log whole responses (``logger.info(response)``) and the connectors log every query and
+its args. ``LogPolicyFilter`` sits on the logger, before any handler formats the record, and:
+
+* samples per request: one decision per request (by longest matching route prefix) keeps or drops
+  all of that request's INFO payload logs together; connector query logs have their own rate;
+* truncates anything it keeps to ``max_payload_bytes``.
+
+Dropped records are never formatted, so sampled-out ``logger.info(big_dict)`` calls don't pay
+for ``str(big_dict)``. WARNING and above and records marked ``extra={"log_policy_exempt": True}``
+(the access log lines) are never sampled out.
+
+The policy lives in redis (``log-policy``) and replicas pick up changes from the
+``log-policy-update`` channel, so it can be changed without a redeploy::
+
+    python -m utilities.log_policy show
+    python -m utilities.log_policy set '{"sample_rate": 0.1, "route_sample_rates": {"/games/leaderboard": 0.01}}'
+    python -m utilities.log_policy reset
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import random
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+import config
+from connectors.redis_pool import RedisConnector
+
+logger = logging.getLogger("s3logger")
+
+LOG_POLICY_KEY = "log-policy"
+LOG_POLICY_CHANNEL = "log-policy-update"
+QUERY_LOG_MODULES = frozenset({"pgsql", "pgsql_async"})
+
+
+@dataclass(frozen=True)
+class LogPolicy:
+    sample_rate: float = 1.0
+    # path prefix -> sample rate; the longest matching prefix wins
+    route_sample_rates: Dict[str, float] = field(default_factory=dict)
+    query_sample_rate: float = 1.0
+    max_payload_bytes: int = 4096
+
+    def rate_for(self, path: str) -> float:
+        best = None
+        for prefix in self.route_sample_rates:
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.route_sample_rates[best] if best is not None else self.sample_rate
+
+    @classmethod
+    def from_json(cls, payload) -> "LogPolicy":
+        values = json.loads(payload) if payload else {}
+        known = {f.name for f in dataclasses.fields(cls)}
+        return cls(**{name: value for name, value in values.items() if name in known})
+
+    def to_json(self) -> str:
+        return json.dumps(dataclasses.asdict(self))
+
+
+_policy = LogPolicy()
+# (keep payload logs, keep query logs) for the current request; None outside a request
+_sampled: ContextVar[Optional[Tuple[bool, bool]]] = ContextVar("log_sampled", default=None)
+
+
+def current_policy() -> LogPolicy:
+    return _policy
+
+
+def set_policy(policy: LogPolicy):
+    global _policy
+    _policy = policy
+
+
+def begin_request(path: str) -> Token:
+    policy = _policy
+    return _sampled.set((random.random() < policy.rate_for(path), random.random() < policy.query_sample_rate))
+
+
+def end_request(token: Token):
+    _sampled.reset(token)
+
+
+class LogPolicyFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        exempt = record.levelno >= logging.WARNING or getattr(record, "log_policy_exempt", False)
+        sampled = _sampled.get()
+        if not exempt and sampled is not None:
+            keep_payloads, keep_queries = sampled
+            if not (keep_queries if record.module in QUERY_LOG_MODULES else keep_payloads):
+                return False
+
+        limit = _policy.max_payload_bytes
+        message = record.getMessage()
+        if len(message) > limit:
+            encoded = message.encode("utf-8", "replace")
+            if len(encoded) > limit:
+                message = f"{encoded[:limit].decode('utf-8', 'ignore')}... [truncated {len(encoded) - limit} bytes]"
+        # store the rendered message so handlers don't format it a second time
+        record.msg = message
+        record.args = None
+        return True
+
+
+async def listen_for_log_policy(rd_con: aioredis.Redis, retry_seconds: float = 5):
+    """Background task: load the stored policy, then apply updates from ``LOG_POLICY_CHANNEL`` until cancelled."""
+    while True:
+        pubsub = rd_con.pubsub()
+        try:
+            await pubsub.subscribe(LOG_POLICY_CHANNEL)
+            # (re)load after subscribing so an update published in between isn't missed
+            set_policy(LogPolicy.from_json(await rd_con.get(LOG_POLICY_KEY)))
+            while True:
+                # poll with a timeout rather than listen(): a blocking read would trip the pool's socket_timeout
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    set_policy(LogPolicy.from_json(message["data"]))
+                    logger.warning(f"Log policy updated: {_policy}")
+                except (ValueError, TypeError) as e:
+                    logger.error(f"Ignoring malformed log policy {message['data']}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Log policy listener failed, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
+        finally:
+            await pubsub.aclose()
+
+
+async def publish_policy(rd_con: aioredis.Redis, policy: Optional[LogPolicy]):
+    payload = policy.to_json() if policy else ""
+    if policy:
+        await rd_con.set(LOG_POLICY_KEY, payload)
+    else:
+        await rd_con.delete(LOG_POLICY_KEY)
+    await rd_con.publish(LOG_POLICY_CHANNEL, payload)
+
+
+async def main(command: str, policy_json: Optional[str]):
+    redis_connector = RedisConnector()
+    redis_connector.connect(config.SettingsFromEnvironment())
+    rd_con = redis_connector.aclient
+    try:
+        if command == "set":
+            await publish_policy(rd_con, LogPolicy.from_json(policy_json))
+        elif command == "reset":
+            await publish_policy(rd_con, None)
+        print(LogPolicy.from_json(await rd_con.get(LOG_POLICY_KEY)))
+    finally:
+        await redis_connector.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or change the runtime log policy")
+    parser.add_argument("command", choices=["show", "set", "reset"])
+    parser.add_argument("policy", nargs="?", help='JSON, e.g. \'{"sample_rate": 0.1, "max_payload_bytes": 1024}\'')
+    args = parser.parse_args()
+    asyncio.run(main(args.command, args.policy))
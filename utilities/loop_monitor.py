@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger("s3logger")
+
+# stalls kept (with their stacks) for /debug/loop
+RECENT_STALLS = 20
+# innermost frames kept per stack, so the blocking call itself survives the log policy's size cap
+STACK_DEPTH = 25
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task, and optionally catches what blocked it.
+
+    The sampler sleeps ``interval_seconds`` at a time; anything beyond that before it runs again is time
+    the loop spent on something else without yielding (a blocking call in an ``async def`` handler,
+    a big synchronous loop...). Each lag is passed to ``record_lag`` (the OTel histogram).
+
+    With ``capture_stacks`` a watchdog thread also watches the sampler's heartbeat. When the loop has not
+    come back for ``block_threshold_seconds`` past the next tick, it snapshots the loop thread's stack
+    (the code holding the loop right now) and logs it once per stall. This costs a thread waking every
+    half threshold, so it is meant for staging or for short investigations.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float = 0.5,
+        block_threshold_seconds: float = 0.1,
+        capture_stacks: bool = False,
+        record_lag: Optional[Callable[[float], None]] = None,
+        record_stall: Optional[Callable[[], None]] = None,
+    ):
+        self.interval_seconds = interval_seconds
+        self.block_threshold_seconds = block_threshold_seconds
+        self.capture_stacks = capture_stacks
+        self.record_lag = record_lag
+        self.record_stall = record_stall
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=RECENT_STALLS)
+        self.max_lag_seconds = 0.0
+        self.samples = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._sample())
+        if self.capture_stacks:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info(
+            f"Loop lag monitor every {self.interval_seconds * 1000:.0f}ms, "
+            f"stack capture {'on' if self.capture_stacks else 'off'} (threshold {self.block_threshold_seconds * 1000:.0f}ms)"
+        )
+
+    async def close(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval_seconds)
+            self._heartbeat = now = time.monotonic()
+            lag = max(now - started - self.interval_seconds, 0.0)
+            self.samples += 1
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            if self.record_lag is not None:
+                self.record_lag(lag)
+            if lag >= self.block_threshold_seconds:
+                if self.record_stall is not None:
+                    self.record_stall()
+                if not self.capture_stacks:
+                    logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms")
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stopped.wait(self.block_threshold_seconds / 2):
+            heartbeat = self._heartbeat
+            overdue = time.monotonic() - heartbeat - self.interval_seconds
+            if overdue < self.block_threshold_seconds or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=STACK_DEPTH)) if frame is not None else "<loop thread not found>"
+            self.stalls.append({"at": time.time(), "blocked_ms": round(overdue * 1000, 1), "stack": stack})
+            logger.warning(f"Event loop blocked for over {overdue * 1000:.0f}ms, loop thread is at:\n{stack}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"samples": self.samples, "max_lag_ms": round(self.max_lag_seconds * 1000, 1), "recent_stalls": len(self.stalls)}
+
+    def recent_stalls(self) -> List[Dict[str, Any]]:
+        return list(self.stalls)
@@ -0,0 +1,96 @@
+"""Keyset (cursor) pagination shared by the list endpoints.
+
+A sort is a list of ``{"field": ..., "order": "asc"|"desc"}`` dicts, as built by the routers'
+``simple_sort`` mappers. ``with_tiebreak`` appends the row id so the order is total, the
+cursor carries the sort mode plus the last row's values for every sort field, and the next
+page is everything strictly after that row. Unlike LIMIT/OFFSET nothing is scanned and
+discarded, and pages don't shift when rows are inserted ahead of the reader.
+
+Queries select the id as ``row_id`` so the cursor can be built; ``page_response`` strips it.
+"""
+
+import base64
+import datetime
+import json
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+
+ROW_ID = "row_id"
+
+
+def json_default(value: Any) -> Any:
+    """``json.dumps`` fallback for the column types psycopg hands back (NUMERIC, timestamps, intervals, uuids)."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def with_tiebreak(sort_fields: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    if sort_fields[-1]["field"] == "id":
+        return sort_fields
+    return sort_fields + [{"field": "id", "order": sort_fields[-1]["order"]}]
+
+
+def order_by(sort_fields: List[Dict[str, str]], table_alias: str) -> str:
+    order_by_fields = ", ".join([f"{table_alias}.{f['field']} {f['order']}" for f in sort_fields])
+    return f"ORDER BY {order_by_fields}"
+
+
+def encode_cursor(sort_by: str, values: List[Any]) -> str:
+    payload = json.dumps({"s": sort_by, "v": values}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_by: str, sort_fields: List[Dict[str, str]]) -> List[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = payload["v"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor is invalid")
+
+    if payload.get("s") != sort_by or len(values) != len(sort_fields):
+        raise HTTPException(status_code=400, detail="cursor does not match sortBy")
+    return values
+
+
+def keyset_condition(sort_fields: List[Dict[str, str]], table_alias: str, values: List[Any]) -> Tuple[str, Dict[str, Any]]:
+    """``(a, b, id) after (va, vb, vid)`` expanded so each column can sort in its own direction."""
+    params = {f"keyset_{i}": value for i, value in enumerate(values)}
+    clauses = []
+    for i, sort_field in enumerate(sort_fields):
+        equal_prefix = [f"{table_alias}.{f['field']} = %(keyset_{j})s" for j, f in enumerate(sort_fields[:i])]
+        operator = "<" if sort_field["order"] == "desc" else ">"
+        clauses.append(" AND ".join(equal_prefix + [f"{table_alias}.{sort_field['field']} {operator} %(keyset_{i})s"]))
+    return "(" + " OR ".join(f"({clause})" for clause in clauses) + ")", params
+
+
+def add_keyset(query: str, params: Dict[str, Any], sort_fields: List[Dict[str, str]], table_alias: str, cursor: str, sort_by: str) -> str:
+    condition, keyset_params = keyset_condition(sort_fields, table_alias, decode_cursor(cursor, sort_by, sort_fields))
+    params.update(keyset_params)
+    joiner = "AND" if re.search(r"\bwhere\b", query, re.IGNORECASE) else "WHERE"
+    return f"{query} {joiner} {condition}"
+
+
+def add_limit(query: str):
+    return f"{query} LIMIT %(limit)s"
+
+
+def page_response(records: List[Dict[str, Any]], sort_fields: List[Dict[str, str]], sort_by: str, page_size: int) -> Dict[str, Any]:
+    next_cursor: Optional[str] = None
+    if records and len(records) >= page_size:
+        last = records[-1]
+        next_cursor = encode_cursor(sort_by, [last[ROW_ID] if f["field"] == "id" else last[f["field"]] for f in sort_fields])
+
+    for record in records:
+        record.pop(ROW_ID, None)
+    return {"status": "SUCCESS", "data": json.dumps(records, default=json_default), "next_cursor": next_cursor}
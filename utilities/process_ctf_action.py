@@ -1,22 +1,23 @@
 import json
 import logging
-import os
 import re
+from dataclasses import dataclass
 from typing import Optional
 
-import redis
-import requests
+import redis.asyncio as aioredis
 
-from connectors.pgsql import PostgreSQLConnector
+from connectors.pgsql_async import AsyncPostgreSQLConnector
 from utilities.achievements import (
     Achievement,
+    AchievementCatalog,
+    AwardResult,
     StaffMember,
-    get_achievement_by_ctf_id_and_user_id,
-    get_random_staff_member,
-    insert_user_achievement,
+    unlock_achievement,
 )
-from utilities.events import log_event
-from utilities.users import User, get_user_by_device
+from utilities.auth_cache import TTLCache
+from utilities.events import queue_event
+from utilities.facts import FactPrefetcher
+from utilities.write_behind import WriteBehindBuffer
 
 
 class UserNotRegisteredException(Exception):
@@ -26,14 +27,15 @@ class UserNotRegisteredException(Exception):
 logger = logging.getLogger("s3logger")
 
 
-def get_registration_code(uuid, mac):
-    logger.info("Retrieving code by uuid and mac.")
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
+@dataclass(slots=True)
+class CtfServices:
+    """Everything a CTF award needs, built once at startup (``app.state.ctf``)."""
 
-    hash_in_rd = rd_con.get(f"{uuid}|{mac}")
-    logger.info(hash_in_rd)
-
-    return hash_in_rd
+    db_connection: AsyncPostgreSQLConnector
+    event_log: Optional[WriteBehindBuffer]
+    facts: FactPrefetcher
+    catalog: AchievementCatalog
+    held_achievements: TTLCache
 
 
 def replace_string_in_text(text, search_string, replacement_string):
@@ -41,73 +43,65 @@ def replace_string_in_text(text, search_string, replacement_string):
     return re.sub(regex, replacement_string, text)
 
 
-def get_fact():
-    url = "https://uselessfacts.jsph.pl/api/v2/facts/random"
-    response = requests.get(url)
-    try:
-        return response.json()
-    except Exception as e:
-        logger.error(e)
-
-
-def send_fact_to(db_connection: PostgreSQLConnector):
-    staff_member: StaffMember = get_random_staff_member(db_connection)
-    fact_dict = get_fact()
-    logger.info(fact_dict)
-    rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
+async def send_fact_to(rd_con: aioredis.Redis, facts: FactPrefetcher):
+    """Publish a prefetched fact, at most once a minute across all replicas."""
+    staff_member: Optional[StaffMember] = facts.random_staff_member()
+    fact = facts.take_fact()
+    logger.info(fact)
+    if fact is None or staff_member is None:
+        if fact is not None:
+            facts.return_fact(fact)
+        return
 
-    last_sent_fact = rd_con.get("last_sent_fact")
-    if last_sent_fact is None:
-        rd_con.set("last_sent_fact", fact_dict.get("text", "OOPS"), ex=60)  # TTL 1min
-        rd_con.publish(
+    if await rd_con.set("last_sent_fact", fact, ex=60, nx=True):  # TTL 1min
+        await rd_con.publish(
             "fact",
             json.dumps(
                 {
-                    "fact": fact_dict.get("text", "OOPS"),
+                    "fact": fact,
                     "discord_handle": staff_member.discord_handle,
                     "discord_user_id": staff_member.discord_user_id,
                 }
             ),
         )
+    else:
+        facts.return_fact(fact)
 
 
-def ctf_action(db_connection: PostgreSQLConnector, uuid: str, mac_address: str, event_id: int, achievement: Achievement):
+async def ctf_action(ctf: CtfServices, rd_con: aioredis.Redis, uuid: str, mac_address: str, event_id: int, achievement: Achievement):
+    achievement = ctf.catalog.resolve(achievement)
     message = f'Someone unlocked achievement: "{achievement.name}" but we don\'t know who... they should register their badge!'
     status = "SUCCESS"
 
     if uuid is not None and mac_address is not None:
-        r = log_event(db_connection, event_id, uuid, mac_address)
-        logger.info(f"Event logged {r}")
+        await queue_event(ctf.db_connection, ctf.event_log, event_id, uuid, mac_address)
         try:
-            user_record: Optional[User] = get_user_by_device(db_connection, uuid, mac_address)
-            if not user_record:
+            award: Optional[AwardResult] = await unlock_achievement(ctf.db_connection, ctf.held_achievements, uuid, mac_address, achievement.id)
+            if not award:
                 raise UserNotRegisteredException(f"User with badge: {uuid} | {mac_address} does not exist. They probably haven't registered yet.")
 
-            achievement_info = get_achievement_by_ctf_id_and_user_id(db_connection, user_record.id, achievement.id)
-            logger.info(achievement_info)
-            rd_con = redis.Redis(host=os.getenv("REDIS_HOST"), port=6379, db=0)
-            if achievement_info.user_has_achievement == 1:
+            logger.info(award)
+            if not award.newly_awarded:
                 achievement_name = achievement.name
                 if achievement_name == "Badge Access Point":
                     achievement_name = "[REDACTED]"
 
-                message = f"{user_record.discord_handle} has already unlocked: {achievement_name}"
-                rd_con.publish("community-message", message)
+                message = f"{award.discord_handle} has already unlocked: {achievement_name}"
+                await rd_con.publish("community-message", message)
             else:
-                message = f"{user_record.discord_handle} unlocked: {achievement.name} for {achievement.points} points!"
-                insert_user_achievement(db_connection, user_record.id, achievement.id)
-                rd_con.publish(
+                message = f"{award.discord_handle} unlocked: {achievement.name} for {achievement.points} points!"
+                await rd_con.publish(
                     "achievement",
                     json.dumps(
                         {
-                            "handle": user_record.discord_handle,
+                            "handle": award.discord_handle,
                             "name": achievement.name,
                             "description": achievement.description,
                             "points": achievement.points,
                         }
                     ),
                 )
-            send_fact_to(db_connection)
+            await send_fact_to(rd_con, ctf.facts)
         except UserNotRegisteredException as e:
             logger.error(f"{e.__class__.__name__} caught: {e}")
             status = "ERROR"
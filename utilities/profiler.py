@@ -0,0 +1,118 @@
+"""Wall-clock sampling profiler for a single request.
+
+``RequestProfiler`` runs a thread that wakes every ``interval_seconds`` and looks at the request's task:
+
+* if the task is running on the loop thread, the loop thread's stack (trimmed to the task's own frames)
+  is counted — time spent computing;
+* otherwise the task's suspended coroutine chain is counted with a trailing ``[awaiting]`` frame —
+  time spent waiting on postgres, redis, the threadpool or a lock.
+
+The result is a ``Counter`` of collapsed stacks (``frame;frame;frame count`` per line), which
+``flamegraph.pl`` and speedscope read directly. Nothing is traced per call, so the request pays only for
+the GIL hand-offs to the sampler thread. Code running in threadpool workers (plain ``def`` handlers,
+``asyncio.to_thread``) shows up as the ``[awaiting]`` frame of the await that is waiting on it.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+from typing import Any, List, Optional
+
+logger = logging.getLogger("s3logger")
+
+AWAITING_FRAME = "[awaiting]"
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def running_stack(frame: Optional[FrameType], root: Optional[FrameType]) -> List[str]:
+    """Labels from ``root`` down to ``frame``; the whole thread stack when ``root`` is not on it."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def suspended_stack(coro: Any) -> List[str]:
+    """Labels of a suspended coroutine and everything it is awaiting, outermost first."""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    labels.append(AWAITING_FRAME)
+    return labels
+
+
+class RequestProfiler:
+    def __init__(self, task: asyncio.Task, interval_seconds: float = 0.005, max_seconds: float = 30):
+        self.task = task
+        self.interval_seconds = interval_seconds
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._loop = task.get_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._root = getattr(task.get_coro(), "cr_frame", None)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stopped.wait(self.interval_seconds) and time.monotonic() < deadline:
+            try:
+                if asyncio.current_task(self._loop) is self.task:
+                    stack = running_stack(sys._current_frames().get(self._loop_thread_id), self._root)
+                else:
+                    stack = suspended_stack(self.task.get_coro())
+            except Exception:
+                # the loop thread moved on while we were walking its frames; skip this sample
+                continue
+            if stack:
+                self.stacks[";".join(stack)] += 1
+                self.samples += 1
+
+
+class ProfileSink:
+    """Writes collapsed stacks to ``directory``, and ships them to the log bucket when given an ``S3Uploader``."""
+
+    def __init__(self, directory: str, uploader=None):
+        self.directory = directory
+        self.uploader = uploader
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, request_id: str, stacks: Counter) -> str:
+        started = datetime.now()
+        file_name = f"{started:%Y%m%dT%H%M%S}-{request_id}.collapsed"
+        file_path = os.path.join(self.directory, file_name)
+        with open(file_path, "w") as profile:
+            for stack, count in stacks.most_common():
+                profile.write(f"{stack} {count}\n")
+
+        if self.uploader is not None:
+            s3_path = f"logs/conference=ckc/app={os.getenv('APP_NAME')}/kind=profile/date={started:%Y-%m-%d}/{file_name}"
+            self.uploader.submit(file_path, s3_path, compress=False)
+        return file_path
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from tracing import db_span, normalize_sql, set_row_count
+
+logger = logging.getLogger("s3logger")
+
+# latencies kept per statement for the percentiles; older samples fall off
+LATENCY_SAMPLES = 1024
+OVERFLOW_FINGERPRINT = "other"
+SORT_KEYS = ("total_ms", "p95_ms", "p99_ms", "count", "max_ms", "rows", "pool_wait_ms")
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(statement.encode()).hexdigest()[:12]
+
+
+def redact_args(args: Any) -> Any:
+    """Arg names and types only; badge ids, MACs and handles never reach the slow-query log."""
+    if isinstance(args, dict):
+        return {name: type(value).__name__ for name, value in args.items()}
+    if isinstance(args, list):
+        return f"{len(args)} parameter sets"
+    return None if args is None else type(args).__name__
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class StatementStats:
+    __slots__ = ("statement", "count", "errors", "rows", "total_ms", "max_ms", "pool_wait_ms", "latencies")
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.pool_wait_ms = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        return {
+            "fingerprint": fingerprint(self.statement),
+            "statement": self.statement,
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "mean_rows": self.rows / self.count if self.count else 0,
+            "total_ms": round(self.total_ms, 3),
+            "max_ms": round(self.max_ms, 3),
+            "pool_wait_ms": round(self.pool_wait_ms, 3),
+            "p50_ms": round(percentile(ordered, 0.5), 3),
+            "p95_ms": round(percentile(ordered, 0.95), 3),
+            "p99_ms": round(percentile(ordered, 0.99), 3),
+        }
+
+
+class QueryStats:
+    """Per-statement timing for both postgres connectors, keyed by the normalized SQL.
+
+    Latencies cover the statement only; time spent waiting for a pooled connection is kept apart in
+    ``pool_wait_ms`` so a saturated pool does not make every statement look slow.
+    Written from the event loop and from the sync connector's threadpool workers, so updates take a lock.
+    At most ``max_statements`` distinct statements are tracked; later ones are folded into ``other``.
+    """
+
+    def __init__(self, slow_query_ms: float = 100, max_statements: int = 500):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self._statements: Dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, slow_query_ms: float, max_statements: int):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+
+    def record(self, query: str, elapsed_ms: float, rows: Optional[int], args: Any = None, failed: bool = False, pool_wait_ms: float = 0.0):
+        statement = normalize_sql(query)
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    statement = OVERFLOW_FINGERPRINT
+                    stats = self._statements.get(statement)
+                if stats is None:
+                    stats = self._statements[statement] = StatementStats(statement)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.pool_wait_ms += pool_wait_ms
+            stats.latencies.append(elapsed_ms)
+            if failed:
+                stats.errors += 1
+            elif rows is not None and rows > 0:
+                stats.rows += rows
+
+        if elapsed_ms >= self.slow_query_ms:
+            logger.warning(
+                f"slow query fp={fingerprint(statement)} took={elapsed_ms:.1f}ms pool_wait={pool_wait_ms:.1f}ms rows={rows} failed={failed} "
+                f"statement={statement} args={redact_args(args)}",
+                extra={"log_policy_exempt": True},
+            )
+
+    def top(self, sort_by: str = "total_ms", limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            summaries = [stats.summary() for stats in self._statements.values()]
+        return sorted(summaries, key=lambda summary: summary[sort_by], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+
+
+query_stats = QueryStats()
+
+
+class QueryObservation:
+    __slots__ = ("span", "rows", "failed", "pool_wait_ms")
+
+    def __init__(self, span):
+        self.span = span
+        self.rows: Optional[int] = None
+        self.failed = False
+        self.pool_wait_ms = 0.0
+
+    def add_pool_wait(self, wait_ms: float):
+        """Time the connector spent acquiring a connection; taken out of the statement's latency."""
+        self.pool_wait_ms += wait_ms
+
+    def set_rows(self, rows: Any):
+        # cursor.rowcount is -1 when the driver can't tell
+        self.rows = len(rows) if isinstance(rows, list) else (rows if rows is not None and rows >= 0 else None)
+        set_row_count(self.span, rows)
+
+    def record_exception(self, exc: BaseException):
+        self.span.record_exception(exc)
+
+
+@contextmanager
+def observe_query(query: str, args: Any = None):
+    """Trace span plus ``query_stats`` timing around one statement (including its retries).
+
+    Connectors report each connection acquire through ``add_pool_wait``; it is recorded separately and
+    subtracted from the statement's latency.
+    """
+    with db_span(query) as span:
+        observation = QueryObservation(span)
+        start = time.perf_counter()
+        try:
+            yield observation
+        except BaseException:
+            observation.failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if span.is_recording():
+                span.set_attribute("db.pool_wait_ms", observation.pool_wait_ms)
+            query_stats.record(
+                query, max(elapsed_ms - observation.pool_wait_ms, 0.0), observation.rows, args, observation.failed, observation.pool_wait_ms
+            )
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from psycopg import DatabaseError, OperationalError
+
+from connectors.pgsql_async import AsyncPostgreSQLConnector
+
+logger = logging.getLogger("s3logger")
+
+AfterCommit = Callable[[Any], Awaitable[None]]
+PendingRow = Tuple[Dict[str, Any], Optional[asyncio.Future], Optional[AfterCommit]]
+
+
+class WriteBehindBuffer:
+    """Coalesces single-row writes of one statement and flushes them as a batch.
+
+    Rows are flushed through ``AsyncPostgreSQLConnector.execute_many`` once ``max_batch`` rows are
+    pending or ``max_delay_seconds`` after the first one arrived, whichever comes first. A batch is one
+    transaction, so when postgres rejects it (a foreign key miss, a bad value) it is replayed row by row
+    and only the offending rows fail.
+
+    ``durable=True``: ``write`` returns only after the row's batch has committed and hands back its
+    ``RETURNING`` value, so the caller sees exactly what the row-at-a-time path returned. That is the
+    first returned column, or the whole returned row as a tuple with ``whole_row=True``.
+    ``durable=False``: ``write`` returns ``None`` at once. ``after_commit`` still runs once the row has
+    committed, but the row is lost if the process dies first, and it is dropped when more than
+    ``max_pending`` rows are waiting.
+    """
+
+    def __init__(
+        self,
+        db_connection: AsyncPostgreSQLConnector,
+        query: str,
+        max_batch: int = 100,
+        max_delay_seconds: float = 0.05,
+        max_pending: int = 10000,
+        durable: bool = True,
+        whole_row: bool = False,
+    ):
+        self.db_connection = db_connection
+        self.query = query
+        self.max_batch = max_batch
+        self.max_delay_seconds = max_delay_seconds
+        self.max_pending = max_pending
+        self.durable = durable
+        self.whole_row = whole_row
+        self.flushed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending: List[PendingRow] = []
+        self._has_rows = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._callbacks: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher, then write out everything still pending."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        if self._callbacks:
+            await asyncio.gather(*self._callbacks, return_exceptions=True)
+
+    async def write(self, params: Dict[str, Any], after_commit: Optional[AfterCommit] = None) -> Optional[Any]:
+        if not self.durable:
+            self.put_nowait(params, after_commit)
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._append(params, future, None)
+        result = await future
+        if after_commit is not None:
+            await after_commit(result)
+        return result
+
+    def put_nowait(self, params: Dict[str, Any], after_commit: Optional[AfterCommit] = None) -> bool:
+        """Queue a row without waiting on it; returns False (and counts a drop) when the buffer is full."""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._append(params, None, after_commit)
+        return True
+
+    def _append(self, params: Dict[str, Any], future: Optional[asyncio.Future], after_commit: Optional[AfterCommit]):
+        self._pending.append((params, future, after_commit))
+        self._has_rows.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+
+    async def _run(self):
+        while True:
+            await self._has_rows.wait()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_delay_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch :]
+                if len(self._pending) < self.max_batch:
+                    self._batch_full.clear()
+                if not self._pending:
+                    self._has_rows.clear()
+                await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[PendingRow]):
+        try:
+            results = await self.db_connection.execute_many(self.query, [params for params, _, _ in batch], whole_row=self.whole_row)
+        except Exception as e:
+            # a statement error rolled the whole transaction back, so replaying the rows one by one is safe;
+            # connection or pool errors leave the outcome unknown (or would just fail again) and fail the batch
+            if len(batch) > 1 and isinstance(e, DatabaseError) and not isinstance(e, OperationalError):
+                logger.error(f"Write-behind batch of {len(batch)} rows failed, retrying row by row: {e}")
+                for row in batch:
+                    await self._write_row(row)
+                return
+            logger.error(f"Write-behind batch of {len(batch)} rows failed: {e}")
+            for row in batch:
+                self._fail(row, e)
+            return
+
+        for row, result in zip(batch, results):
+            self._commit(row, result)
+
+    async def _write_row(self, row: PendingRow):
+        try:
+            result = await self.db_connection.execute(self.query, row[0], whole_row=self.whole_row)
+        except Exception as e:
+            logger.error(f"Write-behind row failed: {e}")
+            self._fail(row, e)
+            return
+        self._commit(row, result)
+
+    def _fail(self, row: PendingRow, error: Exception):
+        self.failed += 1
+        _, future, _ = row
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def _commit(self, row: PendingRow, result: Any):
+        self.flushed += 1
+        _, future, after_commit = row
+        if future is not None and not future.done():
+            future.set_result(result)
+        if after_commit is not None:
+            task = asyncio.create_task(self._after_commit(after_commit, result))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    @staticmethod
+    async def _after_commit(after_commit: AfterCommit, result: Any):
+        try:
+            await after_commit(result)
+        except Exception as e:
+            logger.error(f"Write-behind after-commit hook failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"depth": len(self._pending), "flushed": self.flushed, "failed": self.failed, "dropped": self.dropped}
+
+
+async def insert_returning(
+    db_connection: AsyncPostgreSQLConnector,
+    buffer: Optional[WriteBehindBuffer],
+    query: str,
+    params: Dict[str, Any],
+    after_commit: AfterCommit,
+) -> Optional[Any]:
+    """Run ``query`` (an ``INSERT ... RETURNING id, ...``) through ``buffer`` when write-behind is on, otherwise directly.
+
+    Returns the whole returned row as a tuple (``buffer`` must be built with ``whole_row=True``), and ``after_commit``
+    gets that row once it is committed, however the write was made.
+    """
+    if buffer is not None:
+        return await buffer.write(params, after_commit)
+
+    row = await db_connection.execute(query=query, args=params, whole_row=True)
+    await after_commit(row)
+    return row